@@ -0,0 +1,93 @@
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable, Optional, Tuple
+
+# ==============================================================================
+# MEMOIZING ALLOCATION CACHE
+# ==============================================================================
+# Most accounts share a few hundred (level, risk, satellite classes)
+# combinations. Results are cached under a canonical key whose first element
+# is a fingerprint of the rules; when a lookup arrives with a different
+# fingerprint the cache drops everything it holds.
+
+def rules_fingerprint(pl_dicts, reduction_table: dict, tree: Optional[dict] = None) -> str:
+    """Stable hash of the PL tables, reduction_table and (optionally) the tree."""
+    payload = json.dumps([[[n, pl] for n, pl in pl_dicts], reduction_table, tree],
+                         sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+def satellite_key(satellite_classes: Iterable[str]) -> Tuple[str, ...]:
+    """Satellite classes normalized into a sorted tuple (duplicates kept)."""
+    return tuple(sorted(satellite_classes))
+
+
+class AllocationCache:
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.fingerprint: Optional[str] = None
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._rules: Optional[tuple] = None  # (pl_dicts, reduction_table, tree, fingerprint) last seen
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def fingerprint_of(self, pl_dicts, reduction_table: dict, tree: Optional[dict] = None) -> str:
+        """
+        rules_fingerprint of the given rule objects, hashed again only when
+        other objects arrive. Like compile_tree, it goes by identity: tables
+        changed in place are not noticed, so pass new objects after an edit.
+        """
+        r = self._rules
+        if r is None or r[0] is not pl_dicts or r[1] is not reduction_table or r[2] is not tree:
+            r = self._rules = (pl_dicts, reduction_table, tree, rules_fingerprint(pl_dicts, reduction_table, tree))
+        return r[3]
+
+    def _check(self, fingerprint: str):
+        if fingerprint != self.fingerprint:
+            if self._data:
+                self.invalidations += 1
+            self._data.clear()
+            self.fingerprint = fingerprint
+
+    def get(self, fingerprint: str, key: Hashable, default=None):
+        self._check(fingerprint)
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, fingerprint: str, key: Hashable, value):
+        self._check(fingerprint)
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(self, fingerprint: str, key: Hashable, compute: Callable[[], Any]):
+        value = self.get(fingerprint, key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(fingerprint, key, value)
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions, "invalidations": self.invalidations,
+        }
+
+
+_MISSING = object()
@@ -0,0 +1,90 @@
+from typing import Iterator, List, Optional
+
+# ==============================================================================
+# STRUCTURED ALLOCATION TRACE
+# ==============================================================================
+# Allocators take an optional `trace`. With none given they record nothing and
+# format nothing; with one, every decision is appended as a plain tuple and
+# the narrative text is only built when render() is called.
+
+GROUP, SATELLITE, SKIP = "group", "satellite", "skip"
+
+_FIELDS = {
+    GROUP: ("core_class", "core_fund", "budget", "reduction_pct", "headroom"),
+    SATELLITE: ("fund", "asset_class", "parent_class", "core_class", "leaf_limit", "leaf_source",
+                "share", "allocated", "binding", "capped_by"),
+    SKIP: ("subject", "reason"),
+}
+
+
+def binding_constraint(allocated: float, leaf_limit: float, share: float) -> str:
+    """'leaf' if the leaf limit capped the satellite, 'headroom' if its share of
+    the headroom did, 'none' if it got nothing. Cascading allocators also
+    record 'cap' when an intermediate class's cap did."""
+    if allocated <= 0:
+        return "none"
+    if allocated >= leaf_limit and leaf_limit < share:
+        return "leaf"
+    return "headroom"
+
+
+class AllocationTrace:
+    __slots__ = ("events",)
+
+    def __init__(self):
+        self.events: List[tuple] = []
+
+    def group(self, core_class: str, core_fund: Optional[str], budget: float, reduction_pct: float, headroom: float):
+        self.events.append((GROUP, core_class, core_fund, budget, reduction_pct, headroom))
+
+    def satellite(self, fund: str, asset_class: str, parent_class: Optional[str], core_class: str,
+                  leaf_limit: float, leaf_source: Optional[str], share: float, allocated: float,
+                  binding: Optional[str] = None, capped_by: Optional[str] = None):
+        """capped_by: the intermediate class whose cap bound the satellite (binding 'cap'), if any."""
+        if binding is None:
+            binding = "cap" if capped_by else binding_constraint(allocated, leaf_limit, share)
+        self.events.append((SATELLITE, fund, asset_class, parent_class, core_class, leaf_limit,
+                            leaf_source, share, allocated, binding, capped_by))
+
+    def skip(self, subject: str, reason: str):
+        self.events.append((SKIP, subject, reason))
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def records(self) -> Iterator[dict]:
+        """Events as dicts, built on demand."""
+        for e in self.events:
+            yield dict(zip(("event",) + _FIELDS[e[0]], e))
+
+    def satellites(self) -> Iterator[dict]:
+        return (r for r in self.records() if r["event"] == SATELLITE)
+
+    def render(self) -> str:
+        """Narrative text of the recorded decisions."""
+        lines = ["=" * 24 + " ALLOCATION PLAN " + "=" * 25]
+        for r in self.records():
+            kind = r["event"]
+            if kind == GROUP:
+                held = f" (held by '{r['core_fund']}')" if r["core_fund"] else ""
+                lines.append(f"\nSatellites will draw from the '{r['core_class']}' budget{held}.")
+                lines.append(f"  - Available satellite headroom: {r['headroom']:.2f}% "
+                             f"({r['reduction_pct']:g}% of {r['budget']:.2f}%)")
+            elif kind == SATELLITE:
+                child = (f" (as child of {r['core_class']})"
+                         if r["parent_class"] == r["core_class"] != r["asset_class"] else "")
+                source = f" from {r['leaf_source']}" if r["leaf_source"] else ""
+                lines.append(f"  - Adding '{r['fund']}' (class {r['asset_class']}{child}) with a leaf limit "
+                             f"of {r['leaf_limit']:.2f}%{source}: allocated {r['allocated']:.2f}%.")
+                if r["binding"] == "leaf":
+                    lines.append(f"      └── Limited by its leaf limit of {r['leaf_limit']:.2f}%")
+                elif r["binding"] == "headroom":
+                    lines.append(f"      └── Limited by its share of headroom ({r['share']:.2f}%)")
+                elif r["binding"] == "cap":
+                    lines.append(f"      └── Limited by the cap on satellites under {r['capped_by']}")
+                else:
+                    lines.append("      └── No headroom left for it")
+            else:
+                lines.append(f"\nSkipping {r['subject']}: {r['reason']}")
+        lines.append("=" * 65)
+        return "\n".join(lines)
@@ -0,0 +1,120 @@
+import io
+import logging
+from collections import defaultdict
+
+from catalog import FundCatalog, LoadReport, catalog_class_lookup, iter_fund_rows, load_catalog_snapshot
+from holdings import Overlay
+from leaflimits import leaf_limit_table
+
+log = logging.getLogger(__name__)
+
+# ==============================================================================
+# 1. DATA LOADING FUNCTION
+# ==============================================================================
+def load_funds_from_csv(file_content=None, path=None, snapshot=False):
+    """
+    Load the catalog from a string or, streaming, from a file on disk. With
+    snapshot=True a file is parsed once and reused from a pickled snapshot.
+    Progress and the load summary go to this module's logger.
+    """
+    log.info("--- Inspecting Fund Data ---")
+    report = LoadReport()
+    try:
+        if path is not None and snapshot:
+            funds_catalog, report = load_catalog_snapshot(path)
+        elif path is not None:
+            with open(path, newline="", encoding="utf-8") as f:
+                funds_catalog = FundCatalog(iter_fund_rows(f, report))
+        else:
+            funds_catalog = FundCatalog(iter_fund_rows(io.StringIO(file_content), report))
+    except Exception as e:
+        log.error("FATAL: Could not read or process the fund data. Error: %s", e)
+        return None
+    log.info("%s", report.summary())
+    log.info("Successfully loaded and processed %d funds.", len(funds_catalog))
+    return funds_catalog
+
+# ==============================================================================
+# 2. CORE LOGIC & HELPERS
+# ==============================================================================
+def find_leaf_PL(pl_dicts, asset_class):
+    name = leaf_limit_table(pl_dicts).source_of(asset_class)
+    if name is None:
+        return None, None
+    return name, dict(pl_dicts)[name]
+
+def allocate_funds_within_budget(initial_funds, satellites_to_add, reduction_table, pl_dicts, risk_index, funds_catalog, trace=None,
+                                 names=None):
+    """
+    `names`, an optional nameindex.NameIndex over the catalog, resolves
+    satellite names that are not in it verbatim; names it cannot resolve to
+    one fund are skipped (and traced) instead of silently dropped.
+
+    The returned portfolio is an Overlay on initial_funds: it holds only the
+    satellites and the core entries they draw down, and reads the rest
+    through, so initial_funds (often a core shared by many accounts) must not
+    change while it is in use.
+    """
+    final_portfolio = Overlay(initial_funds)
+    allocation_details = []
+    class_of = catalog_class_lookup(funds_catalog)
+    leaves = leaf_limit_table(pl_dicts)
+
+    # First core fund listed for each class.
+    core_by_class = {}
+    for name in initial_funds:
+        core_by_class.setdefault(class_of(name), name)
+
+    sats_by_class = defaultdict(list)
+    for fund_name in satellites_to_add:
+        asset_class = class_of(fund_name)
+        if not asset_class and names is not None:
+            resolved = names.resolve(fund_name)
+            if resolved.best is None:
+                if trace is not None:
+                    trace.skip(fund_name, resolved.reason)
+                continue
+            fund_name, asset_class = resolved.best.name, resolved.best.asset_class
+        if asset_class:
+            sats_by_class[asset_class].append({"name": fund_name})
+
+    for asset_class, satellites in sats_by_class.items():
+        core_fund_name = core_by_class.get(asset_class)
+        class_budget = initial_funds[core_fund_name]["alloc"] if core_fund_name else 0
+        if not core_fund_name:
+            if trace is not None:
+                trace.skip(asset_class, "no core fund for this asset class.")
+            continue
+        
+        reduction_pct = reduction_table.get(asset_class, 0)
+        headroom_to_distribute = class_budget * (reduction_pct / 100)
+        if trace is not None:
+            trace.group(asset_class, core_fund_name, class_budget, reduction_pct, headroom_to_distribute)
+
+        leaf_source, leaf_limit = leaves.lookup(asset_class, risk_index)
+        for sat in satellites:
+            sat["leaf_limit"] = leaf_limit
+
+        sorted_sats = sorted(satellites, key=lambda x: x["leaf_limit"])
+        num_remaining_sats = len(sorted_sats)
+        for sat_info in sorted_sats:
+            if num_remaining_sats <= 0 or headroom_to_distribute <= 1e-9:
+                sat_info["allocated"] = 0; continue
+            equal_share = headroom_to_distribute / num_remaining_sats
+            allocation = min(sat_info["leaf_limit"], equal_share)
+            sat_info["allocated"] = allocation
+            sat_info["share"] = equal_share
+            headroom_to_distribute -= allocation
+            num_remaining_sats -= 1
+
+        for sat_info in sorted_sats:
+            alloc = sat_info["allocated"]
+            if trace is not None:
+                trace.satellite(sat_info["name"], asset_class, asset_class, asset_class, leaf_limit,
+                                leaf_source, sat_info.get("share", 0.0), alloc)
+            if alloc > 0:
+                final_portfolio[sat_info["name"]] = {"alloc": alloc}
+                final_portfolio.own(core_fund_name)["alloc"] -= alloc
+            allocation_details.append({"fund_name": sat_info["name"], "asset_class": asset_class, "allocated": alloc, "drew_from": core_fund_name})
+            
+    return final_portfolio, allocation_details
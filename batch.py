@@ -0,0 +1,298 @@
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from hierarchy import compile_tree
+from leaflimits import leaf_limit_table
+
+# ==============================================================================
+# DENSE MODEL TABLES
+# ==============================================================================
+# PL2/PL3/PL4 are stacked into one (level x class x risk) array over a shared
+# class index, so a whole book of portfolios can be allocated at every risk
+# level in a handful of array operations instead of one dict at a time.
+
+REDUCTION_DEN = 10_000  # reduction percentages are exact to 1/REDUCTION_DEN of a percent in unit mode
+
+
+def largest_remainder(scaled: np.ndarray, axis: int = 0, total=None) -> np.ndarray:
+    """
+    Round to integers along `axis` so every slice sums to `total` (default:
+    its own rounded sum). Everything is floored, then the largest remainders
+    get one more; a slice already over its total loses one from its smallest
+    remainders instead. Zeros stay zero while anything else can take up the
+    difference. Ties go to the lower index, so the result depends on nothing
+    but the input.
+    """
+    scaled = np.round(scaled, 9)  # 2.64 * 100 is 263.99999999999997
+    floor = np.floor(scaled)
+    rem = scaled - floor
+    if total is None:
+        total = np.round(scaled.sum(axis=axis, keepdims=True))
+    short = (total - floor.sum(axis=axis, keepdims=True)).astype(np.int64)
+    shape = [1] * scaled.ndim
+    shape[axis] = scaled.shape[axis]
+    steps = np.arange(scaled.shape[axis]).reshape(shape)
+
+    def rank(key):
+        r = np.empty(key.shape, dtype=np.int64)
+        np.put_along_axis(r, np.argsort(key, axis=axis, kind="stable"), steps, axis=axis)
+        return r
+
+    out = floor.astype(np.int64) + (rank(np.where(scaled != 0, -rem, 1.0)) < short)
+    if (short < 0).any():
+        out -= rank(np.where(floor > 0, rem, 2.0)) < -short
+    return out
+
+
+class UnitTables(NamedTuple):
+    """A LevelMatrix in integer units: `scale` units make one percentage point."""
+    scale: int
+    values: np.ndarray     # (level x class x risk) int64; every column keeps its total
+    leaf: np.ndarray       # (class x risk) int64
+    reduction: np.ndarray  # (class,) int64, in 1/REDUCTION_DEN of a percent
+
+
+class LevelMatrix:
+    def __init__(self, pl_dicts: List[Tuple[str, dict]], reduction_table: dict, tree: dict, num_risks: int = 7):
+        h = compile_tree(tree)
+        names = list(h.names)
+        for _, pl in pl_dicts:
+            names.extend(n for n in pl if n not in h.index)
+        self.classes: List[str] = list(dict.fromkeys(names))
+        self.index: Dict[str, int] = {n: i for i, n in enumerate(self.classes)}
+        self.levels: List[str] = [name for name, _ in pl_dicts]
+        self.level_index: Dict[str, int] = {n: i for i, n in enumerate(self.levels)}
+        L, C, R = len(self.levels), len(self.classes), num_risks
+
+        self.values = np.zeros((L, C, R))
+        self.present = np.zeros((L, C), dtype=bool)
+        for li, (_, pl) in enumerate(pl_dicts):
+            for n, allocs in pl.items():
+                row = list(allocs)[:R]
+                self.values[li, self.index[n], :len(row)] = row
+                self.present[li, self.index[n]] = True
+
+        # Leaf limit = value from the most detailed level that has the class.
+        leaves = leaf_limit_table(pl_dicts)
+        self.leaf = np.zeros((C, R))
+        self.leaf_level = np.full(C, -1)
+        for n in leaves.index:
+            row = leaves.row(n)[:R]
+            self.leaf[self.index[n], :len(row)] = row
+            self.leaf_level[self.index[n]] = self.level_index[leaves.source_of(n)]
+
+        self.reduction = np.array([reduction_table.get(n, 0) for n in self.classes], dtype=float)
+
+        # parent[l, r, c]: nearest ancestor-or-self of c held as a core class
+        # (present and > 0) in level l at risk r, or -1.
+        chains = []
+        for n in self.classes:
+            chain = h.ancestors(n, include_self=True) if n in h.index else [n]
+            chains.append([self.index[a] for a in chain])
+        held = self.present[:, :, None] & (self.values > 0)
+        self.parent = np.full((L, R, C), -1)
+        for c, chain in enumerate(chains):
+            for a in reversed(chain):
+                hit = held[:, a, :]
+                self.parent[:, :, c][hit] = a
+        # chains[c]: c and its ancestors, nearest first, padded with -1.
+        self.chains = np.full((C, max(map(len, chains), default=1)), -1)
+        for c, chain in enumerate(chains):
+            self.chains[c, :len(chain)] = chain
+        self._units: Dict[int, UnitTables] = {}
+
+    def units(self, scale: int = 100) -> UnitTables:
+        """The tables in integer units, scale=100 being basis points. Cached per scale."""
+        u = self._units.get(scale)
+        if u is None:
+            # Every column is meant to hold 100%, so it is rounded to exactly that.
+            values = largest_remainder(np.where(self.present[:, :, None], self.values, 0.0) * scale, axis=1,
+                                       total=100 * scale)
+            has = self.leaf_level >= 0
+            leaf = np.zeros(self.leaf.shape, dtype=np.int64)
+            leaf[has] = values[self.leaf_level[has], np.flatnonzero(has)]
+            reduction = np.round(self.reduction * REDUCTION_DEN).astype(np.int64)
+            u = self._units[scale] = UnitTables(scale, values, leaf, reduction)
+        return u
+
+    def parent_of(self, levels: np.ndarray, risks: np.ndarray, s: np.ndarray, held: Optional[np.ndarray] = None,
+                  include_self: bool = True) -> np.ndarray:
+        """
+        (E x risk) core class each satellite entry of class `s[e]` in a
+        portfolio at `levels[e]` draws from, -1 where none is held.
+        `held[e]` (E x class bool) limits the core to the classes a portfolio
+        holds a fund for. include_self=False skips the class itself and looks
+        only at strict ancestors, as pl2's find_satellite_parent does.
+        """
+        if held is None:
+            if not include_self:
+                up = self.chains[s, 1] if self.chains.shape[1] > 1 else np.full(len(s), -1)
+                found = self.parent[levels[:, None], risks[None, :], np.where(up >= 0, up, 0)[:, None]]
+                return np.where(up[:, None] >= 0, found, -1)
+            return self.parent[levels[:, None], risks[None, :], s[:, None]]
+        chain = self.chains[s] if include_self else self.chains[s, 1:]
+        if chain.shape[1] == 0:
+            return np.full((len(s), len(risks)), -1)
+        a = np.where(chain >= 0, chain, 0)
+        ok = (chain >= 0) & np.take_along_axis(held, a, axis=1) & self.present[levels[:, None], a]
+        ok = ok[:, :, None] & (self.values[levels[:, None, None], a[:, :, None], risks[None, None, :]] > 0)
+        nearest = np.take_along_axis(chain, ok.argmax(axis=1), axis=1)
+        return np.where(ok.any(axis=1), nearest, -1)
+
+    def encode(self, levels: Sequence[str], satellites: Sequence[Sequence[str]]):
+        """Turn level names and satellite class lists into batch arrays."""
+        lv = np.array([self.level_index[n] for n in levels], dtype=np.int64)
+        counts = np.zeros((len(levels), len(self.classes)), dtype=np.int64)
+        for p, sats in enumerate(satellites):
+            for s in sats:
+                counts[p, self.index[s]] += 1
+        return lv, counts
+
+
+# ==============================================================================
+# BATCH ALLOCATION
+# ==============================================================================
+class BatchResult:
+    """Sparse satellite entries, one row per (portfolio, satellite class).
+
+    `allocation`, `leaf_limit`, `share` and `parent` are (entries x risk);
+    `allocation` is the weight of a single fund of that class. With a unit
+    scale they are int64 counts of 1/scale of a percentage point.
+    """
+
+    def __init__(self, matrix, levels, risks, portfolio, sat_class, count, parent, leaf_limit, allocation, share,
+                 scale=None, held=None):
+        self.matrix, self.levels, self.risks, self.scale, self.held = matrix, levels, risks, scale, held
+        self.portfolio, self.sat_class, self.count = portfolio, sat_class, count
+        self.parent, self.leaf_limit = parent, leaf_limit
+        self.allocation, self.share = allocation, share
+
+    @property
+    def leaf_bound(self) -> np.ndarray:
+        return (self.allocation > 0) & (self.allocation >= self.leaf_limit) & (self.leaf_limit < self.share)
+
+    def core_allocations(self) -> np.ndarray:
+        """Dense (portfolio x class x risk) core weights after satellites drew from them."""
+        m = self.matrix
+        values = (m.values if self.scale is None else m.units(self.scale).values)[self.levels][:, :, self.risks]
+        present = m.present[self.levels] if self.held is None else m.present[self.levels] & self.held
+        core = np.where(present[:, :, None] & (values > 0), values, 0)
+        e, r = np.nonzero(self.parent >= 0)
+        np.subtract.at(core, (self.portfolio[e], self.parent[e, r], r), (self.allocation * self.count[:, None])[e, r])
+        return core
+
+    def totals(self) -> np.ndarray:
+        """
+        (portfolio x risk) sum of core and satellite weights; exactly 100 *
+        scale in unit mode for portfolios that hold every class of their level.
+        """
+        total = self.core_allocations().sum(axis=1)
+        np.add.at(total, self.portfolio, self.allocation * self.count[:, None])
+        return total
+
+
+def allocate_batch(matrix: LevelMatrix, levels: np.ndarray, counts: np.ndarray,
+                   risks: Optional[Sequence[int]] = None, method: str = "waterfill",
+                   scale: Optional[int] = None, held: Optional[np.ndarray] = None) -> BatchResult:
+    """
+    Allocate satellites for a batch of portfolios at several risk levels at once.
+    - levels: (P,) level index per portfolio; counts: (P, C) satellite funds per class
+    - method 'waterfill' equal-shares the headroom capped by leaf limits, like
+      Portfolio.add_satellites: a satellite draws from the nearest held class
+      that is its own class or an ancestor of it. allocate_funds_within_budget
+      agrees where that is the satellite's own class; it never looks further up.
+    - method 'greedy' fills the smallest leaf limits first from the nearest held
+      strict ancestor, like split_reduction_with_leaf_limits, so a satellite of
+      a class the core holds draws from that class's parent, not from itself.
+    - scale: run in int64 units of 1/scale of a percentage point (100 for basis
+      points). The tables are rounded by largest remainder, water levels are
+      floored and the unused units stay with the core, so no epsilon is needed
+      and every portfolio adds up to exactly 100 * scale.
+    - held: (P, C) bool, the core classes each portfolio holds a fund for, as
+      Portfolio.build_from_level takes them; default every class of its level.
+    """
+    p, s = np.nonzero(counts)
+    return allocate_entries(matrix, levels, p, s, counts[p, s], risks, method, scale, held)
+
+
+def allocate_entries(matrix: LevelMatrix, levels: np.ndarray, p: np.ndarray, s: np.ndarray, count: np.ndarray,
+                     risks: Optional[Sequence[int]] = None, method: str = "waterfill",
+                     scale: Optional[int] = None, held: Optional[np.ndarray] = None) -> BatchResult:
+    """
+    allocate_batch over sparse satellite entries: `count[e]` funds of class
+    `s[e]` in portfolio `p[e]`, each (p, s) at most once. Books with many
+    classes never need the dense (portfolio x class) counts.
+    """
+    if method not in ("waterfill", "greedy"):
+        raise ValueError(f"Unknown method '{method}'.")
+    risks = np.arange(matrix.values.shape[2]) if risks is None else np.asarray(risks)
+    if method == "greedy" and (count > 1).any():
+        raise ValueError("Greedy allocation takes at most one fund per satellite class.")
+    levels = np.asarray(levels, dtype=np.int64)
+    R = len(risks)
+    E = len(p)
+    parent = matrix.parent_of(levels[p], risks, s, None if held is None else held[p],
+                              include_self=method == "waterfill")  # (E, R)
+    placed = parent >= 0
+    g = np.where(placed, parent, 0)
+    if scale is None:
+        n = count.astype(float)
+        lim = matrix.leaf[s][:, risks]
+        budget = matrix.values[levels[p][:, None], g, risks[None, :]]
+        headroom = np.where(placed, budget * matrix.reduction[g] / 100, 0.0)
+    else:
+        u = matrix.units(scale)
+        n = count.astype(np.int64)
+        lim = u.leaf[s][:, risks]
+        budget = u.values[levels[p][:, None], g, risks[None, :]]
+        headroom = np.where(placed, budget * u.reduction[g] // (100 * REDUCTION_DEN), 0)
+
+    # Flatten to one row per (entry, risk) and sort by group then leaf limit.
+    # Unplaced satellites get their own group id C so they never share headroom.
+    C = len(matrix.classes)
+    key = ((p[:, None] * (C + 1) + np.where(placed, g, C)) * R + np.arange(R)[None, :]).ravel()
+    fl_lim, fl_n, fl_h = lim.ravel(), np.repeat(n, R), headroom.ravel()
+    order = np.lexsort((fl_lim, key))
+    k, l, c, H = key[order], fl_lim[order], fl_n[order], fl_h[order]
+    start = np.ones(len(k), dtype=bool)
+    start[1:] = k[1:] != k[:-1]
+    starts = np.flatnonzero(start)
+    gid = np.cumsum(start) - 1
+
+    # S: leaf weight of earlier rows in the group; N: funds from this row on.
+    w = c * l
+    cw = np.cumsum(w)
+    S = cw - w - (cw - w)[starts][gid]
+    cn = np.cumsum(c)
+    total_n = np.add.reduceat(c, starts) if len(c) else c
+    N = total_n[gid] - (cn - c - (cn - c)[starts][gid])
+
+    if method == "waterfill":
+        # Water level: the headroom left once every smaller limit is filled,
+        # shared by the remaining funds. Taken at the first row where that share
+        # no longer exceeds the row's own limit.
+        feasible = S + N * l >= H
+        if scale is None:
+            cand = np.where(feasible, (H - S) / N, -np.inf)
+            level = np.maximum.reduceat(cand, starts) if len(cand) else cand
+            level = np.where(np.isneginf(level), np.inf, level)[gid]
+        else:
+            lo, hi = np.iinfo(np.int64).min, np.iinfo(np.int64).max
+            cand = np.where(feasible, (H - S) // N, lo)
+            level = np.maximum.reduceat(cand, starts) if len(cand) else cand
+            level = np.where(level == lo, hi, level)[gid]
+        alloc = np.minimum(l, level)
+        share = level
+    else:
+        alloc = np.clip(H - S, 0, l)
+        share = np.maximum(H - S, 0)
+    alloc = np.where(H <= (1e-9 if scale is None else 0), 0, alloc)
+
+    out_alloc = np.empty_like(alloc)
+    out_share = np.empty_like(share)
+    out_alloc[order], out_share[order] = alloc, share
+    return BatchResult(
+        matrix, levels, risks, p, s, count, parent, lim,
+        out_alloc.reshape(E, R), out_share.reshape(E, R), scale, held,
+    )
@@ -0,0 +1,363 @@
+"""
+Allocator benchmarks.
+
+    python bench.py --out results.json
+    python bench.py --out new.json --compare results.json
+
+Generates a synthetic rule set (a tree of `fanout ** depth` leaf classes with
+one PL per tree depth), a catalog made of `test.csv` repeated `--catalog-copies`
+times and a batch of random portfolios. Every allocator variant runs over the
+same batch; each is timed `--repeat` times and then run once more under
+tracemalloc for its peak memory. Startup is timed in fresh interpreters
+working in a temporary copy of the modules: importing them and loading the
+rules, and loading the catalog cold (no snapshot) and warm.
+Results are written as JSON. With --compare,
+a table of ratios against an earlier run is printed to stderr, and the exit
+status is 1 if any variant got slower or heavier by more than --tolerance.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+from allocation_cache import AllocationCache
+from allocator import allocate_funds_within_budget
+from catalog import FundCatalog, LoadReport, load_catalog, load_funds_from_file
+from nameindex import NameIndex
+from portfolio import AllocationRules, Fund, Portfolio
+from snapshot import snapshot_path
+
+import pl2
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+NUM_RISKS = 7
+
+# ==============================================================================
+# 1. SYNTHETIC DATA
+# ==============================================================================
+def synthetic_rules(fanout: int, depth: int, seed: int = 0):
+    """
+    (pl_dicts, reduction_table, tree) for a full tree of the given fanout and
+    depth. Level PL{k+2} lists every class at tree depth k, and each class's
+    allocation is split among its children with random weights, so every
+    level's columns add up to 100 like the real tables.
+    """
+    rnd = random.Random(seed)
+    tree: Dict[str, dict] = {}
+    levels: List[Dict[str, List[float]]] = [{} for _ in range(depth)]
+    reduction_table: Dict[str, float] = {}
+
+    def split(total: List[float], n: int) -> List[List[float]]:
+        w = [[rnd.random() if rnd.random() > 0.1 else 0.0 for _ in range(NUM_RISKS)] for _ in range(n)]
+        col = [sum(x[r] for x in w) or 1.0 for r in range(NUM_RISKS)]
+        return [[round(total[r] * x[r] / col[r], 4) for r in range(NUM_RISKS)] for x in w]
+
+    stack = [("C", [100.0] * NUM_RISKS, tree, 0)]
+    while stack:
+        prefix, allocs, node, d = stack.pop()
+        if d == depth:
+            continue
+        for i, child in enumerate(split(allocs, fanout)):
+            name = f"{prefix}{i}" if d == 0 else f"{prefix}_{i}"
+            node[name] = {"children": {}} if d + 1 < depth else {}
+            levels[d][name] = child
+            reduction_table[name] = rnd.choice([10.0, 12.5, 25.0, 37.5, 50.0])
+            stack.append((name, child, node[name].get("children"), d + 1))
+    pl_dicts = [(f"PL{d + 2}", levels[d]) for d in range(depth)]
+    return pl_dicts, reduction_table, tree
+
+
+def synthetic_portfolios(pl_dicts, n: int, satellites: int, seed: int = 0) -> List[Tuple[str, int, List[str]]]:
+    """(level name, risk index, satellite classes) for n random portfolios."""
+    rnd = random.Random(seed + 1)
+    classes = sorted({c for _, pl in pl_dicts for c in pl})
+    names = [name for name, _ in pl_dicts]
+    return [(rnd.choice(names), rnd.randrange(NUM_RISKS), rnd.sample(classes, satellites)) for _ in range(n)]
+
+
+def synthetic_catalog(path: str, copies: int, source: str = os.path.join(HERE, "test.csv")):
+    """Write `source` repeated `copies` times, with names and ISINs kept unique."""
+    with open(source, encoding="utf-8") as f:
+        rows = [line.rstrip("\n").split(";") for line in f if line.strip()]
+    with open(path, "w", encoding="utf-8", newline="") as out:
+        for k in range(copies):
+            for name, isin, asset_class in rows:
+                out.write(f"{name} #{k};{isin[:2]}{k:06d}{isin[8:]};{asset_class}\n")
+
+# ==============================================================================
+# 2. VARIANTS
+# ==============================================================================
+# Each factory does the per-rule-set setup once and returns a function that
+# allocates one portfolio, so only the per-portfolio work is measured.
+
+def _core_pl(pl_dicts):
+    levels = dict(pl_dicts)
+    return lambda name, risk: pl2.core_template(levels[name], risk)
+
+
+def _pl2(fn_name: str):
+    def factory(pl_dicts, reduction_table, tree):
+        fn, core_pl = getattr(pl2, fn_name), _core_pl(pl_dicts)
+        if fn_name == "add_satellites":
+            finest = pl_dicts[-1][1]
+            return lambda lvl, risk, sats: fn(core_pl(lvl, risk), reduction_table, tree, finest, risk, sats)
+        return lambda lvl, risk, sats: fn(core_pl(lvl, risk), reduction_table, tree, pl_dicts, risk, sats)
+    return factory
+
+
+def _pl2_cached(pl_dicts, reduction_table, tree):
+    core_pl, cache = _core_pl(pl_dicts), AllocationCache()
+    return lambda lvl, risk, sats: pl2.split_reduction_with_leaf_limits_cached(
+        core_pl(lvl, risk), reduction_table, tree, pl_dicts, risk, sats, cache)
+
+
+def _portfolio(cached: bool):
+    def factory(pl_dicts, reduction_table, tree):
+        rules = AllocationRules(pl_dicts, reduction_table, tree)
+        core = {n: Fund(f"{n} Core", ac) for n, ac in rules.asset_classes.items()}
+        cache = AllocationCache() if cached else None
+
+        def run(lvl, risk, sats):
+            p = Portfolio.build_from_level("bench", lvl, risk, core, rules)
+            p.add_satellites([Fund(f"{c} Satellite", rules.asset_classes[c]) for c in sats], risk, cache=cache)
+            return p
+        return run
+    return factory
+
+
+def _budget(pl_dicts, reduction_table, tree):
+    levels = dict(pl_dicts)
+    catalog = FundCatalog((f"{c} {role}", "", c) for c in sorted({c for _, pl in pl_dicts for c in pl})
+                          for role in ("Core", "Satellite"))
+
+    def run(lvl, risk, sats):
+        initial = {f"{c} Core": {"alloc": a[risk]} for c, a in levels[lvl].items()}
+        return allocate_funds_within_budget(initial, [f"{c} Satellite" for c in sats],
+                                            reduction_table, pl_dicts, risk, catalog)
+    return run
+
+
+VARIANTS: Dict[str, Callable] = {
+    "pl2.split_reduction_among_satellites": _pl2("split_reduction_among_satellites"),
+    "pl2.add_satellites": _pl2("add_satellites"),
+    "pl2.add_satellites_dynamic": _pl2("add_satellites_dynamic"),
+    "pl2.split_reduction_with_leaf_limits": _pl2("split_reduction_with_leaf_limits"),
+    "pl2.split_reduction_with_leaf_limits+cache": _pl2_cached,
+    "pl2.split_reduction_cascading": _pl2("split_reduction_cascading"),
+    "Portfolio.add_satellites": _portfolio(cached=False),
+    "Portfolio.add_satellites+cache": _portfolio(cached=True),
+    "allocate_funds_within_budget": _budget,
+}
+
+# ==============================================================================
+# 3. MEASUREMENT
+# ==============================================================================
+def measure(fn: Callable[[], object], repeat: int) -> dict:
+    """Best and median wall time over `repeat` runs, then peak traced memory of one more."""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"best_s": min(times), "median_s": statistics.median(times), "peak_kib": peak / 1024}
+
+
+def bench_variants(rules, portfolios, repeat: int, only=None) -> List[dict]:
+    out = []
+    for name, factory in VARIANTS.items():
+        if only and name not in only:
+            continue
+        run = factory(*rules)
+        run(*portfolios[0])  # build the lazily cached hierarchy and leaf tables outside the timing
+        r = measure(lambda: [run(lvl, risk, sats) for lvl, risk, sats in portfolios], repeat)
+        r.update(name=name, kind="allocator", items=len(portfolios), per_item_us=r["best_s"] / len(portfolios) * 1e6)
+        out.append(r)
+
+    if not only or "validation.validate_levels" in only:
+        from validation import validate_levels
+        r = measure(lambda: validate_levels(rules[0], rules[2]), repeat)
+        r.update(name="validation.validate_levels", kind="validation", items=1, per_item_us=r["best_s"] * 1e6)
+        out.append(r)
+
+    if not only or any(n.startswith("batch.allocate_batch") for n in only):
+        from batch import LevelMatrix, allocate_batch  # numpy is optional for the other variants
+        matrix = LevelMatrix(*rules)
+        lv, counts = matrix.encode([p[0] for p in portfolios], [p[2] for p in portfolios])
+        matrix.units(100)  # converted once per rule set, like the float tables
+        # One call allocates every risk level, so it covers NUM_RISKS times the work.
+        for name, scale in (("batch.allocate_batch", None), ("batch.allocate_batch[bp]", 100)):
+            if only and name not in only:
+                continue
+            r = measure(lambda: allocate_batch(matrix, lv, counts, scale=scale), repeat)
+            r.update(name=name, kind="allocator", items=len(portfolios),
+                     per_item_us=r["best_s"] / len(portfolios) * 1e6)
+            out.append(r)
+    return out
+
+
+def bench_catalog(copies: int, repeat: int, only=None) -> List[dict]:
+    out = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "catalog.csv")
+        synthetic_catalog(path, copies)
+        with open(path, encoding="utf-8") as f:
+            rows = sum(1 for _ in f)
+        for name, fn in (("catalog.load_catalog", lambda: load_catalog(path, LoadReport())),
+                         ("catalog.load_funds_from_file", lambda: load_funds_from_file(path, LoadReport()))):
+            if only and name not in only:
+                continue
+            r = measure(fn, repeat)
+            r.update(name=name, kind="catalog", items=rows, per_item_us=r["best_s"] / rows * 1e6)
+            out.append(r)
+        name = "catalog.nameindex.resolve"
+        if not only or name in only:
+            names = NameIndex(load_catalog(path, LoadReport()))
+            rnd = random.Random(0)
+            queries = []
+            for fund in rnd.sample(names.funds, 200):  # a dropped character, in lower case
+                i = rnd.randrange(len(fund))
+                queries.append((fund[:i] + fund[i + 1:]).lower())
+            r = measure(lambda: [names.resolve(q) for q in queries], repeat)
+            r.update(name=name, kind="catalog", items=len(queries), per_item_us=r["best_s"] / len(queries) * 1e6)
+            out.append(r)
+    return out
+
+
+STARTUP = "import pl2, portfolio, allocator, pldata; pldata.load_rules()"
+CATALOG_STARTUP = "import sys, catalog; catalog.load_catalog_snapshot(sys.argv[1])"
+
+
+def _sandbox(dest: str):
+    """Copy the modules and data files into dest, so runs there write their .pyc files and snapshots there."""
+    for name in os.listdir(HERE):
+        if name.endswith(".py"):
+            shutil.copy2(os.path.join(HERE, name), dest)
+    shutil.copytree(os.path.join(HERE, "data"), os.path.join(dest, "data"),
+                    ignore=shutil.ignore_patterns("__pycache__"))
+
+
+def bench_startup(copies: int, repeat: int, only=None) -> List[dict]:
+    """
+    Wall time of a fresh interpreter importing the modules and loading the
+    rules, and of one loading a catalog of `copies` test.csv copies without
+    its snapshot (cold) and with it (warm). Everything runs in a temporary
+    copy of the modules, so nothing in this tree is written or removed.
+    """
+    python_s = measure(lambda: subprocess.run([sys.executable, "-c", "pass"], check=True), repeat)["best_s"]
+    out = []
+    with tempfile.TemporaryDirectory() as tmp:
+        _sandbox(tmp)
+        path = os.path.join(tmp, "catalog.csv")
+        synthetic_catalog(path, max(copies, 1))
+        snap = snapshot_path(path, "catalog")
+        for name, code, cold in (("startup.import", [STARTUP], False),
+                                 ("startup.catalog.cold", [CATALOG_STARTUP, path], True),
+                                 ("startup.catalog.warm", [CATALOG_STARTUP, path], False)):
+            if only and name not in only:
+                continue
+            cmd = [sys.executable, "-c", *code]
+            subprocess.run(cmd, cwd=tmp, check=True)  # leaves .pyc files and the snapshot behind
+
+            def run():
+                if cold:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(snap)
+                subprocess.run(cmd, cwd=tmp, check=True)
+            r = measure(run, repeat)
+            r.update(python_s=python_s, name=name, kind="startup", items=1,
+                     per_item_us=(r["best_s"] - python_s) * 1e6)
+            out.append(r)
+    return out
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Print ratios against a baseline run; returns the names that regressed."""
+    old = {r["name"]: r for r in baseline["results"]}
+    regressed = []
+    print(f"{'benchmark':<42} {'time':>8} {'memory':>8}", file=sys.stderr)
+    for r in results["results"]:
+        b = old.get(r["name"])
+        if b is None:
+            print(f"{r['name']:<42} {'new':>8} {'new':>8}", file=sys.stderr)
+            continue
+        t = r["best_s"] / b["best_s"] if b["best_s"] else 1.0
+        m = r["peak_kib"] / b["peak_kib"] if b["peak_kib"] else 1.0
+        flag = ""
+        if t > 1 + tolerance or m > 1 + tolerance:
+            regressed.append(r["name"])
+            flag = "  REGRESSION"
+        print(f"{r['name']:<42} {t:>7.2f}x {m:>7.2f}x{flag}", file=sys.stderr)
+    return regressed
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Time and memory-profile every allocator variant.")
+    ap.add_argument("--fanout", type=int, default=12, help="children per class in the synthetic tree")
+    ap.add_argument("--depth", type=int, default=3, help="tree depth, also the number of PL levels")
+    ap.add_argument("--portfolios", type=int, default=2000)
+    ap.add_argument("--satellites", type=int, default=4, help="satellite classes per portfolio")
+    ap.add_argument("--catalog-copies", type=int, default=1000, help="times test.csv is repeated (0 skips the catalog benchmarks)")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--no-startup", action="store_true", help="skip the interpreter startup benchmarks")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--only", nargs="*", help="benchmark names to run (default: all)")
+    ap.add_argument("--out", help="JSON results file; stdout if omitted")
+    ap.add_argument("--compare", help="earlier JSON results to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown/growth ratio (0.10 = 10%%)")
+    args = ap.parse_args(argv)
+
+    rules = synthetic_rules(args.fanout, args.depth, args.seed)
+    portfolios = synthetic_portfolios(rules[0], args.portfolios, args.satellites, args.seed)
+    results = bench_variants(rules, portfolios, args.repeat, args.only)
+    if args.catalog_copies and (not args.only or any(n.startswith("catalog.") for n in args.only)):
+        results += bench_catalog(args.catalog_copies, args.repeat, args.only)
+    if not args.no_startup and (not args.only or any(n.startswith("startup.") for n in args.only)):
+        results += bench_startup(args.catalog_copies, args.repeat, args.only)
+
+    report = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "classes": sum(len(pl) for _, pl in rules[0]),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            return 1 if compare(report, json.load(f), args.tolerance) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,359 @@
+"""
+Bulk model-portfolio construction.
+
+    python bulk.py clients.csv --catalog test.csv --out results.jsonl
+    python bulk.py clients.csv --catalog test.csv --out results.parquet
+    python bulk.py clients.csv --catalog test.csv --out results.db
+    python bulk.py clients.csv --catalog test.csv --out results.db --incremental
+
+The client file is `;`-separated with a header row
+(account_id;pl_level;risk_level;core_funds;satellite_funds, fund lists split
+by `|`, risk_level 1-7) or JSON lines with the same keys. Rows are allocated
+across a process pool; every worker loads the rules and catalog once and
+results are written in input order as CSV or JSONL, in columnar form
+(Parquet/Arrow with pyarrow, else a directory of .npy files; see export.py),
+or into an SQLite result store that can be queried later (see resultstore.py).
+With --incremental, only the clients whose results in that store a rules,
+client or catalog change has made stale are allocated (see dependencies.py).
+The PL tables are validated first and nothing is allocated if they are
+inconsistent.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from types import MappingProxyType
+from typing import Dict, Iterator, List, Mapping, Optional
+
+from allocation_cache import AllocationCache
+from allocation_trace import AllocationTrace, binding_constraint
+from allocator import allocate_funds_within_budget
+from catalog import LoadReport, load_catalog
+from dependencies import Incremental, catalog_stamp, reads_for
+from export import COLUMNS, FORMATS, ColumnarWriter, ResultBlock, can_write
+from pldata import RULES_PATH, load_rules
+from portfolio import AllocationRules, Fund, Portfolio, RulesStore
+from resultstore import ResultStore
+from validation import validate_levels
+
+OUTPUT_FIELDS = list(COLUMNS)
+NAN = float("nan")
+RISK_LEVELS = range(1, 8)
+
+# ==============================================================================
+# 1. CLIENT FILE
+# ==============================================================================
+def _split_funds(field: str, value) -> List[str]:
+    if isinstance(value, list) and all(isinstance(v, str) for v in value):
+        return [v.strip() for v in value if v.strip()]
+    if value is None or isinstance(value, str):
+        return [v.strip() for v in (value or "").split("|") if v.strip()]
+    raise ValueError(f"{field} must be a list of names or a '|'-separated string, not {value!r}")
+
+
+def _required(row: dict, field: str) -> str:
+    value = row.get(field)
+    if value is None or not str(value).strip():
+        raise ValueError(f"missing {field}")
+    if not isinstance(value, (str, int)) or isinstance(value, bool):
+        raise ValueError(f"{field} must be text or an integer, not {value!r}")
+    return str(value).strip()
+
+
+def read_clients(path: str) -> Iterator[dict]:
+    """
+    Yield client rows lazily from a `;` CSV or a .jsonl file. A row that does
+    not parse comes out as {"account_id", "error"} (the account id as given,
+    else "line <n>") for the run to report; it does not stop the file.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for n, line in enumerate(f, 1):
+                if line.strip():
+                    yield _parse_row(line, n, json.loads)
+        else:
+            reader = csv.DictReader(f, delimiter=";")
+            for row in reader:
+                yield _parse_row(row, reader.line_num, dict)
+
+
+def _parse_row(raw, line: int, decode) -> dict:
+    row = None
+    try:
+        row = decode(raw)
+        if not isinstance(row, dict):
+            raise ValueError(f"expected an object, got {type(row).__name__}")
+        return parse_client(row)
+    except ValueError as e:
+        account_id = row.get("account_id") if isinstance(row, dict) else None
+        if not isinstance(account_id, (str, int)) or not str(account_id).strip():
+            account_id = f"line {line}"
+        return {"account_id": str(account_id).strip(), "error": f"bad client row: {e}"}
+
+
+def parse_client(row: dict) -> dict:
+    """
+    A client row as the workers take it; fund lists may be lists or
+    `|`-joined strings. ValueError names the first field that is missing or
+    out of range (risk_level must be 1-7).
+    """
+    risk = _required(row, "risk_level")
+    try:
+        risk_level = int(risk)
+    except ValueError:
+        raise ValueError(f"risk_level must be an integer, not {risk!r}") from None
+    if risk_level not in RISK_LEVELS:
+        raise ValueError(f"risk_level must be {RISK_LEVELS[0]}-{RISK_LEVELS[-1]}, not {risk_level}")
+    return {
+        "account_id": _required(row, "account_id"),
+        "pl_level": _required(row, "pl_level"),
+        "risk_level": risk_level,
+        "core_funds": _split_funds("core_funds", row.get("core_funds")),
+        "satellite_funds": _split_funds("satellite_funds", row.get("satellite_funds")),
+    }
+
+# ==============================================================================
+# 2. WORKER
+# ==============================================================================
+_worker: Dict[str, object] = {}
+
+
+def init_worker(catalog_path: str, engine: str, rules_path: str = RULES_PATH, track: bool = False):
+    """Load the shared rules and catalog once per worker process; track: record each result's reads."""
+    _worker["catalog"] = load_catalog(catalog_path, LoadReport())
+    _worker["rules"] = RulesStore(AllocationRules(*load_rules(rules_path)))
+    _worker["engine"] = engine
+    _worker["cache"] = AllocationCache()
+    _worker["catalog_stamp"] = catalog_stamp(catalog_path) if track else None
+
+
+def reload_rules(rules_path: str = RULES_PATH) -> "Future[AllocationRules]":
+    """Load changed rules into this process in the background; clients already running keep the old ones."""
+    return _worker["rules"].reload(*load_rules(rules_path, refresh=True))
+
+
+def _block(holdings, catalog, client: dict, rules: AllocationRules) -> ResultBlock:
+    """Holdings (name, allocation, is_satellite, leaf_limit, binding) as columns."""
+    records = [catalog.record(h[0]) for h in holdings]
+    return ResultBlock(
+        [h[0] for h in holdings],
+        [r.isin if r else "" for r in records],
+        [r.asset_class if r else "" for r in records],
+        [h[1] for h in holdings],
+        [h[3] if h[2] else NAN for h in holdings],
+        [h[4] if h[2] else "" for h in holdings],
+        ["satellite" if h[2] else "core" for h in holdings],
+        client["pl_level"], client["risk_level"], rules.version,
+    )
+
+
+def _budget_core(client: dict, rules: AllocationRules, risk: int) -> Mapping[str, Mapping[str, float]]:
+    """The client's initial_funds, read-only and shared by every client with the same level, risk and core funds."""
+    def build():
+        level = rules.get_portfolio_level(client["pl_level"])
+        if level is None:
+            raise ValueError(f"PL '{client['pl_level']}' not found.")
+        level, class_of = level.allocations, _worker["catalog"].class_of
+        initial = {}
+        for name in client["core_funds"]:
+            allocs = level.get(class_of(name), ())
+            initial[name] = MappingProxyType({"alloc": allocs[risk] if 0 <= risk < len(allocs) else 0})
+        return MappingProxyType(initial)
+    key = ("budget-core", client["pl_level"], risk, tuple(client["core_funds"]))
+    return _worker["cache"].get_or_compute(rules.fingerprint, key, build)
+
+
+def _build_budget(client: dict, rules: AllocationRules) -> List[tuple]:
+    catalog, risk = _worker["catalog"], client["risk_level"] - 1
+    initial = _budget_core(client, rules, risk)
+    trace = AllocationTrace()
+    final, _ = allocate_funds_within_budget(
+        initial, client["satellite_funds"], rules.reduction_table, rules.pl_dicts, risk, catalog, trace=trace)
+    limits = {r["fund"]: (r["leaf_limit"], r["binding"]) for r in trace.satellites()}
+    return [(name, d["alloc"], name not in initial) + limits.get(name, (NAN, "")) for name, d in final.items()]
+
+
+def _build_portfolio(client: dict, rules: AllocationRules) -> List[tuple]:
+    catalog = _worker["catalog"]
+    risk = client["risk_level"] - 1
+    core = {}
+    for name in client["core_funds"]:
+        ac = rules.get_asset_class(catalog.class_of(name) or "")
+        if ac:
+            core.setdefault(ac.name, Fund(name, ac))
+    p = Portfolio.build_from_level(client["account_id"], client["pl_level"], risk, core, rules)
+    sats = []
+    for name in client["satellite_funds"]:
+        ac = rules.get_asset_class(catalog.class_of(name) or "")
+        if ac:
+            sats.append(Fund(name, ac))
+    p.add_satellites(sats, risk, cache=_worker["cache"])
+    out = []
+    for name, h in p.holdings.items():
+        lim, share = h.leaf_limit, h.competing_share
+        binding = binding_constraint(h.allocation, lim, share) if lim is not None and share is not None else ""
+        out.append((name, h.allocation, h.is_satellite, NAN if lim is None else lim, binding))
+    return out
+
+
+def process_client(client: dict):
+    """Returns (account_id, ResultBlock or None, error message or None)."""
+    if "error" in client:  # did not parse, see read_clients
+        return client["account_id"], None, client["error"]
+    try:
+        build = _build_portfolio if _worker["engine"] == "portfolio" else _build_budget
+        # One snapshot for the whole client, whatever reload_rules() publishes meanwhile.
+        rules = _worker["rules"].current
+        block = _block(build(client, rules), _worker["catalog"], client, rules)
+        if _worker["catalog_stamp"]:
+            block = block._replace(reads=reads_for(client, rules, _worker["engine"], _worker["catalog"].class_of,
+                                                   _worker["catalog_stamp"]))
+        return client["account_id"], block, None
+    except Exception as e:
+        return client["account_id"], None, f"{type(e).__name__}: {e}"
+
+# ==============================================================================
+# 3. OUTPUT & DRIVER
+# ==============================================================================
+class ResultWriter:
+    def __init__(self, path: Optional[str], fmt: str):
+        self.fmt = fmt
+        self.owned = path is not None
+        self.f = open(path, "w", newline="", encoding="utf-8") if path else sys.stdout
+        if fmt == "csv":
+            self.w = csv.writer(self.f, delimiter=";")
+            self.w.writerow(OUTPUT_FIELDS)
+
+    def write(self, account_id: str, block: ResultBlock):
+        k = len(block.fund)
+        limits = [None if lim != lim else lim for lim in block.leaf_limit]  # NaN: none (core)
+        rows = zip([account_id] * k, block.fund, block.isin, block.asset_class, block.allocation, limits,
+                   block.binding, block.role)
+        if self.fmt == "csv":
+            self.w.writerows(rows)
+        else:
+            self.f.writelines(json.dumps(dict(zip(OUTPUT_FIELDS, r)), ensure_ascii=False) + "\n" for r in rows)
+
+    def close(self):
+        if self.owned:
+            self.f.close()
+
+
+def open_writer(path: Optional[str], fmt: str):
+    """
+    ResultWriter for csv/jsonl (stdout if no path), ColumnarWriter for the
+    columnar formats. Without pyarrow, parquet and arrow are written as an
+    npy directory next to the requested path, with a warning.
+    """
+    if fmt == "sqlite":
+        if path is None:
+            raise ValueError("The sqlite format needs --out.")
+        return ResultStore(path)
+    if fmt in FORMATS:
+        if path is None:
+            raise ValueError(f"The {fmt} format needs --out.")
+        if not can_write(fmt):
+            npy = os.path.splitext(path)[0] + ".npy"
+            print(f"Writing {fmt} needs pyarrow, which is not installed; writing the npy format to {npy} instead.",
+                  file=sys.stderr)
+            path, fmt = npy, "npy"
+        return ColumnarWriter(path, fmt)
+    return ResultWriter(path, fmt)
+
+
+def _format_of(path: Optional[str]) -> str:
+    ext = os.path.splitext(path or "")[1].lower()
+    return {".csv": "csv", ".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow", ".npy": "npy",
+            ".db": "sqlite", ".sqlite": "sqlite"}.get(ext, "jsonl")
+
+
+def run(clients: Iterator[dict], catalog_path: str, writer, engine: str = "portfolio",
+        workers: Optional[int] = None, chunksize: int = 256, rules_path: str = RULES_PATH) -> Dict[str, int]:
+    """Allocate every client and write results in input order. Returns counters."""
+    stats = {"accounts": 0, "rows": 0, "errors": 0}
+    track = isinstance(writer, ResultStore)
+
+    def consume(results):
+        for account_id, block, error in results:
+            stats["accounts"] += 1
+            if error:
+                stats["errors"] += 1
+                print(f"{account_id}: {error}", file=sys.stderr)
+                continue
+            writer.write(account_id, block)
+            stats["rows"] += len(block.fund)
+
+    if workers == 0:
+        init_worker(catalog_path, engine, rules_path, track)
+        consume(map(process_client, clients))
+        return stats
+
+    workers = workers or os.cpu_count() or 1
+    # Feed the pool one window at a time so the client file is never read whole.
+    window = chunksize * workers * 4
+    with ProcessPoolExecutor(workers, initializer=init_worker,
+                             initargs=(catalog_path, engine, rules_path, track)) as pool:
+        while True:
+            batch = list(islice(clients, window))
+            if not batch:
+                break
+            consume(pool.map(process_client, batch, chunksize=chunksize))
+    return stats
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Build model portfolios for every client in a file.")
+    ap.add_argument("clients", help="client file (.csv with ';' separator, or .jsonl)")
+    ap.add_argument("--catalog", required=True, help="fund catalog (name;isin;asset_class)")
+    ap.add_argument("--rules", default=RULES_PATH, help="rules file (PL tables, reduction_table, tree)")
+    ap.add_argument("--out", help="output file (.csv, .jsonl, .parquet, .arrow, .db) or .npy directory; "
+                                  "stdout if omitted")
+    ap.add_argument("--format", choices=["csv", "jsonl", *FORMATS, "sqlite"], help="output format (default: from --out)")
+    ap.add_argument("--engine", choices=["portfolio", "budget"], default="portfolio",
+                    help="portfolio: Portfolio.add_satellites; budget: allocate_funds_within_budget")
+    ap.add_argument("--workers", type=int, help="worker processes (0 runs inline; default: all CPUs)")
+    ap.add_argument("--chunksize", type=int, default=256)
+    ap.add_argument("--skip-validation", action="store_true", help="allocate even if the PL tables are inconsistent")
+    ap.add_argument("--incremental", action="store_true",
+                    help="with a result store: allocate only clients whose stored results are stale")
+    args = ap.parse_args(argv)
+    fmt = args.format or _format_of(args.out)
+    if args.incremental and fmt != "sqlite":
+        print("--incremental needs a result store (--out results.db).", file=sys.stderr)
+        return 2
+
+    data = load_rules(args.rules)
+    if not args.skip_validation:
+        report = validate_levels(data.pl_dicts, data.tree)
+        if not report.ok:
+            print(report.summary(), file=sys.stderr)
+            return 2
+
+    try:
+        writer = open_writer(args.out, fmt)
+    except (ImportError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    clients, incremental = read_clients(args.clients), None
+    try:
+        if isinstance(writer, ResultStore):
+            rules = AllocationRules(*data)
+            writer.save_rules(rules.version, *data)  # what later --incremental runs diff against
+            if args.incremental:
+                incremental = Incremental(writer, rules, args.engine, catalog_stamp(args.catalog))
+                clients = incremental.clients(clients)
+        stats = run(clients, args.catalog, writer, args.engine, args.workers, args.chunksize, args.rules)
+    finally:
+        writer.close()
+    if incremental is not None:
+        print(incremental.summary(), file=sys.stderr)
+    print(f"Processed {stats['accounts']} accounts, wrote {stats['rows']} rows, {stats['errors']} errors.",
+          file=sys.stderr)
+    return 1 if stats["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
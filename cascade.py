@@ -0,0 +1,71 @@
+from bisect import bisect_right
+from heapq import merge
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from hierarchy import Hierarchy
+from waterfill import INF, split_sorted
+
+# ==============================================================================
+# CASCADING HEADROOM THROUGH DEEP TREES
+# ==============================================================================
+# Below a core class every intermediate class X may cap what the satellites
+# under it take in total (X's own satellites sit in its parent's pool). Filled
+# at one water level from the core, a pool whose cap binds holds its satellites
+# at the level where they exactly use the cap. So each satellite's effective
+# limit is its leaf limit clamped by the fill level of every capped pool above
+# it, and the core then splits its headroom among the effective limits like
+# any flat group. The pools are solved children-first in one post-order walk
+# over the classes on satellite paths; each keeps its satellites' effective
+# limits sorted, so a pool's fill level is one split_sorted scan.
+
+
+def effective_limits(h: Hierarchy, nodes: Sequence[int], cores: Sequence[int], limits: Sequence[float],
+                     cap_of: Callable[[int], float]) -> Tuple[List[float], List[Optional[int]], Dict[int, List[int]]]:
+    """
+    For satellites at tree nodes `nodes`, each drawing from the core node in
+    `cores` (a strict ancestor), returns:
+
+      - the effective limit of each satellite,
+      - the node whose cap set it, or None where its leaf limit did,
+      - for each core node, its satellites in ascending effective limit.
+
+    `cap_of(node)` is the most the satellites strictly below `node` may take
+    together (INF for no cap); it is asked once per node between a core and
+    its satellites.
+    """
+    parent = h.parent
+    eff = [float(l) for l in limits]
+    bound: List[Optional[int]] = [None] * len(eff)
+    # Classes on some satellite's path below its core, and the satellites of each.
+    # A satellite class may itself be a core holding: the satellites under it
+    # then draw from it, not from its own core, so pools are keyed by
+    # (node, core) and only merge upwards within one core's group.
+    at: Dict[int, List[int]] = {}
+    path: Dict[int, int] = {}
+    for s, (n, c) in enumerate(zip(nodes, cores)):
+        at.setdefault(n, []).append(s)
+        while n != c and n not in path:
+            path[n] = c
+            n = parent[n]
+
+    # Preorder indexes put children after parents, so descending is post-order.
+    pending: Dict[Tuple[int, int], List[List[Tuple[float, int]]]] = {}
+    groups: Dict[int, List[int]] = {}
+    for n in sorted(path, reverse=True):
+        c = path[n]
+        own = sorted((eff[s], s) for s in at.get(n, ()))
+        below = pending.pop((n, c), None)
+        if below:
+            pool = list(merge(*below)) if len(below) > 1 else below[0]
+            cap = cap_of(n)
+            if cap < INF:
+                level, _ = split_sorted([e for e, _ in pool], cap)
+                i = bisect_right(pool, (level, len(eff)))
+                for e, s in pool[i:]:  # clamping the tail keeps the pool sorted
+                    eff[s], bound[s] = level, n
+                pool[i:] = [(level, s) for _, s in pool[i:]]
+            own = list(merge(own, pool))
+        pending.setdefault((parent[n], c), []).append(own)
+    for (core, _), lists in pending.items():
+        groups[core] = [s for _, s in merge(*lists)]
+    return eff, bound, groups
@@ -0,0 +1,197 @@
+import csv
+import io
+import sys
+from collections import Counter
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, TextIO, Tuple
+
+from snapshot import load_with_snapshot
+
+# ==============================================================================
+# STREAMING FUND CATALOG LOADER
+# ==============================================================================
+# Catalog files are `name;isin;asset_class` rows. They are read from disk one
+# row at a time, so vendor dumps never have to sit in memory as one string.
+# Problems are collected into a LoadReport instead of being printed per row.
+
+@dataclass
+class LoadReport:
+    max_samples: int = 20
+    rows_read: int = 0
+    loaded: int = 0
+    skipped: Counter = field(default_factory=Counter)
+    samples: List[str] = field(default_factory=list)
+    duplicate_names: Counter = field(default_factory=Counter)
+    duplicate_isins: Counter = field(default_factory=Counter)
+    conflicting_isins: Dict[str, set] = field(default_factory=dict)
+
+    def warn(self, kind: str, message: str):
+        self.skipped[kind] += 1
+        if len(self.samples) < self.max_samples:
+            self.samples.append(message)
+
+    @property
+    def ok(self) -> bool:
+        return not (self.skipped or self.duplicate_names or self.duplicate_isins)
+
+    def summary(self) -> str:
+        lines = [f"Read {self.rows_read} rows, loaded {self.loaded} funds."]
+        for kind, n in sorted(self.skipped.items()):
+            lines.append(f"  - skipped {n} rows: {kind}")
+        if self.duplicate_names:
+            lines.append(f"  - {len(self.duplicate_names)} duplicate fund names (later rows win)")
+            for name in sorted(self.duplicate_names)[:self.max_samples]:
+                lines.append(f"      {name}")
+        if self.duplicate_isins:
+            lines.append(f"  - {len(self.duplicate_isins)} duplicate ISINs, "
+                         f"{len(self.conflicting_isins)} with conflicting asset classes")
+            for isin, classes in sorted(self.conflicting_isins.items())[:self.max_samples]:
+                lines.append(f"      {isin}: {', '.join(sorted(classes))}")
+        for s in self.samples:
+            lines.append(f"    {s}")
+        return "\n".join(lines)
+
+
+def iter_fund_rows(f: TextIO, report: Optional[LoadReport] = None, delimiter: str = ";") -> Iterator[Tuple[str, str, str]]:
+    """Yield (name, isin, asset_class) from an open text stream, one row at a time."""
+    report = report if report is not None else LoadReport()
+    seen_names, seen_isins = set(), {}
+    for i, row in enumerate(csv.reader(f, delimiter=delimiter)):
+        if not row or not any(c.strip() for c in row):
+            continue  # Skip empty rows
+        report.rows_read += 1
+        if len(row) < 3:
+            report.warn("malformed", f"row {i+1}: {row}")
+            continue
+        name, isin, asset_class = (item.strip() for item in row[:3])
+        if not name or not asset_class:
+            report.warn("missing name or class", f"row {i+1}: {row}")
+            continue
+        if name in seen_names:
+            report.duplicate_names[name] += 1  # replaces the earlier fund, so it is not counted again
+        else:
+            seen_names.add(name)
+            report.loaded += 1
+        if isin:
+            prev = seen_isins.get(isin)
+            if prev is not None:
+                report.duplicate_isins[isin] += 1
+                if prev != asset_class:
+                    report.conflicting_isins.setdefault(isin, {prev}).add(asset_class)
+            seen_isins[isin] = asset_class
+        yield name, isin, asset_class
+
+
+def load_funds(f: TextIO, report: Optional[LoadReport] = None) -> Dict[str, dict]:
+    """Build the `name -> {class, isin}` catalog from an open text stream."""
+    return {name: {"class": asset_class, "isin": isin} for name, isin, asset_class in iter_fund_rows(f, report)}
+
+
+def load_funds_from_file(path: str, report: Optional[LoadReport] = None, encoding: str = "utf-8") -> Dict[str, dict]:
+    with open(path, newline="", encoding=encoding) as f:
+        return load_funds(f, report)
+
+
+def load_funds_from_string(content: str, report: Optional[LoadReport] = None) -> Dict[str, dict]:
+    return load_funds(io.StringIO(content), report)
+
+
+# ==============================================================================
+# INDEXED FUND CATALOG
+# ==============================================================================
+class FundRecord(NamedTuple):
+    name: str
+    isin: str
+    asset_class: str
+
+
+class FundCatalog(Mapping):
+    """
+    Funds indexed by name, ISIN and asset class, each an O(1) hash lookup.
+    Still reads like the old `name -> {class, isin}` dict for existing callers.
+    Class strings are interned, so every fund of a class shares one string.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[str, str, str]] = ()):
+        self._by_name: Dict[str, FundRecord] = {}
+        self._by_isin: Dict[str, FundRecord] = {}
+        self._by_class: Dict[str, Dict[str, FundRecord]] = {}
+        for name, isin, asset_class in rows:
+            self.add(name, isin, asset_class)
+
+    @classmethod
+    def from_dict(cls, funds: Dict[str, dict]) -> "FundCatalog":
+        return cls((n, d.get("isin", ""), d["class"]) for n, d in funds.items())
+
+    def add(self, name: str, isin: str, asset_class: str) -> FundRecord:
+        """Add or replace a fund; a later row for the same name wins."""
+        rec = FundRecord(name, isin, sys.intern(asset_class))
+        old = self._by_name.get(name)
+        if old is not None:
+            self._by_class[old.asset_class].pop(name, None)
+            if old.isin and self._by_isin.get(old.isin) is old:
+                del self._by_isin[old.isin]
+        self._by_name[name] = rec
+        if isin:
+            self._by_isin[isin] = rec
+        self._by_class.setdefault(rec.asset_class, {})[name] = rec
+        return rec
+
+    # --- Mapping interface (name -> {"class", "isin"}) ---
+    def __getitem__(self, name: str) -> dict:
+        rec = self._by_name[name]
+        return {"class": rec.asset_class, "isin": rec.isin}
+
+    def __iter__(self):
+        return iter(self._by_name)
+
+    def __len__(self) -> int:
+        return len(self._by_name)
+
+    def __contains__(self, name) -> bool:
+        return name in self._by_name
+
+    # --- Indexed lookups ---
+    def record(self, name: str) -> Optional[FundRecord]:
+        return self._by_name.get(name)
+
+    def by_isin(self, isin: str) -> Optional[FundRecord]:
+        return self._by_isin.get(isin)
+
+    def class_of(self, name: str) -> Optional[str]:
+        rec = self._by_name.get(name)
+        return rec.asset_class if rec else None
+
+    def class_of_isin(self, isin: str) -> Optional[str]:
+        rec = self._by_isin.get(isin)
+        return rec.asset_class if rec else None
+
+    def in_class(self, asset_class: str) -> List[FundRecord]:
+        return list(self._by_class.get(asset_class, {}).values())
+
+    @property
+    def asset_classes(self) -> List[str]:
+        return [c for c, funds in self._by_class.items() if funds]
+
+
+def load_catalog(path: str, report: Optional[LoadReport] = None, encoding: str = "utf-8") -> FundCatalog:
+    with open(path, newline="", encoding=encoding) as f:
+        return FundCatalog(iter_fund_rows(f, report))
+
+
+def _parse_catalog(path: str) -> Tuple[FundCatalog, LoadReport]:
+    report = LoadReport()
+    return load_catalog(path, report), report
+
+
+def load_catalog_snapshot(path: str) -> Tuple[FundCatalog, LoadReport]:
+    """load_catalog() with its report, reused from a pickled snapshot while `path` is unchanged."""
+    return load_with_snapshot(path, _parse_catalog, "catalog")
+
+
+def catalog_class_lookup(funds_catalog):
+    """`name -> class` function for a FundCatalog or a plain catalog dict."""
+    if isinstance(funds_catalog, FundCatalog):
+        return funds_catalog.class_of
+    return lambda name: funds_catalog.get(name, {}).get("class")
@@ -0,0 +1,185 @@
+"""
+Which rules an allocation depends on, and which results a rules change makes stale.
+
+    python bulk.py clients.csv --catalog test.csv --out results.db                 # full run
+    python bulk.py clients.csv --catalog test.csv --out results.db --incremental   # after a rules edit
+
+Every result written to a result store carries the keys of the rule entries
+its allocation read:
+
+    level:<PL>:<class>:<risk>  a core class's allocation in the client's PL
+    reduction:<class>          the reduction_table entry of a core class its satellites drew from
+    leaf:<class>:<risk>        a satellite class's leaf limit
+    parent:<class>             a satellite class's ancestors, which decide the core class it draws from
+
+(risks are 0-based, as in the PL tables) plus stamps of its other inputs:
+the client row, the engine and the catalog file. rules_diff() lists the keys
+whose values differ between two rule sets; a stored account needs a new
+allocation only if it read one of them, or if a stamp no longer matches.
+Most model updates touch one or two classes and so a small part of the book.
+
+The keys are worked out from the client and the rules rather than traced at
+each lookup: core templates and the AllocationCache answer most lookups
+without reading the tables, so traced reads would miss them. They mirror
+what each engine reads; change one and its function here changes with it.
+"""
+import hashlib
+import json
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from leaflimits import leaf_limit_table
+from portfolio import AllocationRules
+
+# ==============================================================================
+# 1. WHAT AN ALLOCATION READS
+# ==============================================================================
+def portfolio_reads(rules: AllocationRules, pl_level: str, risk: int, core_classes: Iterable[str],
+                    satellite_classes: Iterable[str]) -> Set[str]:
+    """Rule entries Portfolio.build_from_level + add_satellites read; classes as the catalog gives them."""
+    level = rules.get_portfolio_level(pl_level)
+    reads, held = set(), set()
+    for c in core_classes:
+        if c:
+            reads.add(f"level:{pl_level}:{c}:{risk}")
+            if rules.get_asset_class(c) and level and level.get_allocation(c, risk) > 0:
+                held.add(c)
+    for s in satellite_classes:
+        if not s:
+            continue
+        reads.add(f"parent:{s}")  # also covers a class the rules do not know yet
+        ac = rules.get_asset_class(s)
+        core = ac.find_ancestor_in(held) if ac else None
+        if core:
+            reads.add(f"reduction:{core.name}")
+            reads.add(f"leaf:{s}:{risk}")
+    return reads
+
+
+def budget_reads(rules: AllocationRules, pl_level: str, risk: int, core_classes: Iterable[str],
+                 satellite_classes: Iterable[str]) -> Set[str]:
+    """Rule entries allocate_funds_within_budget reads: satellites only draw from a core fund of their own class."""
+    reads, cores = set(), set()
+    for c in core_classes:
+        if c:
+            reads.add(f"level:{pl_level}:{c}:{risk}")
+            cores.add(c)
+    for s in satellite_classes:
+        if s in cores:
+            reads.add(f"reduction:{s}")
+            reads.add(f"leaf:{s}:{risk}")
+    return reads
+
+
+def client_stamp(client: dict) -> str:
+    payload = json.dumps([client["pl_level"], client["risk_level"], client["core_funds"], client["satellite_funds"]],
+                         ensure_ascii=False, separators=(",", ":"))
+    return "client:" + hashlib.blake2b(payload.encode(), digest_size=8).hexdigest()
+
+
+def catalog_stamp(path: str) -> str:
+    h = hashlib.blake2b(digest_size=8)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return "catalog:" + h.hexdigest()
+
+
+STAMPS = ("client:", "engine:", "catalog:")
+
+# ==============================================================================
+# 2. WHAT A RULES CHANGE TOUCHES
+# ==============================================================================
+def _chain(rules: AllocationRules, cls: str) -> Optional[tuple]:
+    ac = rules.get_asset_class(cls)
+    names = []
+    while ac:
+        names.append(ac.name)
+        ac = ac.parent
+    return tuple(names) if names else None
+
+
+def rules_diff(old: AllocationRules, new: AllocationRules) -> Set[str]:
+    """Keys (as in the module docstring) whose values differ between two rule sets."""
+    changed = set()
+    risks = max(old.leaf_limits.num_risks, new.leaf_limits.num_risks)
+    for name in old.portfolio_levels.keys() | new.portfolio_levels.keys():
+        a = old.portfolio_levels[name].allocations if name in old.portfolio_levels else {}
+        b = new.portfolio_levels[name].allocations if name in new.portfolio_levels else {}
+        for cls in a.keys() | b.keys():
+            ra, rb = a.get(cls, ()), b.get(cls, ())
+            if ra != rb:
+                for r in range(max(len(ra), len(rb))):
+                    if (ra[r] if r < len(ra) else 0) != (rb[r] if r < len(rb) else 0):
+                        changed.add(f"level:{name}:{cls}:{r}")
+    for cls in old.reduction_table.keys() | new.reduction_table.keys():
+        if old.get_reduction_pct(cls) != new.get_reduction_pct(cls):
+            changed.add(f"reduction:{cls}")
+    # Portfolio reads the name-ordered table, the budget engine the one in
+    # pl_dicts order; they only differ if the PLs are listed out of order.
+    for ta, tb in ((old.leaf_limits, new.leaf_limits),
+                   (leaf_limit_table(old.pl_dicts), leaf_limit_table(new.pl_dicts))):
+        for cls in ta.index.keys() | tb.index.keys():
+            if ta.row(cls) != tb.row(cls):
+                changed.update(f"leaf:{cls}:{r}" for r in range(risks) if ta.limit(cls, r) != tb.limit(cls, r))
+    for cls in old.asset_classes.keys() | new.asset_classes.keys():
+        if _chain(old, cls) != _chain(new, cls):
+            changed.add(f"parent:{cls}")
+    return changed
+
+# ==============================================================================
+# 3. PICKING THE CLIENTS TO RECOMPUTE
+# ==============================================================================
+class Incremental:
+    """
+    The stale accounts of a result store under `rules`: those stored under
+    another rules version that read a key rules_diff reports, those stored
+    without dependencies (or under rules the store has no copy of), and, per
+    client, any whose stamps differ or that were never stored.
+    """
+
+    def __init__(self, store, rules: AllocationRules, engine: str, catalog: str):
+        self.rules, self.engine, self.catalog = rules, f"engine:{engine}", catalog
+        self.stale: Set[str] = set(store.untracked())
+        self.changed: Dict[str, int] = {}  # rules version -> how many keys changed since
+        for version in store.versions():
+            if version in ("", rules.version):  # rows without a version are untracked
+                continue
+            data = store.rules_data(version)
+            if data is None:
+                self.stale.update(store.accounts_under(version))
+                continue
+            keys = rules_diff(AllocationRules(*data), rules)
+            self.changed[version] = len(keys)
+            self.stale.update(store.readers(keys, version))
+        self.stamps = store.account_keys(STAMPS)
+        self.kept = self.selected = 0
+
+    def clients(self, clients: Iterable[dict]) -> Iterator[dict]:
+        """The clients that need a new allocation, in input order."""
+        for client in clients:
+            if "error" in client:  # a row that did not parse: the run reports it
+                yield client
+                continue
+            aid = client["account_id"]
+            stamps = self.stamps.get(aid)
+            if aid in self.stale or stamps != {client_stamp(client), self.engine, self.catalog}:
+                self.selected += 1
+                yield client
+            else:
+                self.kept += 1
+
+    def summary(self) -> str:
+        diffs = ", ".join(f"{v}: {n} changed entries" for v, n in sorted(self.changed.items())) or "no other versions"
+        return (f"Incremental against rules {self.rules.version} ({diffs}): "
+                f"{self.selected} accounts to allocate, {self.kept} kept.")
+
+
+def reads_for(client: dict, rules: AllocationRules, engine: str, class_of, catalog: str) -> List[str]:
+    """Every key a client's stored result depends on, sorted."""
+    risk = client["risk_level"] - 1
+    cores = [class_of(n) or "" for n in client["core_funds"]]
+    sats = [class_of(n) or "" for n in client["satellite_funds"]]
+    fn = portfolio_reads if engine == "portfolio" else budget_reads
+    keys = fn(rules, client["pl_level"], risk, cores, sats)
+    keys.update((client_stamp(client), f"engine:{engine}", catalog))
+    return sorted(keys)
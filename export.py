@@ -0,0 +1,215 @@
+"""
+Columnar export of allocation results.
+
+    with ColumnarWriter("results.parquet") as w:
+        w.write("ACC-1", ResultBlock(funds, isins, classes, allocations, leaf_limits, bindings, roles))
+
+Rows are buffered column by column in fixed-size numpy chunks and written
+one chunk at a time. String columns are dictionary-encoded as they arrive
+(an account, fund or class string is stored once, rows hold int32 codes),
+so no Python object is kept per row. Formats:
+
+  - parquet, arrow  one file, through pyarrow if it is installed;
+  - npy             a directory with one .npy per column, string columns as
+                    codes plus a <column>.labels.npy, read back by read_npy().
+
+fmt=None picks parquet when pyarrow is importable and npy otherwise.
+"""
+import os
+import shutil
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: the npy format needs only numpy
+    pa = pq = None
+
+COLUMNS = ("account_id", "fund", "isin", "asset_class", "allocation", "leaf_limit", "binding", "role")
+STRING_COLUMNS = ("account_id", "fund", "isin", "asset_class", "binding", "role")
+FLOAT_COLUMNS = ("allocation", "leaf_limit")
+FORMATS = ("parquet", "arrow", "npy")
+CHUNK_ROWS = 65_536
+
+
+class ResultBlock(NamedTuple):
+    """One account's rows, column by column. leaf_limit is NaN and binding '' for core holdings."""
+    fund: Sequence[str]
+    isin: Sequence[str]
+    asset_class: Sequence[str]
+    allocation: Sequence[float]
+    leaf_limit: Sequence[float]
+    binding: Sequence[str]
+    role: Sequence[str]
+    # Per account rather than per row; only the result store keeps them.
+    pl_level: str = ""
+    risk_level: int = 0  # 1-7, as in the client file
+    rules_version: str = ""
+    reads: Sequence[str] = ()  # rule entries the allocation depended on, see dependencies.py
+
+
+class Labels:
+    """Strings in first-seen order and their int32 codes."""
+
+    def __init__(self):
+        self.labels: List[str] = []
+        self.codes: Dict[str, int] = {}
+
+    def code(self, value: str) -> int:
+        c = self.codes.get(value)
+        if c is None:
+            c = self.codes[value] = len(self.labels)
+            self.labels.append(value)
+        return c
+
+    def encode(self, values: Sequence[str]) -> np.ndarray:
+        return np.fromiter(map(self.code, values), dtype=np.int32, count=len(values))
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+
+def default_format() -> str:
+    return "parquet" if pa is not None else "npy"
+
+
+def can_write(fmt: str) -> bool:
+    """Whether fmt can be written here: parquet and arrow need pyarrow."""
+    return fmt == "npy" or pa is not None
+
+# ==============================================================================
+# SINKS
+# ==============================================================================
+# A sink takes full chunks ({column: array}, string columns as codes into the
+# writer's Labels) and finishes the file on close.
+
+class _ArrowSink:
+    def __init__(self, path: str, fmt: str, labels: Dict[str, Labels]):
+        if pa is None:
+            raise ImportError(f"Writing {fmt} needs pyarrow; install it or use the npy format.")
+        self.fmt, self.labels = fmt, labels
+        strings = pa.dictionary(pa.int32(), pa.string())
+        self.schema = pa.schema([(c, strings if c in STRING_COLUMNS else pa.float64()) for c in COLUMNS])
+        if fmt == "parquet":
+            self.writer = pq.ParquetWriter(path, self.schema)
+        else:
+            # The IPC file format allows one dictionary per column, so the
+            # chunk-local dictionaries are decoded to plain strings there.
+            self.schema = pa.schema([(c, pa.string() if c in STRING_COLUMNS else pa.float64()) for c in COLUMNS])
+            self.writer = pa.ipc.new_file(path, self.schema)
+
+    def _strings(self, column: str, codes: np.ndarray):
+        # Only the labels this chunk uses, so a chunk never costs more than its rows.
+        used, local = np.unique(codes, return_inverse=True)
+        labels = self.labels[column].labels
+        arr = pa.DictionaryArray.from_arrays(pa.array(local.astype(np.int32)),
+                                             pa.array([labels[i] for i in used.tolist()], pa.string()))
+        return arr if self.fmt == "parquet" else arr.dictionary_decode()
+
+    def write(self, chunk: Dict[str, np.ndarray]):
+        arrays = [self._strings(c, chunk[c]) if c in STRING_COLUMNS else pa.array(chunk[c]) for c in COLUMNS]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class _NpySink:
+    def __init__(self, path: str, labels: Dict[str, Labels]):
+        os.makedirs(path, exist_ok=True)
+        self.path, self.labels, self.rows = path, labels, 0
+        self.dtypes = {c: np.dtype(np.int32 if c in STRING_COLUMNS else np.float64) for c in COLUMNS}
+        # Raw column data streams to .part files; the .npy header needs the final length.
+        self.parts = {c: open(os.path.join(path, f"{c}.part"), "wb") for c in COLUMNS}
+
+    def write(self, chunk: Dict[str, np.ndarray]):
+        for c, f in self.parts.items():
+            chunk[c].astype(self.dtypes[c], copy=False).tofile(f)
+        self.rows += len(chunk[COLUMNS[0]])
+
+    def close(self):
+        for c, part in self.parts.items():
+            part.close()
+            with open(part.name, "rb") as src, open(os.path.join(self.path, f"{c}.npy"), "wb") as out:
+                header = {"descr": np.lib.format.dtype_to_descr(self.dtypes[c]), "fortran_order": False,
+                          "shape": (self.rows,)}
+                np.lib.format.write_array_header_2_0(out, header)
+                shutil.copyfileobj(src, out, 1 << 20)
+            os.remove(part.name)
+        for c in STRING_COLUMNS:
+            np.save(os.path.join(self.path, f"{c}.labels.npy"), np.array(self.labels[c].labels, dtype=str))
+
+
+def read_npy(path: str, decode: bool = True, mmap: bool = False) -> Dict[str, np.ndarray]:
+    """Columns written in the npy format; string columns as str arrays, or as int32 codes if not decode."""
+    mode = "r" if mmap else None
+    out = {c: np.load(os.path.join(path, f"{c}.npy"), mmap_mode=mode) for c in COLUMNS}
+    if decode:
+        for c in STRING_COLUMNS:
+            out[c] = np.load(os.path.join(path, f"{c}.labels.npy"))[out[c]]
+    return out
+
+# ==============================================================================
+# WRITER
+# ==============================================================================
+class ColumnarWriter:
+    def __init__(self, path: str, fmt: Optional[str] = None, chunk_rows: int = CHUNK_ROWS):
+        fmt = fmt or default_format()
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format '{fmt}'; expected one of {', '.join(FORMATS)}.")
+        self.fmt, self.chunk_rows, self.rows = fmt, chunk_rows, 0
+        self.labels = {c: Labels() for c in STRING_COLUMNS}
+        self.sink = _NpySink(path, self.labels) if fmt == "npy" else _ArrowSink(path, fmt, self.labels)
+        self.buf = {c: np.empty(chunk_rows, dtype=np.int32 if c in STRING_COLUMNS else np.float64) for c in COLUMNS}
+        self.n = 0
+
+    def write(self, account_id: str, block: ResultBlock):
+        """Append one account's rows."""
+        k = len(block.fund)
+        if self.n + k > self.chunk_rows:  # spans chunks: go through whole columns
+            columns = {c: self.labels[c].encode(getattr(block, c)) for c in STRING_COLUMNS if c != "account_id"}
+            columns["account_id"] = np.full(k, self.labels["account_id"].code(account_id), dtype=np.int32)
+            columns.update((c, np.asarray(getattr(block, c), dtype=np.float64)) for c in FLOAT_COLUMNS)
+            self.write_columns(columns)
+            return
+        # Small blocks are copied straight into the chunk, one slice per column.
+        n, buf = self.n, self.buf
+        buf["account_id"][n:n + k] = self.labels["account_id"].code(account_id)
+        for c in STRING_COLUMNS[1:]:
+            buf[c][n:n + k] = list(map(self.labels[c].code, getattr(block, c)))
+        for c in FLOAT_COLUMNS:
+            buf[c][n:n + k] = getattr(block, c)
+        self.n += k
+        self.rows += k
+        if self.n == self.chunk_rows:
+            self.flush()
+
+    def write_columns(self, columns: Dict[str, np.ndarray]):
+        """Append rows given as whole columns; string columns as codes from self.labels."""
+        k, start = len(columns[COLUMNS[0]]), 0
+        while start < k:
+            take = min(k - start, self.chunk_rows - self.n)
+            for c in COLUMNS:
+                self.buf[c][self.n:self.n + take] = columns[c][start:start + take]
+            self.n += take
+            start += take
+            if self.n == self.chunk_rows:
+                self.flush()
+        self.rows += k
+
+    def flush(self):
+        if self.n:
+            self.sink.write({c: a[:self.n] for c, a in self.buf.items()})
+            self.n = 0
+
+    def close(self):
+        self.flush()
+        self.sink.close()
+
+    def __enter__(self) -> "ColumnarWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,141 @@
+from collections import OrderedDict
+from typing import AbstractSet, Callable, Dict, Hashable, Iterable, List, Mapping, Optional, TypeVar
+
+T = TypeVar("T")
+
+# ==============================================================================
+# COMPILED ASSET-CLASS HIERARCHY
+# ==============================================================================
+# The nested `tree` dicts used by the scripts are walked once into flat arrays:
+# a parent index per node, its depth and its preorder interval [tin, tout).
+# "Is X under Y" is then an interval test and "nearest ancestor of X in a core
+# set" is a walk up the parent array, without re-walking the dict per lookup.
+
+class Hierarchy:
+    __slots__ = ("names", "index", "parent", "depth", "tin", "tout")
+
+    def __init__(self, tree: dict):
+        self.names: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.parent: List[int] = []
+        self.depth: List[int] = []
+        self.tin: List[int] = []
+        self.tout: List[int] = []
+        # Iterative preorder walk; the first occurrence of a name wins, like the
+        # recursive find_satellite_parent did.
+        stack = [(name, node, -1, 0) for name, node in reversed(list(tree.items()))]
+        while stack:
+            name, node, p, d = stack.pop()
+            if name is None:  # end-of-subtree marker
+                self.tout[node] = len(self.names)
+                continue
+            i = len(self.names)
+            self.names.append(name)
+            self.index.setdefault(name, i)
+            self.parent.append(p)
+            self.depth.append(d)
+            self.tin.append(i)
+            self.tout.append(i + 1)
+            stack.append((None, i, None, None))
+            children = (node or {}).get("children", {}) or {}
+            for cn, cnode in reversed(list(children.items())):
+                stack.append((cn, cnode, i, d + 1))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def parent_of(self, name: str) -> Optional[str]:
+        i = self.index.get(name)
+        if i is None or self.parent[i] < 0:
+            return None
+        return self.names[self.parent[i]]
+
+    def ancestors(self, name: str, include_self: bool = False) -> List[str]:
+        """Ancestors of `name`, nearest first."""
+        i = self.index.get(name)
+        if i is None:
+            return []
+        out = []
+        if not include_self:
+            i = self.parent[i]
+        while i >= 0:
+            out.append(self.names[i])
+            i = self.parent[i]
+        return out
+
+    def is_under(self, name: str, ancestor: str, include_self: bool = False) -> bool:
+        """O(1) test whether `name` lies in the subtree of `ancestor`."""
+        i, a = self.index.get(name), self.index.get(ancestor)
+        if i is None or a is None:
+            return False
+        if i == a:
+            return include_self
+        return self.tin[a] <= self.tin[i] < self.tout[a]
+
+    def nearest_ancestor_in(self, name: str, core: Iterable[str], include_self: bool = False) -> Optional[str]:
+        """Closest ancestor of `name` that is in `core`, O(depth)."""
+        i = self.index.get(name)
+        if i is None:
+            return None
+        if not isinstance(core, (AbstractSet, Mapping)):
+            core = set(core)
+        if not include_self:
+            i = self.parent[i]
+        while i >= 0:
+            if self.names[i] in core:
+                return self.names[i]
+            i = self.parent[i]
+        return None
+
+    def subtree(self, name: str) -> List[str]:
+        """`name` and all its descendants in preorder."""
+        i = self.index.get(name)
+        if i is None:
+            return []
+        return self.names[self.tin[i]:self.tout[i]]
+
+
+class IdentityCache:
+    """
+    Values built from an object, cached by the object's identity: at most
+    maxsize of them, least recently used dropped first. Plain dicts, lists and
+    tuples cannot be weakly referenced, so each entry holds its object; while
+    the entry exists that id() cannot be reused by another object. An object
+    mutated in place must be rebuilt explicitly with refresh=True.
+    """
+    __slots__ = ("maxsize", "_data")
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, obj, build: Callable[[], T], *extra: Hashable, refresh: bool = False) -> T:
+        """build()'s value for (obj, *extra), built once while cached."""
+        key = (id(obj), *extra)
+        entry = self._data.get(key)
+        if entry is None or entry[0] is not obj or refresh:
+            entry = self._data[key] = (obj, build())
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        else:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:  # evicted by another thread meanwhile
+                pass
+        return entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+
+_compiled = IdentityCache()
+
+def compile_tree(tree: dict, refresh: bool = False) -> Hierarchy:
+    """tree compiled once and cached per tree object (see IdentityCache)."""
+    return _compiled.get(tree, lambda: Hierarchy(tree), refresh=refresh)
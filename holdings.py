@@ -0,0 +1,398 @@
+import sys
+from array import array
+from collections.abc import Mapping, MutableMapping
+from math import isnan
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# ==============================================================================
+# ARRAY-BACKED HOLDINGS STORE
+# ==============================================================================
+# Funds are interned once into a FundRegistry shared by every portfolio built
+# on the same rules. A portfolio's holdings are then parallel arrays with one
+# row per fund: fund id, owning core fund id, allocation, leaf limit, competing
+# share and a flag byte, plus a fund id -> row index. That is about 33 bytes a
+# holding in the columns and one dict entry in the index; the dict of objects
+# it replaces cost several hundred. `Portfolio.holdings` is a mapping view over
+# the store, so `name -> holding` code keeps working unchanged.
+#
+# Thousands of accounts hold the same core level at the same risk. A store can
+# fork() another: the two share their columns until either writes, and only
+# then does the writer copy them. The row index of the rows they had when
+# forked stays shared; each indexes the rows it appends after that itself.
+# The rules keep one frozen core store per (level, risk, core funds), and
+# each portfolio built on it is a fork.
+
+SATELLITE, HELD = 1, 2  # flag bits; an attached satellite with no allocation is not HELD
+NO_GROUP = -1
+_NAN = float("nan")
+_NANS, _NO_GROUPS = array("d", [_NAN]), array("i", [NO_GROUP])
+
+
+class FundRegistry:
+    """Fund name <-> integer id, and each fund's asset class as a class id."""
+    __slots__ = ("funds", "ids", "fund_class", "class_names", "class_ids", "_lock")
+
+    def __init__(self):
+        self.funds: List = []
+        self.ids: Dict[str, int] = {}
+        self.fund_class = array("i")
+        self.class_names: List[str] = []
+        self.class_ids: Dict[str, int] = {}
+        self._lock = Lock()  # taken only to register a new fund
+
+    def __len__(self) -> int:
+        return len(self.funds)
+
+    def class_id(self, name: str) -> int:
+        i = self.class_ids.get(name)
+        if i is None:
+            i = self.class_ids[name] = len(self.class_names)
+            self.class_names.append(name)
+        return i
+
+    def intern(self, fund) -> int:
+        fid = self.ids.get(fund.name)
+        if fid is None:
+            with self._lock:  # registries are shared across threads through their rules
+                fid = self.ids.get(fund.name)
+                if fid is None:
+                    self.funds.append(fund)
+                    self.fund_class.append(self.class_id(fund.asset_class.name))
+                    fid = self.ids[fund.name] = len(self.funds) - 1
+                    return fid
+        if self.funds[fid].asset_class.name != fund.asset_class.name:
+            raise ValueError(f"Fund '{fund.name}' is already registered in class "
+                             f"'{self.funds[fid].asset_class.name}', not '{fund.asset_class.name}'.")
+        return fid
+
+
+class HoldingView:
+    """One row of a HoldingStore, read and written in place."""
+    __slots__ = ("_store", "_fid", "_row", "_epoch")
+
+    def __init__(self, store: "HoldingStore", fid: int, row: int):
+        self._store, self._fid, self._row, self._epoch = store, fid, row, store.epoch
+
+    def _r(self) -> int:
+        s = self._store
+        if self._epoch != s.epoch:  # rows moved since this view was made
+            self._row, self._epoch = s.row(self._fid), s.epoch
+            if self._row < 0:
+                raise KeyError(f"'{s.registry.funds[self._fid].name}' is no longer held.")
+        return self._row
+
+    @property
+    def fund(self):
+        return self._store.registry.funds[self._fid]
+
+    @property
+    def allocation(self) -> float:
+        return self._store.alloc[self._r()]
+
+    @allocation.setter
+    def allocation(self, value: float):
+        r = self._r()
+        self._store.own()
+        self._store.alloc[r] = value
+
+    @property
+    def is_satellite(self) -> bool:
+        return bool(self._store.flags[self._r()] & SATELLITE)
+
+    @property
+    def leaf_limit(self) -> Optional[float]:
+        v = self._store.leaf[self._r()]
+        return None if isnan(v) else v
+
+    @property
+    def competing_share(self) -> Optional[float]:
+        v = self._store.share[self._r()]
+        return None if isnan(v) else v
+
+    @competing_share.setter
+    def competing_share(self, value: Optional[float]):
+        r = self._r()
+        self._store.own()
+        self._store.share[r] = _NAN if value is None else value
+
+    def __repr__(self) -> str:
+        return (f"PortfolioHolding(fund={self.fund!r}, allocation={self.allocation!r}, "
+                f"is_satellite={self.is_satellite!r}, leaf_limit={self.leaf_limit!r}, "
+                f"competing_share={self.competing_share!r})")
+
+
+class HoldingStore(MutableMapping):
+    """
+    Struct-of-arrays holdings, seen as a `fund name -> holding` mapping of the
+    HELD rows in insertion order. A fund's row is found through a fund id ->
+    row dict and the HELD rows are counted as flags change, so lookups and
+    len() are O(1). Set the HELD flag through set_held() to keep the count.
+    """
+    __slots__ = ("registry", "fund", "group", "alloc", "leaf", "share", "flags", "epoch", "_rows", "_added",
+                 "_held", "_shared")
+
+    def __init__(self, registry: FundRegistry):
+        self.registry = registry
+        self.fund = array("i")
+        self.group = array("i")
+        self.alloc = array("d")
+        self.leaf = array("d")
+        self.share = array("d")
+        self.flags = bytearray()
+        self.epoch = 0
+        # fund id -> row, the first row if a fund has two. _rows is never changed
+        # in place, so forks share it; rows appended since go into _added.
+        self._rows: Dict[int, int] = {}
+        self._added: Dict[int, int] = {}
+        self._held = 0  # rows with HELD set
+        self._shared = False  # columns are also another store's: copy before writing
+
+    # --- Copy on write ---
+    def fork(self) -> "HoldingStore":
+        """A store with the same rows that shares this one's columns until either is written to."""
+        s = HoldingStore.__new__(HoldingStore)
+        s.registry, s.fund, s.group, s.alloc = self.registry, self.fund, self.group, self.alloc
+        s.leaf, s.share, s.flags, s.epoch = self.leaf, self.share, self.flags, 0
+        if self._added:
+            self._rows = {**self._added, **self._rows}
+            self._added = {}
+        s._rows, s._added, s._held = self._rows, {}, self._held
+        s._shared = self._shared = True
+        return s
+
+    def own(self):
+        """Take private copies of shared columns; every write to a column must come after this."""
+        if self._shared:
+            self.fund, self.group, self.alloc = self.fund[:], self.group[:], self.alloc[:]
+            self.leaf, self.share, self.flags = self.leaf[:], self.share[:], self.flags[:]
+            self._shared = False
+
+    def _reindex(self):
+        """Rebuild the row index and HELD count from the columns, after rows moved."""
+        n = len(self.fund)
+        self._rows = dict(zip(reversed(self.fund), range(n - 1, -1, -1)))  # first row wins
+        self._added = {}
+        self._held = self.flags.count(HELD) + self.flags.count(HELD | SATELLITE)
+
+    # --- Rows ---
+    def row(self, fid: int) -> int:
+        r = self._rows.get(fid)
+        return self._added.get(fid, -1) if r is None else r
+
+    def _index(self, fid: int, row: int):
+        if fid not in self._rows:
+            self._added.setdefault(fid, row)
+
+    def row_of(self, name: str) -> int:
+        fid = self.registry.ids.get(name)
+        return -1 if fid is None else self.row(fid)
+
+    def append(self, fund, allocation: float, flags: int, leaf_limit: Optional[float] = None,
+               competing_share: Optional[float] = None, group: int = NO_GROUP) -> int:
+        self.own()
+        fid = self.registry.intern(fund)
+        self._index(fid, len(self.fund))
+        if flags & HELD:
+            self._held += 1
+        self.fund.append(fid)
+        self.group.append(group)
+        self.alloc.append(allocation)
+        self.leaf.append(_NAN if leaf_limit is None else leaf_limit)
+        self.share.append(_NAN if competing_share is None else competing_share)
+        self.flags.append(flags)
+        return len(self.fund) - 1
+
+    def extend(self, fids: Iterable[int], allocations: Iterable[float], flags: int):
+        """Append many ungrouped rows of registered funds at once, e.g. a level's core funds."""
+        self.own()
+        n = len(self.fund)
+        self.fund.extend(fids)
+        self.alloc.extend(allocations)
+        for r in range(n, len(self.fund)):
+            self._index(self.fund[r], r)
+        n = len(self.fund) - n
+        if flags & HELD:
+            self._held += n
+        self.group.extend(_NO_GROUPS * n)
+        self.leaf.extend(_NANS * n)
+        self.share.extend(_NANS * n)
+        self.flags.extend(bytes((flags,)) * n)
+
+    def delete(self, row: int):
+        self.own()
+        for a in (self.fund, self.group, self.alloc, self.leaf, self.share, self.flags):
+            del a[row]
+        self._reindex()  # rows after it moved up; deleting is O(n) anyway
+        self.epoch += 1
+
+    def set_held(self, row: int, held: bool):
+        """Set or clear a row's HELD flag. The caller has called own()."""
+        f = self.flags[row]
+        if held and not f & HELD:
+            self.flags[row] = f | HELD
+            self._held += 1
+        elif not held and f & HELD:
+            self.flags[row] = f & ~HELD
+            self._held -= 1
+
+    def rows_in_group(self, gfid: int) -> List[int]:
+        rows, g, r = [], self.group, -1
+        try:
+            while True:  # array.index keeps the scan in C
+                r = g.index(gfid, r + 1)
+                rows.append(r)
+        except ValueError:
+            return rows
+
+    def view(self, row: int) -> HoldingView:
+        return HoldingView(self, self.fund[row], row)
+
+    def name(self, row: int) -> str:
+        return self.registry.funds[self.fund[row]].name
+
+    def nbytes(self) -> int:
+        """Bytes held by the row arrays and index (the registry is not counted; columns shared through fork() are)."""
+        return sum(a.itemsize * len(a) for a in (self.fund, self.group, self.alloc, self.leaf, self.share)) \
+            + len(self.flags) + sys.getsizeof(self._rows) + sys.getsizeof(self._added)
+
+    # --- Mapping of held rows ---
+    def _held_row(self, name: str) -> int:
+        r = self.row_of(name)
+        if r < 0 or not self.flags[r] & HELD:
+            raise KeyError(name)
+        return r
+
+    def __getitem__(self, name: str) -> HoldingView:
+        return self.view(self._held_row(name))
+
+    def __setitem__(self, name: str, h):
+        """Store a PortfolioHolding (or a view) under its fund's name."""
+        if h.fund.name != name:
+            raise ValueError(f"Holding for '{h.fund.name}' cannot be stored as '{name}'.")
+        flags = HELD | (SATELLITE if h.is_satellite else 0)
+        r = self.row_of(name)
+        if r < 0:
+            self.append(h.fund, h.allocation, flags, h.leaf_limit, h.competing_share)
+            return
+        self.own()
+        self.alloc[r] = h.allocation
+        self.leaf[r] = _NAN if h.leaf_limit is None else h.leaf_limit
+        self.share[r] = _NAN if h.competing_share is None else h.competing_share
+        self.set_held(r, True)
+        self.flags[r] = flags
+
+    def __delitem__(self, name: str):
+        r = self._held_row(name)
+        if self.group[r] != NO_GROUP:
+            self.own()
+            self.set_held(r, False)  # still attached to its core fund's group
+        else:
+            self.delete(r)
+
+    def __contains__(self, name) -> bool:
+        r = self.row_of(name)
+        return r >= 0 and bool(self.flags[r] & HELD)
+
+    def __iter__(self) -> Iterator[str]:
+        for r in self.held_rows():
+            yield self.name(r)
+
+    def __len__(self) -> int:
+        return self._held
+
+    def held_rows(self) -> List[int]:
+        return [r for r, f in enumerate(self.flags) if f & HELD]
+
+    def values(self) -> List[HoldingView]:
+        return [self.view(r) for r in self.held_rows()]
+
+    def items(self) -> List[Tuple[str, HoldingView]]:
+        return [(self.name(r), self.view(r)) for r in self.held_rows()]
+
+    def __repr__(self) -> str:
+        return f"HoldingStore({dict(self.items())!r})"
+
+# ==============================================================================
+# COPY-ON-WRITE MAPPINGS
+# ==============================================================================
+# The dict-based allocators (pl2, allocator) start every account from a copy
+# of its core. An Overlay reads through to the core instead and keeps only
+# what the account changes: the core entries it draws down and the
+# satellites it adds.
+
+_GONE = object()  # deleted from the overlay, still in the base
+
+
+class Overlay(MutableMapping):
+    """
+    A mapping over a base that is never written to: reads fall through to the
+    base, writes and deletes stay in the overlay. Iterates in the order a
+    copy of the base would: base keys first, then added ones. The base must
+    not change while the overlay is in use.
+    """
+    __slots__ = ("base", "changes")
+
+    def __init__(self, base: Mapping, changes: Optional[dict] = None):
+        self.base, self.changes = base, {} if changes is None else changes
+
+    def __getitem__(self, key):
+        if key in self.changes:
+            v = self.changes[key]
+            if v is _GONE:
+                raise KeyError(key)
+            return v
+        return self.base[key]
+
+    def __setitem__(self, key, value):
+        self.changes[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key in self.base:
+            self.changes[key] = _GONE
+        else:
+            del self.changes[key]
+
+    def __contains__(self, key) -> bool:
+        if key in self.changes:
+            return self.changes[key] is not _GONE
+        return key in self.base
+
+    def __iter__(self) -> Iterator:
+        ch = self.changes
+        for k in self.base:
+            if ch.get(k) is not _GONE:
+                yield k
+        for k, v in ch.items():
+            if v is not _GONE and k not in self.base:
+                yield k
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def items(self) -> List[Tuple]:
+        ch, base = self.changes, self.base
+        out = [(k, ch.get(k, v)) for k, v in base.items()]
+        if ch:
+            out = [kv for kv in out if kv[1] is not _GONE]
+            out.extend((k, v) for k, v in ch.items() if v is not _GONE and k not in base)
+        return out
+
+    def values(self) -> List:
+        return [v for _, v in self.items()]
+
+    def own(self, key) -> dict:
+        """The overlay's own dict copy of a mapping value, made on first use, to change in place."""
+        if key in self.changes:
+            return self[key]
+        v = self.changes[key] = dict(self.base[key])
+        return v
+
+    def copy(self) -> "Overlay":
+        """Another overlay on the same base; values changed in place are shared between the two."""
+        return Overlay(self.base, dict(self.changes))
+
+    def __repr__(self) -> str:
+        return f"Overlay({dict(self.items())!r})"
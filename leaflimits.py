@@ -0,0 +1,63 @@
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from hierarchy import IdentityCache
+
+# ==============================================================================
+# PRECOMPUTED LEAF-LIMIT TABLE
+# ==============================================================================
+# A satellite's leaf limit is its class's allocation in the most detailed PL
+# that lists the class. The table resolves that once per class into one flat
+# (class x risk) float array, remembering which PL supplied each row.
+
+class LeafLimitTable:
+    __slots__ = ("index", "source", "limits", "num_risks")
+
+    def __init__(self, pl_dicts: Sequence[Tuple[str, dict]], num_risks: Optional[int] = None):
+        """`pl_dicts` runs from least to most detailed; the last level with a class wins."""
+        if num_risks is None:
+            num_risks = max((len(a) for _, pl in pl_dicts for a in pl.values()), default=7)
+        self.num_risks = num_risks
+        self.index: Dict[str, int] = {}
+        self.source: List[str] = []
+        self.limits = array("d")
+        for pl_name, pl in pl_dicts:
+            for cls, allocs in pl.items():
+                i = self.index.get(cls)
+                if i is None:
+                    i = self.index[cls] = len(self.source)
+                    self.source.append(pl_name)
+                    self.limits.extend([0.0] * num_risks)
+                self.source[i] = pl_name
+                row = list(allocs)[:num_risks]
+                self.limits[i * num_risks:i * num_risks + num_risks] = array("d", row + [0.0] * (num_risks - len(row)))
+
+    def __contains__(self, cls: str) -> bool:
+        return cls in self.index
+
+    def limit(self, cls: str, risk: int) -> float:
+        i = self.index.get(cls)
+        if i is None or not 0 <= risk < self.num_risks:
+            return 0.0
+        return self.limits[i * self.num_risks + risk]
+
+    def source_of(self, cls: str) -> Optional[str]:
+        i = self.index.get(cls)
+        return None if i is None else self.source[i]
+
+    def lookup(self, cls: str, risk: int) -> Tuple[Optional[str], float]:
+        """(name of the PL that supplied the limit, limit), or (None, 0)."""
+        return self.source_of(cls), self.limit(cls, risk)
+
+    def row(self, cls: str) -> List[float]:
+        i = self.index.get(cls)
+        if i is None:
+            return [0.0] * self.num_risks
+        return list(self.limits[i * self.num_risks:(i + 1) * self.num_risks])
+
+
+# Cached per pl_dicts object, the same way compile_tree caches trees.
+_tables = IdentityCache()
+
+def leaf_limit_table(pl_dicts: Sequence[Tuple[str, dict]], refresh: bool = False) -> LeafLimitTable:
+    return _tables.get(pl_dicts, lambda: LeafLimitTable(pl_dicts), refresh=refresh)
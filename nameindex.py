@@ -0,0 +1,196 @@
+import math
+import re
+import unicodedata
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from catalog import FundCatalog
+
+# ==============================================================================
+# FUZZY FUND-NAME INDEX
+# ==============================================================================
+# Human-typed fund names rarely match the catalog byte for byte. Names are
+# normalised (case, accents, currency signs, punctuation, spacing) and split
+# into character trigrams; the index keeps a posting array of name ids per
+# trigram. A query is scored by the Dice overlap of trigram sets. Only names
+# sharing one of the query's rarest trigrams can reach the minimum score, so
+# those few postings are all that is read, and the candidates are scored in a
+# handful of numpy operations rather than by scanning every name.
+
+SYMBOLS = {"€": " EUR ", "$": " USD ", "£": " GBP ", "¥": " JPY ", "&": " and ", "%": " pct "}
+_SYMBOLS = re.compile("|".join(re.escape(s) for s in SYMBOLS))
+_NON_WORD = re.compile(r"[\W_]+")
+STRICT_SCORE = 0.8  # first-pass threshold, see NameIndex.candidates
+
+
+def normalize(name: str) -> str:
+    """Case-folded, accent-free words: 'Robeco New World Financials D €' -> 'robeco new world financials d eur'."""
+    name = _SYMBOLS.sub(lambda m: SYMBOLS[m.group()], name)
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(ch for ch in name if not unicodedata.combining(ch)).casefold()
+    return _NON_WORD.sub(" ", name).strip()
+
+
+def trigrams(norm: str) -> set:
+    padded = f"  {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameMatch(NamedTuple):
+    name: str
+    isin: str
+    asset_class: str
+    score: float  # Dice overlap of trigrams, 1.0 for an exact normalised match
+
+
+class Resolution(NamedTuple):
+    query: str
+    matches: List[NameMatch]  # one per fund (per ISIN where known), best first
+    exact: bool               # the best match equals the query once normalised
+    ambiguous: bool           # the top matches are too close to pick one
+
+    @property
+    def best(self) -> Optional[NameMatch]:
+        """The match to use, or None if there is none or it is ambiguous."""
+        return self.matches[0] if self.matches and not self.ambiguous else None
+
+    @property
+    def reason(self) -> str:
+        """Why there is no best match, in trace.skip form."""
+        if not self.matches:
+            return "not in the fund catalog."
+        close = " or ".join(f"'{m.name}' ({m.score:.2f})" for m in self.matches[:3])
+        return f"ambiguous fund name: {close}."
+
+
+class NameIndex:
+    """
+    Built once from a FundCatalog. `aliases` maps other names (old share
+    classes, CRM spellings) to catalog names and is indexed like them.
+    """
+
+    def __init__(self, catalog: FundCatalog, aliases: Optional[Dict[str, str]] = None,
+                 min_score: float = 0.5, margin: float = 0.05):
+        self.catalog, self.min_score, self.margin = catalog, min_score, margin
+        self.funds: List[str] = list(catalog)
+        fund_id = {n: i for i, n in enumerate(self.funds)}
+        entries: List[Tuple[str, int]] = [(n, i) for i, n in enumerate(self.funds)]
+        for alias, target in (aliases or {}).items():
+            if target not in fund_id:
+                raise KeyError(f"Alias '{alias}' points to '{target}', which is not in the catalog.")
+            entries.append((alias, fund_id[target]))
+
+        self.exact: Dict[str, List[int]] = {}
+        self.vocab: Dict[str, int] = {}
+        rows, owner = [], []
+        for text, fid in entries:
+            norm = normalize(text)
+            self.exact.setdefault(norm, [])
+            if fid not in self.exact[norm]:
+                self.exact[norm].append(fid)
+            rows.append(sorted(self.vocab.setdefault(t, len(self.vocab)) for t in trigrams(norm)))
+            owner.append(fid)
+        self.owner = np.array(owner, dtype=np.int64)  # entry -> fund id
+        self.size = np.array([len(r) for r in rows], dtype=np.int64)
+        self.indptr = np.concatenate(([0], np.cumsum(self.size)))
+        # int32 ids halve the memory the per-query gathers and sorts touch.
+        self.grams = np.fromiter((g for r in rows for g in r), dtype=np.int32, count=int(self.indptr[-1]))
+        # Postings: the entries holding each trigram, grouped by trigram.
+        entry = np.repeat(np.arange(len(rows), dtype=np.int32), self.size)
+        order = np.argsort(self.grams, kind="stable")
+        self.postings = entry[order]
+        self.post_ptr = np.searchsorted(self.grams[order], np.arange(len(self.vocab) + 1))
+
+    def __len__(self) -> int:
+        return len(self.funds)
+
+    def _record(self, fid: int, score: float) -> NameMatch:
+        rec = self.catalog.record(self.funds[fid])
+        return NameMatch(rec.name, rec.isin, rec.asset_class, score)
+
+    def _rank(self, scored: Iterable[Tuple[int, float]], limit: int) -> List[NameMatch]:
+        """Best score per fund, one fund per ISIN, best first."""
+        out, seen = [], set()
+        for fid, score in sorted(scored, key=lambda x: (-x[1], self.funds[x[0]])):
+            m = self._record(fid, score)
+            key = m.isin or m.name
+            if key in seen:
+                continue
+            seen.add(key)
+            out.append(m)
+            if len(out) == limit:
+                break
+        return out
+
+    def _search(self, q: set, known: np.ndarray, df: np.ndarray, tau: float, limit: int) -> List[NameMatch]:
+        """Funds whose Dice score against trigram set q is at least tau; known: q's ids by ascending df."""
+        need = max(1, math.ceil(tau * len(q) / (2 - tau) - 1e-9))  # shared trigrams a match must have
+        if len(known) < need:
+            return []
+        # Any match shares one of the rarest len(known) - need + 1 trigrams.
+        # Reading on until twice as many postings prunes far more candidates
+        # than it costs.
+        read = np.cumsum(df)
+        p = len(known) - need + 1
+        p = max(p, int(np.searchsorted(read, 2 * read[p - 1], side="right")))
+        hits = np.concatenate([self.postings[self.post_ptr[g]:self.post_ptr[g + 1]] for g in known[:p]])
+        hits.sort()
+        first = np.flatnonzero(np.concatenate(([True], hits[1:] != hits[:-1])))
+        cand, seen = hits[first], np.diff(np.append(first, len(hits)))
+
+        # A name seen c times shares at most c + len(known) - p trigrams.
+        unread = len(known) - p
+        cand = cand[2 * (seen + unread) >= tau * (len(q) + self.size[cand]) - 1e-9]
+        if not len(cand):
+            return []
+
+        # Count every query trigram in each remaining row at once.
+        lens = self.size[cand]
+        offsets = np.concatenate(([0], np.cumsum(lens)[:-1]))
+        flat = self.grams[np.repeat(self.indptr[cand] - offsets, lens) + np.arange(int(lens.sum()))]
+        in_query = np.zeros(len(self.vocab), dtype=bool)
+        in_query[known] = True
+        shared = np.add.reduceat(in_query[flat], offsets, dtype=np.int64)
+        score = 2.0 * shared / (len(q) + lens)
+        keep = score >= tau - 1e-12
+        cand, score = cand[keep], score[keep]
+        if len(cand) > 8 * limit:
+            top = np.argpartition(-score, 8 * limit)[:8 * limit]
+            cand, score = cand[top], score[top]
+        return self._rank(zip(self.owner[cand].tolist(), score.tolist()), limit)
+
+    def candidates(self, query: str, limit: int = 5) -> List[NameMatch]:
+        """
+        The best funds for `query`, best first. The rarer the trigrams read,
+        the faster the search, so it first looks only for close matches
+        (STRICT_SCORE) and widens to min_score only if that cannot settle the
+        best match and everything within `margin` of it.
+        """
+        q = trigrams(normalize(query))
+        known = np.array([self.vocab[t] for t in q if t in self.vocab], dtype=np.int64)
+        df = self.post_ptr[known + 1] - self.post_ptr[known]
+        order = np.argsort(df, kind="stable")
+        known, df = known[order], df[order]
+        matches: List[NameMatch] = []
+        for tau in sorted({max(STRICT_SCORE, self.min_score), self.min_score}, reverse=True):
+            matches = self._search(q, known, df, tau, limit)
+            if matches and matches[0].score - self.margin >= tau:
+                break
+        return matches
+
+    def resolve(self, query: str, limit: int = 5) -> Resolution:
+        """
+        Ranked catalog funds for a free-text name or an ISIN, and whether the
+        best one can be trusted.
+        """
+        rec = self.catalog.by_isin(query.strip().upper())
+        if rec is not None:
+            return Resolution(query, [NameMatch(rec.name, rec.isin, rec.asset_class, 1.0)], True, False)
+        fids = self.exact.get(normalize(query))
+        if fids:
+            matches = self._rank(((f, 1.0) for f in fids), limit)
+            return Resolution(query, matches, True, len(matches) > 1 and matches[1].score >= 1.0)
+        matches = self.candidates(query, limit)
+        ambiguous = len(matches) > 1 and matches[0].score - matches[1].score < self.margin
+        return Resolution(query, matches, False, ambiguous)
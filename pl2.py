@@ -1,15 +1,37 @@
 from collections import defaultdict
+from types import MappingProxyType
 
-def split_reduction_among_satellites(core_pl, reduction_table, tree, pl_dicts, risk_index, satellite_classes):
+from cascade import effective_limits
+from hierarchy import IdentityCache, compile_tree
+from holdings import Overlay
+from leaflimits import LeafLimitTable, leaf_limit_table
+from waterfill import INF, split_sorted
+
+# Every allocator here returns new_portfolio as an Overlay on core_pl: only the
+# satellites and the parents they draw down are stored per portfolio, the rest
+# is read through. core_pl must stay unchanged while results are in use;
+# core_template() gives a read-only one, shared by every portfolio on a level
+# and risk.
+
+_templates = IdentityCache(maxsize=256)  # per (pl, risk)
+_level_tables = IdentityCache(maxsize=256)  # per pl, for the allocators given one level's dict
+
+
+def core_template(pl, risk_index, refresh=False):
+    """pl's allocations at risk_index as a read-only core_pl, built once and shared."""
+    return _templates.get(pl, lambda: MappingProxyType({k: a[risk_index] for k, a in pl.items()}), risk_index,
+                          refresh=refresh)
+
+def level_limit_table(pl, refresh=False):
+    """The leaf limits of the single level `pl` (e.g. PL4) as a LeafLimitTable, built once and shared."""
+    return _level_tables.get(pl, lambda: LeafLimitTable([("", pl)]), refresh=refresh)
+
+def split_reduction_among_satellites(core_pl, reduction_table, tree, pl_dicts, risk_index, satellite_classes, trace=None):
     # First, prepare to find parents and the right leaf PL for limits
     satellites_info = []
     for satellite_class in satellite_classes:
         parent_class = find_satellite_parent(tree, core_pl.keys(), satellite_class)
-        leaf_PL_name, leaf_PL = find_leaf_PL(pl_dicts, satellite_class)
-        if leaf_PL is not None:
-            leaf_limit = leaf_PL[satellite_class][risk_index]
-        else:
-            leaf_limit = 0
+        leaf_PL_name, leaf_limit = leaf_limit_table(pl_dicts).lookup(satellite_class, risk_index)
         satellites_info.append({
             'satellite_class': satellite_class,
             'parent_class': parent_class,
@@ -22,18 +44,25 @@ def split_reduction_among_satellites(core_pl, reduction_table, tree, pl_dicts, r
     for info in satellites_info:
         if info['parent_class']:
             satellites_by_parent[info['parent_class']].append(info)
+        elif trace is not None:
+            trace.skip(info['satellite_class'], "no parent in portfolio core.")
 
     # Make the new portfolio starting from core_pl
-    new_portfolio = core_pl.copy()
+    new_portfolio = Overlay(core_pl)
     results = []
 
     for parent_class, satellites in satellites_by_parent.items():
         headroom_total = core_pl[parent_class] * (reduction_table.get(parent_class, 0) / 100)
         even_share = headroom_total / len(satellites)
         parent_alloc = new_portfolio[parent_class]
+        if trace is not None:
+            trace.group(parent_class, None, core_pl[parent_class], reduction_table.get(parent_class, 0), headroom_total)
 
         for info in satellites:
             alloc = min(even_share, info['leaf_limit'])
+            if trace is not None:
+                trace.satellite(info['satellite_class'], info['satellite_class'], parent_class, parent_class,
+                                info['leaf_limit'], info['leaf_PL_name'], even_share, alloc)
             info['allocated'] = alloc
             info['parent_start_alloc'] = parent_alloc
             new_portfolio[info['satellite_class']] = alloc
@@ -47,294 +76,16 @@ def split_reduction_among_satellites(core_pl, reduction_table, tree, pl_dicts, r
 
     return new_portfolio, results
 
-def find_satellite_parent(tree, core_pl_keys, target, path=None):
-    """
-    Recursively find the closest ancestor of 'target' in the tree that is present in core_pl_keys.
-    Returns the name of that ancestor.
+def find_satellite_parent(tree, core_pl_keys, target):
     """
-    if path is None:
-        path = []
-
-    for name, node in tree.items():
-        new_path = path + [name]
-        if name == target:
-            # climb up the path to find first in core_pl_keys (ignoring the current node itself)
-            for parent in reversed(path):
-                if parent in core_pl_keys:
-                    return parent
-            return None
-        res = find_satellite_parent(node.get('children', {}), core_pl_keys, target, new_path)
-        if res:
-            return res
-    return None
-
-def max_satellite_allocation(core_pl, pl_name, reduction_table, tree, pl4, risk_index, satellite_class):
+    Find the closest ancestor of 'target' in the tree that is present in core_pl_keys.
+    Returns the name of that ancestor. The tree is compiled once and cached.
     """
-    Given the core portfolio allocations and parameters, returns:
-    - the relevant parent in core_pl
-    - that parent's allocation for this risk
-    - the max allowed satellite allocation considering reduction and leaf allocation
-    """
-    parent_class = find_satellite_parent(tree, core_pl.keys(), satellite_class)
-    if parent_class is None:
-        raise ValueError(f"No ancestor of {satellite_class} found in portfolio core.")
-
-    parent_alloc = core_pl[parent_class][risk_index]
-    reduction_pct = reduction_table.get(parent_class, 0)
-    reduction_limit = parent_alloc * (reduction_pct / 100)
-    leaf_limit = pl4.get(satellite_class, [0]*7)[risk_index]
-
-    satellite_alloc = min(reduction_limit, leaf_limit)
-    return {
-        'parent_class': parent_class,
-        'parent_alloc': parent_alloc,
-        'max_allocation': satellite_alloc,
-        'reduction_limit': reduction_limit,
-        'leaf_limit': leaf_limit,
-    }
-
-PL4 = {
-  "EQ_EM": [
-    0.36,
-    1.08,
-    2.16,
-    3.6,
-    5.4,
-    7.2,
-    7.2
-  ],
-  "EQ_US": [
-    1.8,
-    8.4,
-    16.8,
-    28,
-    42,
-    56,
-    56
-  ],
-  "EQ_JP": [
-    0.2,
-    0.6,
-    1.2,
-    2,
-    3,
-    4,
-    4
-  ],
-  "EQ_EU": [
-    2.64,
-    0.92,
-    3.84,
-    6.4,
-    9.6,
-    12.8,
-    12.8
-  ],
-  "BO_SEK": [
-    4.3,
-    16.75,
-    28.35,
-    28.35,
-    15.75,
-    0,
-    0
-  ],
-  "MM_SEK": [
-    86.0,
-    60.0,
-    25,
-    5,
-    0,
-    0,
-    0
-  ],
-  "HY_SEK": [
-    1.44,
-    3.61,
-    6.49,
-    6.49,
-    3.61,
-    0,
-    0
-  ],
-  "IG_SEK": [
-    2.26,
-    5.64,
-    10.16,
-    10.16,
-    5.64,
-    0,
-    0
-  ],
-  "EQ_SE": [
-    1.0,
-    3.0,
-    6,
-    10,
-    15,
-    20,
-    20
-  ]
-}
-
-PL3 = {
-  "EQ_SE": [
-    1.0,
-    3.0,
-    6,
-    10,
-    15,
-    20,
-    20
-  ],
-  "EQ_EM": [
-    0.36,
-    1.08,
-    2.16,
-    3.6,
-    5.4,
-    7.2,
-    7.2
-  ],
-  "EQ_WI": [
-    4.64,
-    9.92,
-    21.84,
-    36.4,
-    54.6,
-    72.8,
-    72.8
-  ],
-  "MM_SEK": [
-    86.0,
-    60.0,
-    25,
-    5,
-    0,
-    0,
-    0
-  ],
-  "BO_SEK": [
-    4.3,
-    16.75,
-    28.35,
-    28.35,
-    15.75,
-    0,
-    0
-  ],
-  "CR_SEK": [
-    3.7,
-    9.25,
-    16.65,
-    16.65,
-    9.25,
-    0,
-    0
-  ]
-}
-
-PL2 = {
-  "EQ_ACWI": [
-    5.0,
-    11.0,
-    24.0,
-    40.0,
-    60.0,
-    80.0,
-    80.0
-  ],
-  "FI_SEK": [
-    8.0,
-    26.0,
-    45.0,
-    45.0,
-    25.0,
-    0,
-    0
-  ],
-  "EQ_SE": [
-    1.0,
-    3.0,
-    6,
-    10,
-    15,
-    20,
-    20
-  ],
-  "MM_SEK": [
-    86.0,
-    60.0,
-    25,
-    5,
-    0,
-    0,
-    0
-  ]
-}
-
-
-reduction_table = {
-    'EQ_SE': 37.5,
-    'EQ_US': 37.5,
-    'EQ_EU': 37.5,
-    'EQ_JP': 37.5,
-    'EQ_EM': 37.5,
-    'BO_SEK': 37.5,
-    'IG_SEK': 37.5,
-    'HY_SEK': 37.5,
-    'MM_SEK': 37.5,
-    'EQ_WI': 25,
-    'CR_SEK': 25,
-    'EQ_ACWI': 12.5,
-    'FI_SEK': 12.5,
-}
-
+    return compile_tree(tree).nearest_ancestor_in(target, core_pl_keys)
 
 def node(pl2=None, pl3=None, pl4=None, children=None):
     return {'PL2': pl2, 'PL3': pl3, 'PL4': pl4, 'children': children or {}}
 
-# Now, fill in allocations where possible:
-risk_index = 5  # risk level 6 (since zero indexed)
-satellite_class = 'EQ_JP'
-
-# The tree structure from above (for finding parents)
-tree = {
-    "EQ_ACWI": {
-        'PL2': None, 'PL3': None, 'PL4': None,
-        "children": {
-            "EQ_WI": {'PL2': None, 'PL3': None, 'PL4': None,
-                "children": {
-                    "EQ_US": {'PL2': None, 'PL3': None, 'PL4': None, 'children': {}},
-                    "EQ_EU": {'PL2': None, 'PL3': None, 'PL4': None, 'children': {}},
-                    "EQ_JP": {'PL2': None, 'PL3': None, 'PL4': None, 'children': {}},
-                }
-            },
-            "EQ_EM": {'PL2': None, 'PL3': None, 'PL4': None, 'children': {}}
-        }
-    },
-    "EQ_SE": {'PL2': None, 'PL3': None, 'PL4': None, 'children': {}},
-    "FI_SEK": {'PL2': None, 'PL3': None, 'PL4': None, "children": {}},
-    "MM_SEK": {'PL2': None, 'PL3': None, 'PL4': None, 'children': {}}
-}
-
-# Find ancestor in core_pl for our satellite
-def find_satellite_parent(node, core_keys, target, path=None):
-    if path is None:
-        path = []
-    for name, entry in node.items():
-        new_path = path + [name]
-        if name == target:
-            # Climb up the path to find first in core_keys
-            for parent in reversed(path):
-                if parent in core_keys:
-                    return parent
-            return None
-        res = find_satellite_parent(entry.get('children', {}), core_keys, target, new_path)
-        if res:
-            return res
-    return None
-
 # Compute max allowed
 def max_satellite_allocation(core_pl, reduction_table, tree, pl4, risk_index, satellite_class):
     parent_class = find_satellite_parent(tree, core_pl.keys(), satellite_class)
@@ -343,7 +94,7 @@ def max_satellite_allocation(core_pl, reduction_table, tree, pl4, risk_index, sa
     parent_alloc = core_pl[parent_class]
     reduction_pct = reduction_table.get(parent_class, 0)
     reduction_limit = parent_alloc * (reduction_pct / 100)
-    leaf_limit = pl4.get(satellite_class, [0]*7)[risk_index]
+    leaf_limit = level_limit_table(pl4).limit(satellite_class, risk_index)
     satellite_alloc = min(reduction_limit, leaf_limit)
     return {
         'parent_class': parent_class,
@@ -352,30 +103,31 @@ def max_satellite_allocation(core_pl, reduction_table, tree, pl4, risk_index, sa
         'reduction_limit': reduction_limit,
         'leaf_limit': leaf_limit,
     }
-core_pl = {'EQ_SE': 20, 'EQ_EM': 7.2, 'EQ_WI': 72.8, 'MM_SEK': 0, 'BO_SEK': 0, 'CR_SEK': 0}
 
-from collections import defaultdict
-
-def add_satellites(core_pl, reduction_table, tree, pl4, risk_index, satellite_classes):
-    # Copy so we don't modify original
-    new_portfolio = core_pl.copy()
+def add_satellites(core_pl, reduction_table, tree, pl4, risk_index, satellite_classes, trace=None):
+    # Overlay so we don't modify original
+    new_portfolio = Overlay(core_pl)
     # Track, for each parent, total reduction allocated
     reduction_used = defaultdict(float)
     satellite_results = []
+    leaves = level_limit_table(pl4)
 
     for satellite_class in satellite_classes:
         # 1. Find parent in portfolio tree
         parent_class = find_satellite_parent(tree, core_pl.keys(), satellite_class)
         if parent_class is None:
-            print(f"Skipping {satellite_class}: no parent in portfolio core.")
+            if trace is not None:
+                trace.skip(satellite_class, "no parent in portfolio core.")
             continue
 
         parent_alloc = new_portfolio[parent_class]
         reduction_pct = reduction_table.get(parent_class, 0)
         reduction_max_total = core_pl[parent_class] * (reduction_pct / 100)  # Allowed headroom *at start*
+        if trace is not None and parent_class not in reduction_used:
+            trace.group(parent_class, None, core_pl[parent_class], reduction_pct, reduction_max_total)
         reduction_remaining = reduction_max_total - reduction_used[parent_class]
 
-        leaf_limit = pl4.get(satellite_class, [0]*7)[risk_index]
+        leaf_limit = leaves.limit(satellite_class, risk_index)
         # Satellite fund can be at most its leaf allocation or remaining reduction headroom, whichever is smaller
         allowed = min(reduction_remaining, leaf_limit)
 
@@ -384,6 +136,9 @@ def add_satellites(core_pl, reduction_table, tree, pl4, risk_index, satellite_cl
             new_portfolio[satellite_class] = allowed
             new_portfolio[parent_class] -= allowed
             reduction_used[parent_class] += allowed
+        if trace is not None:
+            trace.satellite(satellite_class, satellite_class, parent_class, parent_class,
+                            leaf_limit, None, reduction_remaining, max(allowed, 0.0))
 
         satellite_results.append({
             'satellite_class': satellite_class,
@@ -402,11 +157,11 @@ def add_satellites(core_pl, reduction_table, tree, pl4, risk_index, satellite_cl
 # EXAMPLE USAGE:
 
 def find_leaf_PL(pl_dicts, satellite_class):
-  for name, pl in reversed(pl_dicts):  # start from the finest
-    if satellite_class in pl:
-      return name, pl
-  return None, None  # not found
-def add_satellites_dynamic(core_pl, reduction_table, tree, pl_dicts, risk_index, satellite_classes):
+  name = leaf_limit_table(pl_dicts).source_of(satellite_class)  # the finest PL with the class
+  if name is None:
+    return None, None  # not found
+  return name, dict(pl_dicts)[name]
+def add_satellites_dynamic(core_pl, reduction_table, tree, pl_dicts, risk_index, satellite_classes, trace=None):
     """
     Adds satellites and always uses the most detailed available PL
     for each satellite as the leaf limit.
@@ -414,33 +169,36 @@ def add_satellites_dynamic(core_pl, reduction_table, tree, pl_dicts, risk_index,
     Returns: new_portfolio, [per-satellite info]
     """
     from collections import defaultdict
-    new_portfolio = core_pl.copy()
+    new_portfolio = Overlay(core_pl)
     reduction_used = defaultdict(float)
     satellite_results = []
+    leaves = leaf_limit_table(pl_dicts)
 
     for satellite_class in satellite_classes:
         parent_class = find_satellite_parent(tree, core_pl.keys(), satellite_class)
         if parent_class is None:
-            print(f"Skipping {satellite_class}: no parent in portfolio core.")
+            if trace is not None:
+                trace.skip(satellite_class, "no parent in portfolio core.")
             continue
 
         parent_alloc = new_portfolio[parent_class]
         reduction_pct = reduction_table.get(parent_class, 0)
         reduction_max_total = core_pl[parent_class] * (reduction_pct / 100)
+        if trace is not None and parent_class not in reduction_used:
+            trace.group(parent_class, None, core_pl[parent_class], reduction_pct, reduction_max_total)
         reduction_remaining = reduction_max_total - reduction_used[parent_class]
 
-        # --- DYNAMIC leaf/PL lookup here ---
-        leaf_PL_name, leaf_PL = find_leaf_PL(pl_dicts, satellite_class)
-        if leaf_PL is not None:
-            leaf_limit = leaf_PL[satellite_class][risk_index]
-        else:
-            leaf_limit = 0  # not found
+        # --- DYNAMIC leaf/PL lookup here (0 if not found) ---
+        leaf_PL_name, leaf_limit = leaves.lookup(satellite_class, risk_index)
 
         allowed = min(reduction_remaining, leaf_limit)
         if allowed > 0:
             new_portfolio[satellite_class] = allowed
             new_portfolio[parent_class] -= allowed
             reduction_used[parent_class] += allowed
+        if trace is not None:
+            trace.satellite(satellite_class, satellite_class, parent_class, parent_class,
+                            leaf_limit, leaf_PL_name, reduction_remaining, max(allowed, 0.0))
 
         satellite_results.append({
             'satellite_class': satellite_class,
@@ -456,22 +214,14 @@ def add_satellites_dynamic(core_pl, reduction_table, tree, pl_dicts, risk_index,
         })
 
     return new_portfolio, satellite_results
-# core_pl, reduction_table, tree, PL4, risk_index as above
-
-# List/dict of available PLs, from least to most detailed
-pl_dicts = [('PL2', PL2), ('PL3', PL3), ('PL4', PL4)]
 
-core_pl = {k: PL2[k][5] for k in PL2}      # PL2 at risk 6
-satellites = ['EQ_WI', 'EQ_JP', 'EQ_US'] 
-risk_index = 5
-
-def split_reduction_with_leaf_limits(core_pl, reduction_table, tree, pl_dicts, risk_index, satellite_classes):
+def split_reduction_with_leaf_limits(core_pl, reduction_table, tree, pl_dicts, risk_index, satellite_classes, trace=None):
     # Prepare lookup tables as before
     satellites_info = []
+    leaves = leaf_limit_table(pl_dicts)
     for satellite_class in satellite_classes:
         parent_class = find_satellite_parent(tree, core_pl.keys(), satellite_class)
-        leaf_PL_name, leaf_PL = find_leaf_PL(pl_dicts, satellite_class)
-        leaf_limit = leaf_PL[satellite_class][risk_index] if leaf_PL is not None else 0
+        leaf_PL_name, leaf_limit = leaves.lookup(satellite_class, risk_index)
         satellites_info.append({
             'satellite_class': satellite_class,
             'parent_class': parent_class,
@@ -483,8 +233,10 @@ def split_reduction_with_leaf_limits(core_pl, reduction_table, tree, pl_dicts, r
     for info in satellites_info:
         if info['parent_class']:
             satellites_by_parent[info['parent_class']].append(info)
+        elif trace is not None:
+            trace.skip(info['satellite_class'], "no parent in portfolio core.")
 
-    new_portfolio = core_pl.copy()
+    new_portfolio = Overlay(core_pl)
     results = []
 
     for parent_class, satellites in satellites_by_parent.items():
@@ -492,9 +244,14 @@ def split_reduction_with_leaf_limits(core_pl, reduction_table, tree, pl_dicts, r
         satellites = sorted(satellites, key=lambda x: x['leaf_limit'])  # Allocate small first if you want
         
         parent_alloc = new_portfolio[parent_class]
+        if trace is not None:
+            trace.group(parent_class, None, core_pl[parent_class], reduction_table.get(parent_class, 0), headroom_total)
 
         for info in satellites:
             allowed = min(info['leaf_limit'], headroom_total)
+            if trace is not None:
+                trace.satellite(info['satellite_class'], info['satellite_class'], parent_class, parent_class,
+                                info['leaf_limit'], info['leaf_PL_name'], headroom_total, allowed)
             info['allocated'] = allowed
             info['parent_start_alloc'] = parent_alloc
             new_portfolio[info['satellite_class']] = allowed
@@ -509,28 +266,116 @@ def split_reduction_with_leaf_limits(core_pl, reduction_table, tree, pl_dicts, r
 
     return new_portfolio, results
 
-# --- Usage Example (same as before) ---
-
-core_pl = {k: PL3[k][5] for k in PL3}  # PL3 at risk 6
-satellites = ['EQ_US', "EQ_EU"]
-pl_dicts = [('PL2', PL2), ('PL3', PL3), ('PL4', PL4)]
-risk_index = 5
-
-
-new_portfolio, satinfo = split_reduction_with_leaf_limits(core_pl, reduction_table, tree, pl_dicts, risk_index, satellites)
-
-print("New portfolio with improved fill:")
-for k, v in new_portfolio.items():
-    print(f"{k}: {v:.2f}%")
-
-print("\nSatellite allocation details:")
-for sat in satinfo:
-    print(
-        f"{sat['satellite_class']}: allocated {sat['allocated']:.2f}% (parent: {sat['parent_class']})," +
-        f" leaf limit: {sat['leaf_limit']:.2f}%, parent now {sat['parent_end_alloc']:.2f}%"
-    )
+def split_reduction_cascading(core_pl, reduction_table, tree, pl_dicts, risk_index, satellite_classes, trace=None):
+    """
+    Satellites draw from their nearest core ancestor, as in
+    split_reduction_with_leaf_limits, but each core's headroom is water-filled:
+    every satellite gets an equal share, capped by its limit, and what a capped
+    one leaves goes to the rest (like Portfolio.add_satellites), rather than
+    filled smallest leaf limit first. So at PL2 risk 5, EQ_US and EQ_EU under
+    EQ_ACWI get 5 each here where the greedy split gives EQ_EU 10 and EQ_US 0.
+    On top of that, every class between a core and its satellites caps what
+    the satellites under it take in total, at its leaf-table allocation times
+    its reduction_table percentage; classes with no reduction entry do not
+    cap. The caps are solved over the whole hierarchy in one post-order pass
+    (see cascade.py). Results come back in input order, with 'capped_by'
+    naming the class whose cap bound, if any (also in the trace).
+    """
+    h = compile_tree(tree)
+    leaves = leaf_limit_table(pl_dicts)
+    satellites_info, nodes, cores, limits = [], [], [], []
+    for satellite_class in satellite_classes:
+        parent_class = find_satellite_parent(tree, core_pl.keys(), satellite_class)
+        if parent_class is None:
+            if trace is not None:
+                trace.skip(satellite_class, "no parent in portfolio core.")
+            continue
+        leaf_PL_name, leaf_limit = leaves.lookup(satellite_class, risk_index)
+        satellites_info.append({
+            'satellite_class': satellite_class,
+            'parent_class': parent_class,
+            'leaf_PL_name': leaf_PL_name,
+            'leaf_limit': leaf_limit
+        })
+        nodes.append(h.index[satellite_class])
+        cores.append(h.index[parent_class])
+        limits.append(leaf_limit)
+
+    def cap_of(i):
+        name = h.names[i]
+        if name not in reduction_table or name not in leaves:
+            return INF
+        return leaves.limit(name, risk_index) * reduction_table[name] / 100
+
+    eff, bound, groups = effective_limits(h, nodes, cores, limits, cap_of)
+
+    new_portfolio = Overlay(core_pl)
+    for core, order in groups.items():
+        parent_class = h.names[core]
+        pct = reduction_table.get(parent_class, 0)
+        headroom_total = core_pl[parent_class] * (pct / 100)
+        level, drawn = split_sorted([eff[s] for s in order], headroom_total)
+        if trace is not None:
+            trace.group(parent_class, None, core_pl[parent_class], pct, headroom_total)
+        for s in order:
+            info = satellites_info[s]
+            allowed = min(eff[s], level)
+            capped_by = h.names[bound[s]] if bound[s] is not None and allowed >= eff[s] else None
+            info.update(effective_limit=eff[s], capped_by=capped_by, allocated=allowed, reduction_used=allowed)
+            new_portfolio[info['satellite_class']] = new_portfolio.get(info['satellite_class'], 0) + allowed
+            if trace is not None:
+                trace.satellite(info['satellite_class'], info['satellite_class'], parent_class, parent_class,
+                                info['leaf_limit'], info['leaf_PL_name'], level, allowed, capped_by=capped_by)
+        new_portfolio[parent_class] -= drawn
+
+    return new_portfolio, satellites_info
+
+class _CoreKey(tuple):
+    """core_pl's items as a tuple that is hashed once, however many lookups use it."""
+    def __hash__(self):
+        h = self.__dict__.get("hash")
+        if h is None:
+            h = self.__dict__["hash"] = tuple.__hash__(self)
+        return h
+
+_core_keys = IdentityCache(maxsize=256)
+
+def _core_key(core_pl):
+    if isinstance(core_pl, MappingProxyType):  # read-only, e.g. from core_template(): key it once
+        return _core_keys.get(core_pl, lambda: _CoreKey(core_pl.items()))
+    return tuple(core_pl.items())
+
+def split_reduction_with_leaf_limits_cached(core_pl, reduction_table, tree, pl_dicts, risk_index, satellite_classes, cache):
+    """
+    split_reduction_with_leaf_limits behind an AllocationCache, with the same
+    results in the same order. Only the order of satellites with equal leaf
+    limits changes an allocation, so the key lists the satellites sorted by
+    leaf limit and every input order that agrees on the ties shares one
+    entry. The overlay and the result dicts are fresh, so callers may modify them.
+    """
+    leaves = leaf_limit_table(pl_dicts)
+    sats = tuple(sorted(satellite_classes, key=lambda s: leaves.limit(s, risk_index)))
+    key = (_core_key(core_pl), risk_index, sats)
+    def compute():
+        # Only the overlay's own entries are cached; the key pins the core they apply to.
+        new_portfolio, results = split_reduction_with_leaf_limits(core_pl, reduction_table, tree, pl_dicts, risk_index, sats)
+        return dict(new_portfolio.changes), results
+
+    cached, results = cache.get_or_compute(cache.fingerprint_of(pl_dicts, reduction_table, tree), key, compute)
+    # Each group keeps its leaf order; groups go back to the order their first satellite was given in.
+    parent_of = {info['satellite_class']: info['parent_class'] for info in results}
+    groups = defaultdict(list)
+    for info in results:
+        groups[info['parent_class']].append(dict(info))
+    ordered = [info for p in dict.fromkeys(parent_of[s] for s in satellite_classes if s in parent_of)
+               for info in groups[p]]
+    changes = {k: v for k, v in cached.items() if k in core_pl}
+    for info in ordered:
+        changes[info['satellite_class']] = cached[info['satellite_class']]
+    return Overlay(core_pl, changes), ordered
 
 def fineprint():
+  from pldata import PL2, PL3, PL4
   def print_pl_table(pl, pl_name="PL"):
     # Collect all asset classes
     asset_classes = sorted(pl.keys())
@@ -555,3 +400,27 @@ def fineprint():
   print_pl_table(PL2, "PL2")
   print_pl_table(PL3, "PL3")
   print_pl_table(PL4, "PL4")
+
+
+if __name__ == "__main__":
+    from pldata import PL3, pl_dicts, reduction_table, tree
+
+    # --- Usage Example (same as before) ---
+
+    core_pl = core_template(PL3, 5)  # PL3 at risk 6
+    satellites = ['EQ_US', "EQ_EU"]
+    risk_index = 5
+
+
+    new_portfolio, satinfo = split_reduction_with_leaf_limits(core_pl, reduction_table, tree, pl_dicts, risk_index, satellites)
+
+    print("New portfolio with improved fill:")
+    for k, v in new_portfolio.items():
+        print(f"{k}: {v:.2f}%")
+
+    print("\nSatellite allocation details:")
+    for sat in satinfo:
+        print(
+            f"{sat['satellite_class']}: allocated {sat['allocated']:.2f}% (parent: {sat['parent_class']})," +
+            f" leaf limit: {sat['leaf_limit']:.2f}%, parent now {sat['parent_end_alloc']:.2f}%"
+        )
@@ -0,0 +1,55 @@
+import json
+import os
+from typing import Dict, List, NamedTuple, Tuple
+
+# ==============================================================================
+# SHARED MODEL DATA
+# ==============================================================================
+# The PL tables, reduction_table and asset-class tree live in data/rules.json,
+# levels ordered from least to most detailed. Importing this module reads
+# nothing: the rules are loaded on first use and kept for the process. The
+# file is small enough that json parses it as fast as a pickled snapshot
+# loads, so unlike the catalog it has none. The module-level names PL2, PL3,
+# PL4, pl_dicts, reduction_table and tree still work and load the rules when
+# first touched.
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+RULES_PATH = os.path.join(DATA_DIR, "rules.json")
+CATALOG_PATH = os.path.join(DATA_DIR, "catalog.csv")
+
+
+class RulesData(NamedTuple):
+    pl_dicts: List[Tuple[str, dict]]
+    reduction_table: Dict[str, float]
+    tree: dict
+
+
+def parse_rules(path: str) -> RulesData:
+    with open(path, encoding="utf-8") as f:
+        doc = json.load(f)
+    return RulesData(list(doc["levels"].items()), doc["reduction_table"], doc["tree"])
+
+
+_rules: Dict[str, RulesData] = {}
+
+def load_rules(path: str = RULES_PATH, refresh: bool = False) -> RulesData:
+    """
+    The rules in `path`, loaded once per process; every call returns the same
+    objects. refresh=True reads the file again.
+    """
+    r = _rules.get(path)
+    if r is None or refresh:
+        r = _rules[path] = parse_rules(path)
+    return r
+
+
+def __getattr__(name: str):
+    if name.startswith("__"):  # e.g. __path__, probed by every `from pldata import ...`
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    r = load_rules()
+    if name in RulesData._fields:
+        return getattr(r, name)
+    levels = dict(r.pl_dicts)
+    if name in levels:
+        return levels[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
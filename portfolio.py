@@ -0,0 +1,396 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Collection, Mapping, NamedTuple, Optional, Dict, List, Tuple
+from collections import defaultdict
+
+from allocation_cache import AllocationCache, rules_fingerprint, satellite_key
+from allocation_trace import AllocationTrace, binding_constraint
+from hierarchy import compile_tree
+from holdings import HELD, NO_GROUP, SATELLITE, FundRegistry, HoldingStore, HoldingView
+from leaflimits import LeafLimitTable
+from waterfill import WaterFill, split_sorted
+
+# ==============================================================================
+# 1. THE "RULEBOOK" DATACLASSES
+# ==============================================================================
+@dataclass(frozen=True, eq=True, slots=True)
+class AssetClass:
+    name: str; parent: Optional['AssetClass'] = None
+    children: Mapping[str, 'AssetClass'] = field(default_factory=lambda: MappingProxyType({}), hash=False, compare=False)
+    def find_ancestor_in(self, names: Collection[str]) -> Optional['AssetClass']:
+        c = self
+        while c:
+            if c.name in names: return c
+            c = c.parent
+        return None
+@dataclass(frozen=True, slots=True)
+class PortfolioLevel:
+    name: str; allocations: Mapping[str, Tuple[float, ...]]
+    def get_allocation(self, name: str, risk: int) -> float:
+        a = self.allocations.get(name)
+        if a and 0 <= risk < len(a): return a[risk]
+        return 0.0
+class AllocationRules:
+    """
+    An immutable snapshot of the PL tables, reduction_table and tree, so any
+    number of threads can read one without locks; new tables make a new
+    snapshot, swapped in through a RulesStore. `version` defaults to a prefix
+    of the content fingerprint.
+
+    Two per-snapshot caches do grow after __init__, because what goes in them
+    depends on the clients' funds: `funds`, the append-only FundRegistry that
+    registers new funds under its own lock, and `_templates`, the core
+    templates by (level, risk, core funds). Neither changes anything already
+    handed out: a template is built off to the side and never written to
+    again (portfolios fork it), and two threads racing on one key build equal
+    templates, so whichever lands is as good as the other.
+    """
+    __slots__ = ("_rt", "pl_dicts", "asset_classes", "hierarchy", "portfolio_levels", "_universes", "_templates",
+                 "fingerprint", "version", "leaf_limits", "funds", "_frozen")
+    def __init__(self, pls: List[Tuple[str, dict]], rt: dict, t: dict, version: Optional[str] = None):
+        pls = [(n, {cn: tuple(a) for cn, a in d.items()}) for n, d in pls]
+        self.pl_dicts = tuple((n, MappingProxyType(d)) for n, d in pls)  # one object, for the id()-keyed caches
+        self._rt = MappingProxyType(dict(rt))
+        self.asset_classes = self._build_tree(pls, t)
+        self.portfolio_levels = MappingProxyType({n: PortfolioLevel(n, d) for n, d in self.pl_dicts})
+        self._templates: Dict[tuple, CoreTemplate] = {}
+        self.fingerprint = rules_fingerprint(pls, rt, t)
+        self.version = version or self.fingerprint[:12]
+        # Levels in name order, so "PL4" outranks "PL3" as the leaf source.
+        self.leaf_limits = LeafLimitTable([(n, self.portfolio_levels[n].allocations) for n in sorted(self.portfolio_levels)])
+        num_risks = max((len(a) for _, d in pls for a in d.values()), default=0)
+        self._universes = tuple(self._universe(r) for r in range(num_risks))
+        self.funds = FundRegistry()  # fund ids shared by every portfolio on these rules
+        self._frozen = True
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False): raise AttributeError(f"AllocationRules is immutable; cannot set '{name}'.")
+        object.__setattr__(self, name, value)
+    def _build_tree(self, pls, t: dict) -> Mapping[str, AssetClass]:
+        self.hierarchy = h = compile_tree(t)
+        names = {cn for _, d in pls for cn in d}
+        # Preorder, so each class is built after its parent and can take it in
+        # its constructor; a subtree is only wired while every node above it is
+        # a known asset class. Children dicts are filled here, before anything
+        # can see them, and only handed out read-only.
+        acm: Dict[str, AssetClass] = {}
+        kids: Dict[str, Dict[str, AssetClass]] = {}
+        wired = set()
+        for i, n in enumerate(h.names):
+            pi = h.parent[i]
+            if n not in names or h.index[n] != i or (pi >= 0 and pi not in wired): continue
+            wired.add(i)
+            p = acm[h.names[pi]] if pi >= 0 else None
+            kids[n] = {}
+            acm[n] = AssetClass(n, p, MappingProxyType(kids[n]))
+            if p: kids[p.name][n] = acm[n]
+        for cn in names - acm.keys():  # not in the tree: a root without children
+            acm[cn] = AssetClass(cn)
+        return MappingProxyType({cn: acm[cn] for _, d in pls for cn in d})
+    @property
+    def reduction_table(self) -> Mapping[str, float]: return self._rt
+    def get_asset_class(self, n: str) -> Optional[AssetClass]: return self.asset_classes.get(n)
+    def get_portfolio_level(self, n: str) -> Optional[PortfolioLevel]: return self.portfolio_levels.get(n)
+    def get_reduction_pct(self, n: str) -> float: return self._rt.get(n, 0.0)
+    def find_leaf_allocation(self, n: str, r: int) -> float: return self.leaf_limits.limit(n, r)
+    def find_leaf_source(self, n: str) -> Optional[str]: return self.leaf_limits.source_of(n)
+    def limit_universe(self, r: int) -> List[float]:
+        """Every leaf limit a satellite can have at risk r (0 for unknown classes)."""
+        return self._universes[r] if 0 <= r < len(self._universes) else self._universe(r)
+    def _universe(self, r: int) -> List[float]:
+        return sorted({0.0, *(self.leaf_limits.limit(n, r) for n in self.leaf_limits.index)})
+    def core_template(self, pl_name: str, risk: int, funds: Mapping[str, 'Fund']) -> 'CoreTemplate':
+        """The core holdings of a level at a risk, built once per distinct set of core funds and shared."""
+        key = (pl_name, risk, tuple((cn, f.name, f.asset_class.name) for cn, f in funds.items()))
+        t = self._templates.get(key)
+        if t is not None: return t
+        level = self.get_portfolio_level(pl_name)
+        if not level: raise ValueError(f"PL '{pl_name}' not found.")
+        reg, held, core = self.funds, {}, {}  # fund id -> allocation; a fund listed twice keeps its first place
+        for cn, _ in level.allocations.items():
+            fund = funds.get(cn)
+            if fund:
+                alloc = level.get_allocation(cn, risk)
+                if alloc > 0:
+                    fid = reg.intern(fund)
+                    held[fid] = alloc
+                    core[cn] = fid
+        store = HoldingStore(reg)
+        store.extend(held, held.values(), HELD)
+        # A fork has its rows settled, so forking it in turn leaves it as it is.
+        t = CoreTemplate(store.fork(), MappingProxyType(core), tuple(sorted(core)))
+        if len(self._templates) < MAX_CORE_TEMPLATES:  # past that, odd cores are built per portfolio
+            self._templates[key] = t
+        return t
+
+MAX_CORE_TEMPLATES = 4096
+
+class CoreTemplate(NamedTuple):
+    """Frozen core holdings; each portfolio on them starts from holdings.fork() (copy on write)."""
+    holdings: HoldingStore
+    core: Mapping[str, int]  # core class -> id of the fund held for it
+    classes: Tuple[str, ...]  # the core classes sorted, as AllocationCache keys list them
+
+class RulesStore:
+    """
+    The current AllocationRules. Readers take `current` once per allocation
+    and keep that snapshot however long it runs; reload() builds and checks
+    the next snapshot off to the side and publishes it with one assignment,
+    so nobody waits on a lock and nothing in flight sees a half-built tree.
+    """
+    def __init__(self, rules: AllocationRules):
+        self.current = rules
+        self._executor: Optional[ThreadPoolExecutor] = None
+    def publish(self, rules: AllocationRules) -> AllocationRules:
+        """Swap in `rules`; returns the snapshot it replaced."""
+        old, self.current = self.current, rules
+        return old
+    def build(self, pls: List[Tuple[str, dict]], rt: dict, t: dict, validate: bool = True) -> AllocationRules:
+        """A new snapshot, refused with ValueError if the PL tables are inconsistent."""
+        if validate:
+            from validation import check_levels  # numpy, only once something is reloaded
+            check_levels(pls, t)
+        return AllocationRules(pls, rt, t)
+    def reload(self, pls: List[Tuple[str, dict]], rt: dict, t: dict, validate: bool = True) -> "Future[AllocationRules]":
+        """Build the next snapshot in a background thread and publish it; the future holds it (or the error)."""
+        def run() -> AllocationRules:
+            rules = self.build(pls, rt, t, validate)
+            self.publish(rules)
+            return rules
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix="rules-reload")
+        return self._executor.submit(run)
+
+# ==============================================================================
+# 2. THE "PORTFOLIO" DATACLASSES
+# ==============================================================================
+
+@dataclass(slots=True)
+class Fund:
+    name: str
+    asset_class: AssetClass
+
+@dataclass(slots=True)
+class PortfolioHolding:
+    """A detached holding; Portfolio.holdings hands out HoldingViews with the same fields."""
+    fund: Fund
+    allocation: float
+    is_satellite: bool = False
+    leaf_limit: Optional[float] = None
+    competing_share: Optional[float] = None
+
+class _SatelliteGroup:
+    """Headroom of one core fund. Its satellites are the store rows whose group is the core fund's id."""
+    __slots__ = ("core_fund", "core_class", "budget", "headroom", "universe", "_fill", "level")
+
+    def __init__(self, core_fund: int, core_class: str, budget: float, headroom: float, universe):
+        self.core_fund, self.core_class = core_fund, core_class
+        self.budget, self.headroom, self.universe = budget, headroom, universe
+        self._fill: Optional[WaterFill] = None
+        self.level = 0.0
+
+    def fill(self, store: HoldingStore) -> WaterFill:
+        """Fenwick index for single-satellite edits, built on first use."""
+        if self._fill is None:
+            self._fill = WaterFill(self.universe)
+            for r in store.rows_in_group(self.core_fund): self._fill.add(store.leaf[r])
+        return self._fill
+
+    def split(self, store: HoldingStore, rows: Optional[List[int]] = None) -> Tuple[float, float]:
+        if rows is None: rows = store.rows_in_group(self.core_fund)
+        return split_sorted(sorted([store.leaf[r] for r in rows]), self.headroom)
+
+class Portfolio:
+    __slots__ = ("name", "rules", "holdings", "_core", "_core_key", "risk", "pl_name", "_groups")
+
+    def __init__(self, name: str, rules: AllocationRules):
+        self.name, self.rules = name, rules
+        self.holdings = HoldingStore(rules.funds)
+        self._core: Mapping[str, int] = {}  # core class -> id of the fund held for it
+        self._core_key: Tuple[str, ...] = ()  # its classes sorted, for cache keys
+        self.risk: Optional[int] = None
+        self.pl_name: Optional[str] = None
+        self._groups: Dict[int, _SatelliteGroup] = {}  # core fund id -> its satellites' headroom
+
+    @property
+    def core_asset_classes(self) -> List[str]:
+        return list(self._core)
+
+    @classmethod
+    def build_from_level(cls, name: str, pl_name: str, risk: int, funds: Dict[str, Fund], rules: AllocationRules):
+        # Accounts on the same core share its rows until their satellites draw on it.
+        t = rules.core_template(pl_name, risk, funds)
+        p = cls(name, rules)
+        p.risk, p.pl_name = risk, pl_name
+        p.holdings, p._core, p._core_key = t.holdings.fork(), t.core, t.classes
+        return p
+
+    def _trace_groups(self, trace: AllocationTrace, core_funds):
+        """Record each group's headroom and every satellite's split in it."""
+        st = self.holdings
+        for gfid in core_funds:
+            g = self._groups[gfid]
+            trace.group(g.core_class, st.name(st.row(gfid)), g.budget, self.rules.get_reduction_pct(g.core_class),
+                        g.headroom)
+            share = g.level if g.level != float("inf") else g.headroom
+            for r in st.rows_in_group(gfid):
+                fund, lim = st.registry.funds[st.fund[r]], st.leaf[r]
+                ac = fund.asset_class
+                trace.satellite(fund.name, ac.name, ac.parent.name if ac.parent else None, g.core_class,
+                                lim, self.rules.find_leaf_source(ac.name), share, min(lim, g.level))
+
+    def _core_fund_for(self, fund: Fund) -> Optional[int]:
+        """Id of the core fund holding the nearest core ancestor of the fund's class."""
+        ancestor = fund.asset_class.find_ancestor_in(self._core)
+        if ancestor:
+            fid = self._core[ancestor.name]
+            if self.holdings.row(fid) >= 0:
+                return fid
+        return None
+
+    def _set_risk(self, risk_index: Optional[int]) -> int:
+        if risk_index is None:
+            if self.risk is None: raise ValueError("No risk level given for this portfolio.")
+            return self.risk
+        if self._groups and risk_index != self.risk:
+            raise ValueError(f"Portfolio already holds satellites at risk index {self.risk}.")
+        self.risk = risk_index
+        return risk_index
+
+    def _attach(self, fund: Fund, core_fund: int, risk_index: int, lim: Optional[float] = None) -> _SatelliteGroup:
+        st = self.holdings
+        g = self._groups.get(core_fund)
+        if g is None:
+            core_class = st.registry.funds[core_fund].asset_class.name
+            budget = st.alloc[st.row(core_fund)]
+            headroom = budget * (self.rules.get_reduction_pct(core_class) / 100)
+            g = self._groups[core_fund] = _SatelliteGroup(
+                core_fund, core_class, budget, headroom, self.rules.limit_universe(risk_index))
+        if lim is None:
+            lim = self.rules.find_leaf_allocation(fund.asset_class.name, risk_index)
+        if g._fill is not None: g._fill.add(lim)
+        st.append(fund, 0.0, SATELLITE, lim, group=core_fund)
+        return g
+
+    def _refresh(self, g: _SatelliteGroup, split: Optional[Tuple[float, float]] = None,
+                 rows: Optional[List[int]] = None):
+        """Re-split a group's headroom: O(log n) for the level, then write holdings."""
+        st = self.holdings
+        st.own()
+        g.level, drawn = split if split is not None else g.fill(st).split(g.headroom)
+        share = g.level if g.level != float("inf") else g.headroom
+        st.alloc[st.row(g.core_fund)] = g.budget - drawn
+        for r in (st.rows_in_group(g.core_fund) if rows is None else rows):
+            alloc = min(st.leaf[r], g.level)
+            if alloc > 0:
+                st.alloc[r], st.share[r] = alloc, share
+                st.set_held(r, True)
+            else:
+                st.alloc[r] = 0.0
+                st.set_held(r, False)
+
+    def _cache_key(self, risk_index: int, rows: Dict[int, List[int]]):
+        """rows: every group's satellite rows."""
+        st = self.holdings
+        names, fund_class = st.registry.class_names, st.registry.fund_class
+        sats = (names[fund_class[st.fund[r]]] for group_rows in rows.values() for r in group_rows)
+        return (self.pl_name, risk_index, self._core_key, satellite_key(sats))
+
+    def add_satellites(self, satellite_funds: List[Fund], risk_index: int, cache: Optional[AllocationCache] = None,
+                       trace: Optional[AllocationTrace] = None):
+        risk_index = self._set_risk(risk_index)
+        st = self.holdings
+        s_by_cf, seen = defaultdict(list), set()
+        for sf in satellite_funds:
+            if sf.name in seen or st.row_of(sf.name) >= 0: continue
+            seen.add(sf.name)
+            gfid = self._core_fund_for(sf)
+            if gfid is not None: s_by_cf[gfid].append(sf)
+            elif trace is not None: trace.skip(sf.name, "no parent in portfolio core.")
+
+        leaf = self.rules.leaf_limits.limit
+        for gfid, sfs in s_by_cf.items():
+            # Smallest leaf limit first, the order new holdings have always appeared in.
+            for lim, sf in sorted(((leaf(sf.asset_class.name, risk_index), sf) for sf in sfs), key=lambda t: t[0]):
+                self._attach(sf, gfid, risk_index, lim)
+        caching = cache is not None and self.pl_name is not None
+        rows = {gfid: st.rows_in_group(gfid) for gfid in (self._groups if caching else s_by_cf)}
+        splits = key = None
+        if caching:
+            key = self._cache_key(risk_index, rows)
+            splits = cache.get(self.rules.fingerprint, key)
+        if splits is None:
+            splits = {self._groups[gfid].core_class: self._groups[gfid].split(st, r) for gfid, r in rows.items()}
+            if caching:
+                cache.put(self.rules.fingerprint, key, splits)
+        for gfid in s_by_cf:
+            g = self._groups[gfid]
+            self._refresh(g, splits[g.core_class], rows[gfid])
+        if trace is not None:
+            self._trace_groups(trace, s_by_cf)
+
+    def add_satellite(self, fund: Fund, risk_index: Optional[int] = None,
+                      trace: Optional[AllocationTrace] = None) -> Optional[HoldingView]:
+        """Add one satellite and re-split only its core fund's group."""
+        risk_index = self._set_risk(risk_index)
+        if self.holdings.row_of(fund.name) >= 0:
+            raise ValueError(f"'{fund.name}' is already in the portfolio.")
+        gfid = self._core_fund_for(fund)
+        if gfid is None:
+            if trace is not None: trace.skip(fund.name, "no parent in portfolio core.")
+            return None
+        self._refresh(self._attach(fund, gfid, risk_index))
+        if trace is not None:
+            self._trace_groups(trace, [gfid])
+        return self.holdings.get(fund.name)
+
+    def remove_satellite(self, fund_name: str, trace: Optional[AllocationTrace] = None):
+        """Remove one satellite and hand its share back to the rest of its group."""
+        st = self.holdings
+        r = st.row_of(fund_name)
+        if r < 0 or st.group[r] == NO_GROUP:
+            raise KeyError(f"'{fund_name}' is not a satellite of this portfolio.")
+        gfid = st.group[r]
+        g = self._groups[gfid]
+        g.fill(st).remove(st.leaf[r])
+        st.delete(r)
+        self._refresh(g)
+        if trace is not None:
+            trace.skip(fund_name, "removed by request.")
+            self._trace_groups(trace, [gfid])
+
+    def render(self) -> str:
+        """The portfolio grouped by budget, with each satellite's binding limit."""
+        lines = [f"\n--- Portfolio Display: {self.name} ---"]
+        st, grouped = self.holdings, defaultdict(list)
+        held = st.held_rows()
+        for r in held:
+            # Attached satellites already know their group; only the rest walk up the tree.
+            g = self._groups.get(st.group[r])
+            if g is not None:
+                grouped[g.core_class].append(r)
+                continue
+            a = st.registry.funds[st.fund[r]].asset_class.find_ancestor_in(self._core)
+            if a: grouped[a.name].append(r)
+        
+        for cn, rows in sorted(grouped.items()):
+            budget = sum(st.alloc[r] for r in rows)
+            headroom = budget * (self.rules.get_reduction_pct(cn) / 100)
+            lines.append(f"\nBudget Group: {cn} (Total: {budget:.2f}%, Headroom: {headroom:.2f}%)")
+            lines.append("-" * 55)
+            for r in sorted(rows, key=st.name):
+                alloc, lim, share = st.alloc[r], st.leaf[r], st.share[r]
+                lines.append(f"    - {st.name(r):<45}: {alloc:.2f}%")
+                if st.flags[r] & SATELLITE:
+                    if binding_constraint(alloc, lim, share) == "leaf":
+                        reason = f"Limited by its leaf limit of {lim:.2f}%"
+                    else:
+                        reason = f"Limited by its share of headroom ({share:.2f}%)"
+                    lines.append(f"      └── Reasoning: {reason}")
+
+        total = sum(st.alloc[r] for r in held)
+        lines.append(f"\n{'='*20} TOTAL PORTFOLIO ALLOCATION: {total:.2f}% {'='*20}")
+        return "\n".join(lines)
+
+    def display(self):
+        print(self.render())
@@ -0,0 +1,352 @@
+"""
+Allocation results kept in SQLite, to answer questions without recomputing.
+
+    python bulk.py clients.csv --catalog test.csv --out results.db
+    python resultstore.py results.db --asset-class EQ_JP --role satellite --min-allocation 5 --accounts
+    python resultstore.py results.db --binding leaf --risk 6 --accounts
+    python resultstore.py results.db --versions
+    python resultstore.py results.db --reads leaf:EQ_JP:4 --accounts
+
+    with ResultStore("results.db") as store:
+        store.write("ACC-1", block)  # replaces ACC-1's earlier rows
+        rows = store.query(isin="LU0000000001", min_allocation=2.5)
+
+One row per holding, in the columns bulk.py writes plus the client's PL and
+risk level (1-7) and the version of the rules it was allocated under (see
+portfolio.AllocationRules.version). Writes are buffered and committed a batch
+of accounts per transaction. Rows are indexed by account, ISIN, asset class
+(with allocation, for threshold questions), risk level, binding constraint
+and rules version, so the usual ops questions are index lookups. NULL
+leaf_limit and binding mark core holdings.
+
+Alongside the rows, the store keeps every account's rules version (also
+for accounts with no rows at all), the rule entries each account's
+allocation read and a copy of every rules version it has results from, so
+bulk.py --incremental can recompute only what a rules change touches (see
+dependencies.py).
+"""
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from export import ResultBlock
+from pldata import RulesData
+
+SCHEMA_VERSION = 3  # 2 added reads and rules, 3 accounts; older stores are upgraded in place
+BATCH_ROWS = 20_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS holdings (
+    account_id    TEXT NOT NULL,
+    fund          TEXT NOT NULL,
+    isin          TEXT,
+    asset_class   TEXT,
+    allocation    REAL NOT NULL,
+    leaf_limit    REAL,
+    binding       TEXT,
+    role          TEXT NOT NULL,
+    pl_level      TEXT,
+    risk_level    INTEGER,
+    rules_version TEXT
+);
+CREATE INDEX IF NOT EXISTS holdings_account ON holdings (account_id);
+CREATE INDEX IF NOT EXISTS holdings_isin ON holdings (isin);
+CREATE INDEX IF NOT EXISTS holdings_class ON holdings (asset_class, allocation);
+CREATE INDEX IF NOT EXISTS holdings_risk ON holdings (risk_level);
+CREATE INDEX IF NOT EXISTS holdings_binding ON holdings (binding, risk_level);
+CREATE INDEX IF NOT EXISTS holdings_version ON holdings (rules_version);
+CREATE TABLE IF NOT EXISTS reads (
+    key        TEXT NOT NULL,
+    account_id TEXT NOT NULL,
+    PRIMARY KEY (key, account_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS reads_account ON reads (account_id);
+CREATE TABLE IF NOT EXISTS accounts (
+    account_id    TEXT PRIMARY KEY,
+    rules_version TEXT
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS accounts_version ON accounts (rules_version);
+CREATE TABLE IF NOT EXISTS rules (
+    version         TEXT PRIMARY KEY,
+    pl_dicts        TEXT NOT NULL,
+    reduction_table TEXT NOT NULL,
+    tree            TEXT NOT NULL
+);
+"""
+
+_INSERT = "INSERT INTO holdings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+class StoredRow(NamedTuple):
+    account_id: str
+    fund: str
+    isin: Optional[str]
+    asset_class: Optional[str]
+    allocation: float
+    leaf_limit: Optional[float]  # None for core holdings
+    binding: Optional[str]       # see allocation_trace.binding_constraint; None for core holdings
+    role: str
+    pl_level: Optional[str]
+    risk_level: Optional[int]
+    rules_version: Optional[str]
+
+
+FIELDS = StoredRow._fields
+
+# Filter name -> SQL condition; values are always bound as parameters.
+_FILTERS = {
+    "account_id": "account_id = ?",
+    "fund": "fund = ?",
+    "isin": "isin = ?",
+    "asset_class": "asset_class = ?",
+    "role": "role = ?",
+    "binding": "binding = ?",
+    "pl_level": "pl_level = ?",
+    "risk_level": "risk_level = ?",
+    "rules_version": "rules_version = ?",
+    "min_allocation": "allocation > ?",
+    "max_allocation": "allocation <= ?",
+}
+
+
+def _where(filters: Dict[str, object]) -> Tuple[str, list]:
+    """WHERE clause and parameters; a list or tuple value matches any of its items."""
+    terms, params = [], []
+    for name, value in filters.items():
+        if value is None:
+            continue
+        if name not in _FILTERS:
+            raise ValueError(f"Unknown filter '{name}'; expected one of {', '.join(_FILTERS)}.")
+        if isinstance(value, (list, tuple)):
+            column = _FILTERS[name].split()[0]
+            terms.append(f"{column} IN ({', '.join('?' * len(value))})")
+            params.extend(value)
+        else:
+            terms.append(_FILTERS[name])
+            params.append(value)
+    return (" WHERE " + " AND ".join(terms) if terms else ""), params
+
+
+class ResultStore:
+    """
+    An SQLite file of allocation results. write() takes the same
+    (account_id, ResultBlock) as bulk's other writers; rows become visible
+    to queries once flushed, at the latest on close().
+    """
+
+    def __init__(self, path: str, batch_rows: int = BATCH_ROWS):
+        self.path, self.batch_rows = path, batch_rows
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, 1, 2, SCHEMA_VERSION):
+            raise ValueError(f"{path} has result store schema {version}; this code reads {SCHEMA_VERSION}.")
+        with self.db:
+            self.db.executescript(_SCHEMA)
+            if version in (1, 2):
+                # Accounts stored without rows are not in holdings; untracked() reports them.
+                self.db.execute("INSERT OR IGNORE INTO accounts "
+                                "SELECT account_id, MAX(rules_version) FROM holdings GROUP BY account_id")
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        # account -> (rows, reads, rules version); a later write replaces an earlier one
+        self.pending: Dict[str, Tuple[List[tuple], List[tuple], Optional[str]]] = {}
+        self.npending = 0
+
+    # --- Writing ---
+    def write(self, account_id: str, block: ResultBlock):
+        """Store an account's rows in place of any it had."""
+        k = len(block.fund)
+        rows = list(zip(
+            [account_id] * k, block.fund, [i or None for i in block.isin], [c or None for c in block.asset_class],
+            block.allocation, [None if lim != lim else lim for lim in block.leaf_limit],  # NaN: core
+            [b or None for b in block.binding], block.role,
+            [block.pl_level or None] * k, [block.risk_level or None] * k, [block.rules_version or None] * k))
+        reads = [(key, account_id) for key in block.reads]
+        old = self.pending.get(account_id)
+        self.npending += k + len(reads) - (len(old[0]) + len(old[1]) if old else 0)
+        self.pending[account_id] = rows, reads, block.rules_version or None
+        if self.npending >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        """Commit buffered accounts in one transaction."""
+        if not self.pending:
+            return
+        with self.db:
+            self._delete(self.pending)
+            self.db.executemany(_INSERT, (r for rows, _, _ in self.pending.values() for r in rows))
+            self.db.executemany("INSERT INTO reads VALUES (?, ?)",
+                                (r for _, reads, _ in self.pending.values() for r in reads))
+            self.db.executemany("INSERT INTO accounts VALUES (?, ?)",
+                                ((a, version) for a, (_, _, version) in self.pending.items()))
+        self.pending.clear()
+        self.npending = 0
+
+    def _delete(self, account_ids: Iterable[str]):
+        ids = [(a,) for a in account_ids]
+        self.db.executemany("DELETE FROM holdings WHERE account_id = ?", ids)
+        self.db.executemany("DELETE FROM reads WHERE account_id = ?", ids)
+        self.db.executemany("DELETE FROM accounts WHERE account_id = ?", ids)
+
+    def delete(self, account_ids: Iterable[str]):
+        self.flush()
+        with self.db:
+            self._delete(account_ids)
+
+    def save_rules(self, version: str, pl_dicts, reduction_table, tree):
+        """Keep the rules results are about to be stored under, for later diffs; once per version."""
+        dump = lambda x: json.dumps(x, ensure_ascii=False, sort_keys=True)
+        with self.db:
+            self.db.execute("INSERT OR IGNORE INTO rules VALUES (?, ?, ?, ?)",
+                            (version, dump([[n, {c: list(a) for c, a in d.items()}] for n, d in pl_dicts]),
+                             dump(dict(reduction_table)), dump(tree)))
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def __enter__(self) -> "ResultStore":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- Queries ---
+    def query(self, limit: Optional[int] = None, **filters) -> List[StoredRow]:
+        """
+        Rows matching every filter, by account and then in stored order.
+        Filters: account_id, fund, isin, asset_class, role, binding, pl_level,
+        risk_level (1-7), rules_version, min_allocation (exclusive) and
+        max_allocation.
+        """
+        where, params = _where(filters)
+        sql = f"SELECT * FROM holdings{where} ORDER BY account_id, rowid"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return [StoredRow(*r) for r in self.db.execute(sql, params)]
+
+    def accounts(self, **filters) -> List[str]:
+        """Accounts with at least one row matching every filter (see query)."""
+        where, params = _where(filters)
+        return [r[0] for r in self.db.execute(f"SELECT DISTINCT account_id FROM holdings{where} ORDER BY 1", params)]
+
+    def portfolio(self, account_id: str) -> List[StoredRow]:
+        return self.query(account_id=account_id)
+
+    def count(self, **filters) -> int:
+        where, params = _where(filters)
+        return self.db.execute(f"SELECT COUNT(*) FROM holdings{where}", params).fetchone()[0]
+
+    def versions(self) -> Dict[str, int]:
+        """Accounts stored per rules version, those without rows included."""
+        rows = self.db.execute("SELECT rules_version, COUNT(*) FROM accounts GROUP BY 1 ORDER BY 1")
+        return {v or "": n for v, n in rows}
+
+    def accounts_under(self, rules_version: str) -> List[str]:
+        """Accounts stored under rules_version, those without rows included."""
+        rows = self.db.execute("SELECT account_id FROM accounts WHERE rules_version = ? ORDER BY 1", (rules_version,))
+        return [r[0] for r in rows]
+
+    def rules_data(self, version: str) -> Optional[RulesData]:
+        """The rules saved under `version`, as pldata.load_rules returns them, or None."""
+        row = self.db.execute("SELECT pl_dicts, reduction_table, tree FROM rules WHERE version = ?",
+                              (version,)).fetchone()
+        if row is None:
+            return None
+        pl_dicts, reduction_table, tree = map(json.loads, row)
+        return RulesData([(n, d) for n, d in pl_dicts], reduction_table, tree)
+
+    def readers(self, keys: Iterable[str], rules_version: Optional[str] = None) -> Set[str]:
+        """Accounts whose allocation read any of `keys`, only those stored under rules_version if given."""
+        db = self.db
+        db.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (key TEXT PRIMARY KEY) WITHOUT ROWID")
+        db.execute("DELETE FROM wanted")
+        db.executemany("INSERT OR IGNORE INTO wanted VALUES (?)", ((k,) for k in keys))
+        sql = "SELECT DISTINCT r.account_id FROM wanted w JOIN reads r ON r.key = w.key"
+        if rules_version is None:
+            return {a for a, in db.execute(sql)}
+        sql += " JOIN accounts a ON a.account_id = r.account_id WHERE a.rules_version = ?"
+        return {a for a, in db.execute(sql, (rules_version,))}
+
+    def account_keys(self, prefixes: Iterable[str]) -> Dict[str, Set[str]]:
+        """Per account, its read keys that start with one of `prefixes`."""
+        out: Dict[str, Set[str]] = {}
+        for prefix in prefixes:
+            # A range rather than LIKE, so the primary key serves it.
+            rows = self.db.execute("SELECT account_id, key FROM reads WHERE key >= ? AND key < ?",
+                                   (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)))
+            for account_id, key in rows:
+                out.setdefault(account_id, set()).add(key)
+        return out
+
+    def untracked(self) -> List[str]:
+        """Accounts stored without their reads or rules version, whose staleness cannot be told."""
+        rows = self.db.execute(
+            "SELECT account_id FROM accounts WHERE rules_version IS NULL "
+            "OR account_id NOT IN (SELECT account_id FROM reads) "
+            "UNION SELECT account_id FROM reads WHERE account_id NOT IN (SELECT account_id FROM accounts) ORDER BY 1")
+        return [r[0] for r in rows]
+
+    def stale(self, rules_version: str) -> List[str]:
+        """Accounts stored under any rules version other than `rules_version`."""
+        rows = self.db.execute("SELECT account_id FROM accounts WHERE rules_version IS NOT ? ORDER BY 1",
+                               (rules_version,))
+        return [r[0] for r in rows]
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Query stored allocation results.")
+    ap.add_argument("db", help="result store written by bulk.py --out results.db")
+    ap.add_argument("--account", dest="account_id")
+    ap.add_argument("--fund")
+    ap.add_argument("--isin")
+    ap.add_argument("--asset-class")
+    ap.add_argument("--role", choices=["core", "satellite"])
+    ap.add_argument("--binding", choices=["leaf", "headroom", "cap", "none"])
+    ap.add_argument("--pl-level")
+    ap.add_argument("--risk", dest="risk_level", type=int, help="risk level, 1-7")
+    ap.add_argument("--rules-version")
+    ap.add_argument("--min-allocation", type=float, help="allocation above this, in %%")
+    ap.add_argument("--max-allocation", type=float, help="allocation at most this, in %%")
+    ap.add_argument("--accounts", action="store_true", help="list matching accounts instead of rows")
+    ap.add_argument("--count", action="store_true", help="print the number of matching rows")
+    ap.add_argument("--versions", action="store_true", help="accounts stored per rules version")
+    ap.add_argument("--reads", nargs="+", metavar="KEY",
+                    help="accounts whose allocation read any of these rule entries (see dependencies.py)")
+    ap.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    ap.add_argument("--limit", type=int)
+    args = ap.parse_args(argv)
+    filters = {name: getattr(args, name) for name in _FILTERS}
+
+    store = ResultStore(args.db)
+    try:
+        if args.reads:
+            print("\n".join(sorted(store.readers(args.reads))))
+        elif args.versions:
+            for version, n in store.versions().items():
+                print(f"{version or '(none)'};{n}")
+        elif args.count:
+            print(store.count(**filters))
+        elif args.accounts:
+            print("\n".join(store.accounts(**filters)))
+        else:
+            rows = store.query(args.limit, **filters)
+            if args.format == "csv":
+                w = csv.writer(sys.stdout, delimiter=";")
+                w.writerow(FIELDS)
+                w.writerows(rows)
+            else:
+                sys.stdout.writelines(json.dumps(r._asdict(), ensure_ascii=False) + "\n" for r in rows)
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
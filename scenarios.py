@@ -0,0 +1,326 @@
+"""
+What-if sweeps over the model tables.
+
+    python scenarios.py clients.csv --catalog test.csv --reduction EQ_WI=25,30,35
+    python scenarios.py clients.csv --catalog test.csv --grid sweep.json --out sweep.jsonl
+
+Every combination of overrides is one scenario. A grid file is JSON with
+either or both of
+
+    {"reduction_table": {"EQ_WI": [25, 30, 35]},
+     "levels": {"PL4": {"EQ_US": [[...7 values...], [...]]}}}
+
+and --reduction adds one reduction_table axis from the command line. The
+client book (the bulk.py client file) is encoded once into flat arrays in
+shared memory; worker processes map it instead of receiving it per task,
+and each scenario is a single pass of the batch allocator over the whole
+book, every portfolio at its own risk level. Each scenario reports the
+distribution of satellite weight, how many portfolios have a satellite
+bound by its leaf limit, and the change of each figure against the
+unmodified tables. Overrides that break the PL invariants are still run
+but flagged with "tables_consistent": false.
+"""
+import argparse
+import copy
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from batch import LevelMatrix, allocate_entries
+from bulk import read_clients
+from catalog import LoadReport, load_catalog
+from pldata import load_rules
+from validation import validate_levels
+
+WEIGHT_BINS = [0, 1, 2, 5, 10, 15, 20, 30, 100]  # satellite weight histogram edges, in percent
+CHANGED = 1e-9  # a portfolio whose satellite weight moved by more than this counts as changed
+
+
+class Scenario(NamedTuple):
+    name: str
+    reduction: Dict[str, float]               # class -> reduction percentage
+    levels: Dict[str, Dict[str, List[float]]]  # level -> class -> allocations per risk
+
+
+def grid(reduction: Optional[Dict[str, Iterable[float]]] = None,
+         levels: Optional[Dict[str, Dict[str, Iterable[List[float]]]]] = None) -> List[Scenario]:
+    """Every combination of the override values, in row-major order."""
+    axes = [(("reduction", cls), list(vals)) for cls, vals in (reduction or {}).items()]
+    axes += [(("level", lvl, cls), list(rows)) for lvl, table in (levels or {}).items() for cls, rows in table.items()]
+    out = []
+    for combo in itertools.product(*(vals for _, vals in axes)):
+        red, lv, parts = {}, {}, []
+        for (key, _), v in zip(axes, combo):
+            if key[0] == "reduction":
+                red[key[1]] = float(v)
+                parts.append(f"{key[1]}={v:g}")
+            else:
+                lv.setdefault(key[1], {})[key[2]] = list(v)
+                parts.append(f"{key[1]}.{key[2]}={'/'.join(f'{x:g}' for x in v)}")
+        out.append(Scenario(", ".join(parts) or "baseline", red, lv))
+    return out
+
+
+def apply(scenario: Scenario, pl_dicts, reduction_table) -> Tuple[list, dict]:
+    """Copies of the tables with the scenario's overrides; the originals are untouched."""
+    reduction_table = {**reduction_table, **scenario.reduction}
+    if scenario.levels:
+        pl_dicts = [(name, {**pl, **copy.deepcopy(scenario.levels.get(name, {}))}) for name, pl in pl_dicts]
+    return pl_dicts, reduction_table
+
+# ==============================================================================
+# 1. CLIENT BOOK IN SHARED MEMORY
+# ==============================================================================
+class Book(NamedTuple):
+    """
+    Portfolios sorted by risk index, so each risk is one contiguous slice,
+    and their satellite entries sorted by portfolio. Clients with the same
+    core classes share one row of core_sets.
+    """
+    level: np.ndarray       # (P,) level index
+    risk: np.ndarray        # (P,) risk index, ascending
+    core: np.ndarray        # (P,) row of core_sets
+    core_sets: np.ndarray   # (K, C) bool, the classes a client holds a core fund for
+    entry_p: np.ndarray     # (E,) portfolio of each satellite entry, ascending
+    entry_s: np.ndarray     # (E,) satellite class index
+    entry_n: np.ndarray     # (E,) funds of that class
+    base_weight: np.ndarray  # (P,) satellite weight under the unmodified tables
+
+    def risk_slices(self) -> Iterable[Tuple[int, slice, slice]]:
+        """(risk, portfolio slice, entry slice) for every risk present."""
+        for r in np.unique(self.risk):
+            p0, p1 = np.searchsorted(self.risk, [r, r + 1])
+            e0, e1 = np.searchsorted(self.entry_p, [p0, p1])
+            yield int(r), slice(p0, p1), slice(e0, e1)
+
+
+def encode_book(clients: Iterable[dict], matrix: LevelMatrix, catalog) -> Tuple[Book, Dict[str, int]]:
+    """Book arrays (base_weight still zero) and counters of what was left out."""
+    rows, skipped = [], {"bad row": 0, "unknown level": 0, "bad risk level": 0, "unknown fund": 0}
+    core_ids: Dict[frozenset, int] = {}
+    for c in clients:
+        if "error" in c:  # see bulk.read_clients
+            skipped["bad row"] += 1
+            continue
+        li = matrix.level_index.get(c["pl_level"])
+        if li is None:
+            skipped["unknown level"] += 1
+            continue
+        risk = c["risk_level"] - 1
+        if not 0 <= risk < matrix.values.shape[2]:
+            skipped["bad risk level"] += 1
+            continue
+        # Like Portfolio.build_from_level: the first core fund of each class
+        # stands for it, and a satellite fund it already holds (under the
+        # unmodified tables) or one listed twice is left out.
+        core: Dict[int, str] = {}
+        for name in c["core_funds"]:
+            ci = matrix.index.get(catalog.class_of(name) or "")
+            if ci is None:
+                skipped["unknown fund"] += 1
+                continue
+            core.setdefault(ci, name)
+        core_id = core_ids.setdefault(frozenset(core), len(core_ids))
+        seen = {name for ci, name in core.items() if matrix.present[li, ci] and matrix.values[li, ci, risk] > 0}
+        sats: Dict[int, int] = {}
+        for name in c["satellite_funds"]:
+            if name in seen:
+                continue
+            seen.add(name)
+            ci = matrix.index.get(catalog.class_of(name) or "")
+            if ci is None:
+                skipped["unknown fund"] += 1
+                continue
+            sats[ci] = sats.get(ci, 0) + 1
+        rows.append((risk, li, core_id, sats))
+    rows.sort(key=lambda row: row[0])
+    ps, ss, ns = [], [], []
+    for i, (_, _, _, sats) in enumerate(rows):
+        for ci, n in sorted(sats.items()):
+            ps.append(i)
+            ss.append(ci)
+            ns.append(n)
+    core_sets = np.zeros((len(core_ids), len(matrix.classes)), dtype=bool)
+    for core, k in core_ids.items():
+        core_sets[k, list(core)] = True
+    book = Book(
+        np.array([row[1] for row in rows], dtype=np.int64), np.array([row[0] for row in rows], dtype=np.int64),
+        np.array([row[2] for row in rows], dtype=np.int64), core_sets,
+        np.array(ps, dtype=np.int64), np.array(ss, dtype=np.int64), np.array(ns, dtype=np.int64),
+        np.zeros(len(rows)),
+    )
+    return book, skipped
+
+
+def share_book(book: Book) -> Tuple[shared_memory.SharedMemory, list]:
+    """Copy the book into one shared memory block; returns the block and the layout to attach it."""
+    size = sum(a.nbytes for a in book) or 1
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    layout, offset = [], 0
+    for a in book:
+        np.ndarray(a.shape, a.dtype, shm.buf, offset)[...] = a
+        layout.append((a.dtype.str, a.shape, offset))
+        offset += a.nbytes
+    return shm, layout
+
+
+def attach_book(buf, layout) -> Book:
+    return Book(*(np.ndarray(shape, np.dtype(dtype), buf, offset) for dtype, shape, offset in layout))
+
+# ==============================================================================
+# 2. EVALUATION
+# ==============================================================================
+def satellite_weights(matrix: LevelMatrix, book: Book, scale: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Per portfolio: total satellite weight in percent, and whether a leaf limit bound any satellite."""
+    weight = np.zeros(len(book.level))
+    bound = np.zeros(len(book.level), dtype=bool)
+    for r, ps, es in book.risk_slices():
+        p = book.entry_p[es] - ps.start
+        res = allocate_entries(matrix, book.level[ps], p, book.entry_s[es], book.entry_n[es], [r], scale=scale,
+                               held=book.core_sets[book.core[ps]])
+        w = res.allocation[:, 0] * res.count
+        weight[ps] = np.bincount(p, weights=w, minlength=ps.stop - ps.start)
+        bound[ps] = np.bincount(p[res.leaf_bound[:, 0]], minlength=ps.stop - ps.start) > 0
+    if scale is not None:
+        weight /= scale
+    return weight, bound
+
+
+def summarize(weight: np.ndarray, bound: np.ndarray) -> Dict[str, object]:
+    q = np.percentile(weight, [10, 50, 90]) if len(weight) else [0.0, 0.0, 0.0]
+    return {
+        "portfolios": int(len(weight)),
+        "satellite_weight_mean": float(weight.mean()) if len(weight) else 0.0,
+        "satellite_weight_p10": float(q[0]),
+        "satellite_weight_p50": float(q[1]),
+        "satellite_weight_p90": float(q[2]),
+        "satellite_weight_max": float(weight.max()) if len(weight) else 0.0,
+        "satellite_weight_hist": np.histogram(weight, WEIGHT_BINS)[0].tolist(),
+        "leaf_bound_portfolios": int(bound.sum()),
+    }
+
+
+def deltas(stats: dict, base: dict) -> Dict[str, object]:
+    out = {}
+    for k, v in stats.items():
+        if k in ("portfolios", "tables_consistent"):
+            continue
+        b = base[k]
+        out[k] = [x - y for x, y in zip(v, b)] if isinstance(v, list) else v - b
+    return out
+
+
+_worker: Dict[str, object] = {}
+
+
+def init_worker(shm_name: str, layout, pl_dicts, reduction_table, tree, scale: Optional[int]):
+    """Map the shared book and keep the base rules; both arrive once per worker, not per scenario."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    rules = (pl_dicts, reduction_table, tree)
+    _worker.update(shm=shm, book=attach_book(shm.buf, layout), rules=rules, scale=scale,
+                   classes=LevelMatrix(*rules).classes)
+
+
+def evaluate(scenario: Scenario) -> Tuple[str, dict, int]:
+    """(name, summary, portfolios whose satellite weight changed) for one scenario."""
+    pl_dicts, reduction_table, tree = _worker["rules"]
+    book = _worker["book"]
+    pl_dicts, reduction_table = apply(scenario, pl_dicts, reduction_table)
+    matrix = LevelMatrix(pl_dicts, reduction_table, tree)
+    if matrix.classes != _worker["classes"]:
+        raise ValueError(f"Scenario '{scenario.name}' adds classes that are not in the tree.")
+    weight, bound = satellite_weights(matrix, book, _worker["scale"])
+    stats = summarize(weight, bound)
+    stats["tables_consistent"] = validate_levels(pl_dicts, tree).ok
+    changed = int((np.abs(weight - book.base_weight) > CHANGED).sum())
+    return scenario.name, stats, changed
+
+
+def sweep(clients: Iterable[dict], catalog, scenarios: List[Scenario], rules=None, workers: Optional[int] = None,
+          scale: Optional[int] = None) -> Tuple[dict, List[dict], Dict[str, int]]:
+    """
+    Evaluate every scenario over the whole book.
+    Returns (baseline summary, one record per scenario in input order, skip counters).
+    """
+    pl_dicts, reduction_table, tree = rules or load_rules()
+    matrix = LevelMatrix(pl_dicts, reduction_table, tree)
+    book, skipped = encode_book(clients, matrix, catalog)
+    weight, bound = satellite_weights(matrix, book, scale)
+    book.base_weight[:] = weight
+    base = summarize(weight, bound)
+
+    def record(result):
+        name, stats, changed = result
+        return {"scenario": name, **stats, "changed_portfolios": changed, "delta": deltas(stats, base)}
+
+    shm, layout = share_book(book)
+    try:
+        initargs = (shm.name, layout, pl_dicts, reduction_table, tree, scale)
+        if workers == 0:
+            init_worker(*initargs)
+            try:
+                return base, [record(evaluate(s)) for s in scenarios], skipped
+            finally:
+                _worker.clear()
+        workers = min(workers or os.cpu_count() or 1, max(len(scenarios), 1))
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=initargs) as pool:
+            return base, [record(r) for r in pool.map(evaluate, scenarios)], skipped
+    finally:
+        shm.close()
+        shm.unlink()
+
+# ==============================================================================
+# 3. DRIVER
+# ==============================================================================
+def _reduction_axis(spec: str) -> Tuple[str, List[float]]:
+    cls, _, values = spec.partition("=")
+    if not cls or not values:
+        raise argparse.ArgumentTypeError(f"expected CLASS=v1,v2,..., got '{spec}'")
+    return cls, [float(v) for v in values.split(",")]
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Sweep reduction_table and PL overrides over a client book.")
+    ap.add_argument("clients", help="client file (.csv with ';' separator, or .jsonl), as for bulk.py")
+    ap.add_argument("--catalog", required=True, help="fund catalog (name;isin;asset_class)")
+    ap.add_argument("--grid", help="JSON file of override values")
+    ap.add_argument("--reduction", action="append", type=_reduction_axis, default=[], metavar="CLASS=v1,v2",
+                    help="reduction_table values to sweep for one class (repeatable)")
+    ap.add_argument("--scale", type=int, help="run in integer units of 1/SCALE percent (100: basis points)")
+    ap.add_argument("--workers", type=int, help="worker processes (0 runs inline; default: all CPUs)")
+    ap.add_argument("--out", help="JSON lines output, one record per scenario; stdout if omitted")
+    args = ap.parse_args(argv)
+
+    spec = {}
+    if args.grid:
+        with open(args.grid, encoding="utf-8") as f:
+            spec = json.load(f)
+    reduction = {**spec.get("reduction_table", {}), **dict(args.reduction)}
+    scenarios = grid(reduction, spec.get("levels"))
+
+    catalog = load_catalog(args.catalog, LoadReport())
+    base, records, skipped = sweep(read_clients(args.clients), catalog, scenarios, workers=args.workers,
+                                   scale=args.scale)
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    try:
+        for rec in records:
+            out.write(json.dumps(rec) + "\n")
+    finally:
+        if args.out:
+            out.close()
+    print(f"{len(records)} scenarios over {base['portfolios']} portfolios; baseline mean satellite weight "
+          f"{base['satellite_weight_mean']:.4f}%, {base['leaf_bound_portfolios']} leaf-bound.", file=sys.stderr)
+    for kind, n in skipped.items():
+        if n:
+            print(f"  - skipped {n} rows/funds: {kind}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
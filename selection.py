@@ -0,0 +1,229 @@
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from catalog import FundCatalog
+from hierarchy import compile_tree
+from leaflimits import leaf_limit_table
+from waterfill import INF
+
+# ==============================================================================
+# SATELLITE SELECTION BY BRANCH AND BOUND
+# ==============================================================================
+# Proposes up to k satellite funds from a catalog that use as much of the core
+# classes' headroom as possible under split_reduction_with_leaf_limits: a
+# core class's satellites take min(headroom, sum of their leaf limits). All
+# funds of a class look the same to the rules, so candidates are grouped by
+# class. Core classes only share the pick budget, so each one is solved on
+# its own for every pick count and a small knapsack over the budget combines
+# them. Without a minimum weight a core class's best m picks are simply its m
+# largest limits. With one (no satellite may be left a sliver of headroom),
+# filling smallest first means all but the largest pick must fit in the
+# headroom less that minimum, a cardinality-bounded subset sum searched by
+# branch and bound. The search stops at the time budget with the best
+# selection found so far.
+
+EPSILON = 1e-9
+
+
+class Candidate(NamedTuple):
+    core_class: str
+    asset_class: str
+    leaf_limit: float
+    funds: List[str]  # catalog funds of the class, in name order
+
+
+class Selection(NamedTuple):
+    funds: List[str]
+    classes: List[str]            # class of each fund, for split_reduction_with_leaf_limits
+    used: float                   # headroom the selection takes, summed over core classes
+    headroom: Dict[str, float]    # core class -> headroom available
+    optimal: bool                 # False if the time budget ran out first
+    bound: float                  # upper bound on `used` proven by the search
+    nodes: int
+
+
+def candidates(core_pl: Dict[str, float], reduction_table: Dict[str, float], tree: dict, pl_dicts, risk_index: int,
+               catalog: FundCatalog, exclude=()) -> Tuple[List[Candidate], Dict[str, float]]:
+    """Classes with catalog funds that would draw from a core class, and each core class's headroom."""
+    h, leaves = compile_tree(tree), leaf_limit_table(pl_dicts)
+    headroom = {c: b * reduction_table.get(c, 0) / 100 for c, b in core_pl.items()}
+    excluded = set(exclude)
+    out = []
+    for cls in catalog.asset_classes:
+        core = h.nearest_ancestor_in(cls, core_pl)
+        lim = leaves.limit(cls, risk_index)
+        if core is None or lim <= EPSILON or headroom[core] <= EPSILON:
+            continue
+        funds = sorted(r.name for r in catalog.in_class(cls) if r.name not in excluded)
+        if funds:
+            out.append(Candidate(core, cls, lim, funds))
+    return out, headroom
+
+
+def fills(limits: List[float], headroom: float, min_weight: float) -> bool:
+    """Whether every satellite gets at least min_weight when filled smallest limit first."""
+    left = headroom
+    for lim in sorted(limits):
+        if min(lim, left) < min_weight - EPSILON:
+            return False
+        left -= min(lim, left)
+    return True
+
+
+def _best_picks(lims: List[float], caps: List[int], m: int, headroom: float, min_weight: float,
+                deadline: float, stats: dict, ceiling: float = INF, search: bool = True) -> Tuple[float, Optional[List[int]]]:
+    """
+    Most headroom exactly m picks can take, and how many of each limit (in
+    descending order, at most caps[i] of limit i), with every pick allocated
+    at least min_weight. (-1, None) if no such picks exist. The search stops
+    early once it reaches `ceiling`, a known upper bound; with search=False
+    only the greedy seed is returned.
+    """
+    if min_weight <= EPSILON:
+        counts, left = [], m
+        for c in caps:
+            counts.append(min(c, left))
+            left -= counts[-1]
+        if left:
+            return -1.0, None
+        return min(headroom, sum(l * c for l, c in zip(lims, counts))), counts
+
+    # The largest pick fills last and takes what is left; the others must all
+    # fit in headroom - min_weight, and then every pick gets at least that.
+    room = headroom - min_weight
+    if room < -EPSILON:
+        return -1.0, None
+    ceiling = min(headroom, ceiling)
+    n = len(lims)
+    best = [-1.0, None]
+    counts = [0] * n
+
+    def fits_from(i: int, space: float) -> int:
+        """First position at or after i whose limit fits in `space` (limits descend)."""
+        lo, hi = i, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if lims[mid] > space + EPSILON:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def top(i: int, j: int) -> float:
+        """Sum of the j largest picks available from position i on."""
+        total = 0.0
+        for l, c in zip(lims[i:], caps[i:]):
+            t = min(c, j)
+            total += l * t
+            j -= t
+            if not j:
+                break
+        return total
+
+    # Seed: the largest limit, then whatever fits, largest first.
+    if caps and m <= sum(caps):
+        seed, left, rest = [0] * n, m - 1, 0.0
+        seed[0] = 1
+        for i in range(n):
+            while left and seed[i] < caps[i] and rest + lims[i] <= room + EPSILON:
+                seed[i] += 1
+                rest += lims[i]
+                left -= 1
+        if not left:
+            best[0], best[1] = min(headroom, lims[0] + rest), seed
+
+    def dfs(i: int, left: int, rest: float, largest: float):
+        stats["nodes"] += 1
+        if stats["nodes"] & 255 == 0 and time.perf_counter() > deadline:
+            stats["timed_out"] = True
+        if stats["timed_out"] or best[0] >= ceiling - EPSILON:
+            return
+        if not left:
+            value = min(headroom, largest + rest)
+            if value > best[0] + EPSILON:
+                best[0], best[1] = value, counts[:]
+            return
+        if largest:
+            j = fits_from(i, room - rest)  # nothing in between can be picked any more
+            if j == n or largest + min(room, rest + top(j, left)) <= best[0] + EPSILON:
+                return
+            i = j
+        elif i == n or lims[i] + min(room, top(fits_from(i + 1, room), left - 1)) <= best[0] + EPSILON:
+            return
+        for t in range(min(caps[i], left), -1, -1):
+            counts[i] = t
+            if t:
+                add = lims[i] * t - (0.0 if largest else lims[i])
+                if rest + add > room + EPSILON:
+                    continue
+                dfs(i + 1, left - t, rest + add, largest or lims[i])
+            else:
+                dfs(i + 1, left, rest, largest)
+        counts[i] = 0
+
+    if search:
+        dfs(0, m, 0.0, 0.0)
+    return best[0], best[1]
+
+
+def select_satellites(core_pl: Dict[str, float], reduction_table: Dict[str, float], tree: dict, pl_dicts,
+                      risk_index: int, catalog: FundCatalog, k: int, max_per_class: int = 1,
+                      min_weight: float = 0.0, time_budget: float = 0.2, exclude=()) -> Selection:
+    """
+    Up to k catalog funds maximising the headroom they take in total, at most
+    max_per_class funds per asset class and, if min_weight is set, at least
+    that much allocated to each. Ties go to fewer funds.
+    """
+    deadline = time.perf_counter() + time_budget
+    cands, headroom = candidates(core_pl, reduction_table, tree, pl_dicts, risk_index, catalog, exclude)
+    groups: Dict[str, List[Candidate]] = {}
+    for c in sorted(cands, key=lambda c: (-c.leaf_limit, c.asset_class)):
+        if c.leaf_limit >= min_weight - EPSILON:
+            groups.setdefault(c.core_class, []).append(c)
+
+    stats = {"nodes": 0, "timed_out": False}
+    tables = []  # per core class: its candidates, and per pick count the relaxed bound
+    for core, group in groups.items():
+        lims = [c.leaf_limit for c in group]
+        caps = [min(max_per_class, len(c.funds)) for c in group]
+        relaxed = [0.0] + [_best_picks(lims, caps, m, headroom[core], 0.0, deadline, stats)[0]
+                           for m in range(1, min(k, sum(caps)) + 1)]
+        tables.append((core, group, lims, caps, relaxed))
+
+    def combine(search: bool):
+        """best[j]: (headroom used, -funds, picks per class) with at most j picks, and ub[j] its bound."""
+        best, ub = [(0.0, 0, {})] * (k + 1), [0.0] * (k + 1)
+        for core, group, lims, caps, relaxed in tables:
+            options = [(0, 0.0, {})]
+            for m in range(1, len(relaxed)):
+                value, counts = _best_picks(lims, caps, m, headroom[core], min_weight, deadline, stats,
+                                            relaxed[m], search)
+                if counts is not None:
+                    options.append((m, value, {c.asset_class: t for c, t in zip(group, counts) if t}))
+            new, new_ub = best[:], ub[:]
+            for j in range(k + 1):
+                for m, value, picks in options:
+                    if m > j:
+                        break
+                    used, neg, prev = best[j - m]
+                    cand = (used + value, neg - m)
+                    if cand[0] > new[j][0] + EPSILON or (abs(cand[0] - new[j][0]) <= EPSILON and cand[1] > new[j][1]):
+                        new[j] = (cand[0], cand[1], {**prev, **picks})
+                for m, value in enumerate(relaxed[:j + 1]):
+                    new_ub[j] = max(new_ub[j], ub[j - m] + value)
+            best, ub = new, new_ub
+        return best, ub
+
+    # The greedy seeds often already meet the relaxed bound; search only if not.
+    best, ub = combine(search=False)
+    if best[k][0] < ub[k] - EPSILON:
+        best, ub = combine(search=True)
+
+    used, _, picks = best[k]
+    funds, classes = [], []
+    for c in sorted(cands, key=lambda c: (c.core_class, -c.leaf_limit, c.asset_class)):
+        t = picks.get(c.asset_class, 0)
+        funds.extend(c.funds[:t])
+        classes.extend([c.asset_class] * t)
+    optimal = not stats["timed_out"] or used >= ub[k] - EPSILON
+    return Selection(funds, classes, used, headroom, optimal, used if optimal else max(ub[k], used), stats["nodes"])
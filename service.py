@@ -0,0 +1,471 @@
+"""
+Allocation service.
+
+    python service.py serve --catalog data/catalog.csv --port 8080
+    python service.py loadtest clients.csv --port 8080 --concurrency 64
+    python service.py selftest clients.csv --catalog data/catalog.csv
+
+A long-running asyncio HTTP/JSON server that keeps the rules and catalog
+loaded. POST /allocate takes one client as a JSON object with the keys of a
+bulk.py client row (account_id, pl_level, risk_level 1-7, core_funds,
+satellite_funds) and an optional deadline_ms, and answers with its holdings
+in the columns bulk.py writes and the rules version they were allocated on. GET /health reports queue depth, counters and
+the rules version. POST /reload loads the rules file again and switches to
+it once it has been validated, without a restart: allocations already
+running finish on the rules they started with (see portfolio.RulesStore;
+with --workers, a fresh pool takes over and the old one drains).
+
+Requests are queued and a single batcher hands them to the allocator in
+small batches: it takes whatever is waiting, up to --max-batch, or waits at
+most --max-wait-ms for more, so one executor hop (and one IPC round trip
+with --workers) serves many requests and identical requests in a batch are
+computed once. The queue is bounded; when it is full a request is refused
+at once with 503 and Retry-After rather than waiting. A request whose
+deadline passes gets 504 and is dropped from its batch if it has not run
+yet. A Content-Length that is not a plain non-negative integer gets 400
+and a body over MAX_BODY gets 413, unread; either closes the connection.
+`loadtest` replays a client file over keep-alive connections and
+prints latency percentiles; `selftest` does the same against a server it
+starts on a loopback port, so no external services are needed.
+"""
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import bulk
+from allocation_cache import rules_fingerprint
+from export import COLUMNS
+from pldata import RULES_PATH, load_rules
+from validation import check_levels
+
+DEFAULT_DEADLINE = 1.0  # seconds
+MAX_BODY = 1 << 20  # bytes; larger requests get 413
+
+# ==============================================================================
+# 1. BATCHED ALLOCATION
+# ==============================================================================
+class Overloaded(Exception):
+    """The request queue is full."""
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before it was allocated."""
+
+
+def _client_key(client: dict) -> tuple:
+    return (client["pl_level"], client["risk_level"], tuple(client["core_funds"]), tuple(client["satellite_funds"]))
+
+
+def process_batch(clients: List[dict]) -> List[tuple]:
+    """bulk.process_client for each client, computing identical portfolios once."""
+    done: Dict[tuple, tuple] = {}
+    out = []
+    for client in clients:
+        key = _client_key(client)
+        if key not in done:
+            done[key] = bulk.process_client(client)
+        _, block, error = done[key]
+        out.append((client["account_id"], block, error))
+    return out
+
+
+class _Pending:
+    __slots__ = ("client", "deadline", "future")
+
+    def __init__(self, client: dict, deadline: float, future: asyncio.Future):
+        self.client, self.deadline, self.future = client, deadline, future
+
+
+class AllocationService:
+    """
+    Owns the request queue, the batcher task and the executor the batches run
+    in: one thread in this process (workers=0), or a process pool whose
+    workers each load the rules and catalog once.
+    """
+
+    def __init__(self, catalog_path: str, engine: str = "portfolio", workers: int = 0, max_batch: int = 32,
+                 max_wait: float = 0.002, max_queue: int = 1024, rules_path: str = RULES_PATH):
+        self.catalog_path, self.engine, self.workers, self.rules_path = catalog_path, engine, workers, rules_path
+        self.rules_version: Optional[str] = None
+        self.max_batch, self.max_wait = max_batch, max_wait
+        self.queue: "asyncio.Queue[_Pending]" = asyncio.Queue(max_queue)
+        self.executor: Optional[Executor] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"requests": 0, "batches": 0, "batched": 0, "rejected": 0, "expired": 0, "errors": 0}
+
+    def _pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(self.workers, initializer=bulk.init_worker,
+                                   initargs=(self.catalog_path, self.engine, self.rules_path))
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        if self.workers:
+            self.executor = self._pool()
+            data = await loop.run_in_executor(None, load_rules, self.rules_path)
+            self.rules_version = rules_fingerprint(*data)[:12]
+        else:
+            self.executor = ThreadPoolExecutor(1)
+            await loop.run_in_executor(
+                self.executor, bulk.init_worker, self.catalog_path, self.engine, self.rules_path)
+            self.rules_version = bulk._worker["rules"].current.version
+        self._task = asyncio.create_task(self._batcher())
+
+    async def reload(self) -> str:
+        """Switch to the rules file as it is now; raises ValueError, keeping the old rules, if it is inconsistent."""
+        loop = asyncio.get_running_loop()
+        if not self.workers:
+            # Built and validated off the allocation thread, then published in one assignment.
+            future = await loop.run_in_executor(None, bulk.reload_rules, self.rules_path)
+            self.rules_version = (await asyncio.wrap_future(future)).version
+        else:
+            data = await loop.run_in_executor(None, load_rules, self.rules_path, True)
+            await loop.run_in_executor(None, check_levels, data.pl_dicts, data.tree)
+            # New batches go to a pool started on the new rules; the old pool
+            # finishes the batches it already has and then exits.
+            old, self.executor = self.executor, self._pool()
+            old.shutdown(wait=False)
+            self.rules_version = rules_fingerprint(*data)[:12]
+        return self.rules_version
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        while not self.queue.empty():
+            p = self.queue.get_nowait()
+            if not p.future.done():
+                p.future.set_exception(Overloaded())
+        if self.executor:
+            self.executor.shutdown()
+
+    async def allocate(self, client: dict, timeout: float = DEFAULT_DEADLINE) -> tuple:
+        """(account_id, ResultBlock or None, error or None); raises Overloaded or DeadlineExceeded."""
+        loop = asyncio.get_running_loop()
+        p = _Pending(client, loop.time() + timeout, loop.create_future())
+        try:
+            self.queue.put_nowait(p)
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            raise Overloaded() from None
+        self.stats["requests"] += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(p.future), timeout)
+        except asyncio.TimeoutError:
+            self.stats["expired"] += 1
+            p.future.cancel()  # the batcher skips it if it has not run yet
+            raise DeadlineExceeded() from None
+
+    async def _next_batch(self) -> List[_Pending]:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        until = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            if self.queue.empty():
+                left = until - loop.time()
+                if left <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), left))
+                except asyncio.TimeoutError:
+                    break
+            else:
+                batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            now = loop.time()
+            live = [p for p in batch if not p.future.done() and p.deadline > now]
+            if not live:
+                continue
+            self.stats["batches"] += 1
+            self.stats["batched"] += len(live)
+            try:
+                results = await loop.run_in_executor(self.executor, process_batch, [p.client for p in live])
+            except Exception as e:  # a broken pool fails the batch, not the service
+                for p in live:
+                    if not p.future.done():
+                        p.future.set_exception(e)
+                continue
+            for p, result in zip(live, results):
+                if result[2]:
+                    self.stats["errors"] += 1
+                if not p.future.done():
+                    p.future.set_result(result)
+
+# ==============================================================================
+# 2. HTTP
+# ==============================================================================
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           422: "Unprocessable Entity", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+def _content_length(headers: Dict[str, str]) -> Optional[int]:
+    """The declared body size, or None if it is not a plain non-negative integer."""
+    value = headers.get("content-length", "") or "0"
+    return int(value) if value.isascii() and value.isdigit() else None
+
+
+def _holdings(block) -> List[dict]:
+    rows = zip(block.fund, block.isin, block.asset_class, block.allocation, block.leaf_limit, block.binding,
+               block.role)
+    return [dict(zip(COLUMNS[1:], (f, i, c, a, None if math.isnan(l) else l, b, r)))
+            for f, i, c, a, l, b, r in rows]
+
+
+async def _route(service: AllocationService, method: str, path: str, body: bytes) -> Tuple[int, dict, dict]:
+    """(status, JSON body, extra headers) for one request."""
+    if path == "/health":
+        return 200, {"status": "ok", "rules_version": service.rules_version, "queued": service.queue.qsize(),
+                     **service.stats}, {}
+    if path == "/reload":
+        if method != "POST":
+            return 405, {"error": "use POST"}, {"Allow": "POST"}
+        try:
+            return 200, {"rules_version": await service.reload()}, {}
+        except (OSError, ValueError, KeyError) as e:
+            return 422, {"error": f"rules not reloaded: {e}", "rules_version": service.rules_version}, {}
+    if path != "/allocate":
+        return 404, {"error": f"no route {path}"}, {}
+    if method != "POST":
+        return 405, {"error": "use POST"}, {"Allow": "POST"}
+    try:
+        row = json.loads(body)
+        client = bulk.parse_client(row)
+        timeout = float(row.get("deadline_ms", DEFAULT_DEADLINE * 1000)) / 1000
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return 400, {"error": f"bad request: {e}"}, {}
+    try:
+        account_id, block, error = await service.allocate(client, timeout)
+    except Overloaded:
+        return 503, {"error": "overloaded"}, {"Retry-After": "1"}
+    except DeadlineExceeded:
+        return 504, {"error": "deadline exceeded"}, {}
+    if error:
+        return 422, {"account_id": account_id, "error": error}, {}
+    return 200, {"account_id": account_id, "rules_version": block.rules_version, "holdings": _holdings(block)}, {}
+
+
+class HttpServer:
+    """HTTP/1.1 with keep-alive in front of an AllocationService."""
+
+    def __init__(self, service: AllocationService, max_body: int = MAX_BODY):
+        self.service, self.max_body = service, max_body
+        self.server: Optional[asyncio.AbstractServer] = None
+        self._connections: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> "HttpServer":
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self.server.serve_forever()
+
+    async def close(self):
+        """Stop accepting, and end idle keep-alive connections by closing them rather than cancelling."""
+        self.server.close()
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, path, version = lines[0].split(" ", 2)
+                except ValueError:
+                    break
+                headers = {k.strip().lower(): v.strip() for k, _, v in (l.partition(":") for l in lines[1:] if l)}
+                # Without a usable length the body cannot be skipped, so the
+                # connection is closed after the error reply.
+                length = _content_length(headers)
+                framed = length is not None and length <= self.max_body
+                if length is None:
+                    status, payload, extra = 400, {"error": "bad Content-Length"}, {}
+                elif length > self.max_body:
+                    status, payload, extra = 413, {"error": f"body over {self.max_body} bytes"}, {}
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, payload, extra = await _route(self.service, method, path.split("?", 1)[0], body)
+                close = headers.get("connection", "").lower() == "close" or version == "HTTP/1.0" or not framed
+                data = json.dumps(payload, ensure_ascii=False).encode()
+                out = [f"HTTP/1.1 {status} {REASONS[status]}", "Content-Type: application/json",
+                       f"Content-Length: {len(data)}", "Connection: " + ("close" if close else "keep-alive")]
+                out += [f"{k}: {v}" for k, v in extra.items()]
+                writer.write(("\r\n".join(out) + "\r\n\r\n").encode() + data)
+                await writer.drain()
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self._connections[task]
+            writer.close()
+
+# ==============================================================================
+# 3. LOOPBACK CLIENT & LOAD TEST
+# ==============================================================================
+class Client:
+    """One keep-alive connection to the service."""
+
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, payload: Optional[dict] = None) -> Tuple[int, dict]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode() if payload is not None else b""
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+                          f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await self.writer.drain()
+        head = (await self.reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        headers = {k.strip().lower(): v.strip() for k, _, v in (l.partition(":") for l in head[1:] if l)}
+        data = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return int(head[0].split(" ", 2)[1]), json.loads(data) if data else {}
+
+    async def allocate(self, client: dict, deadline_ms: Optional[float] = None) -> Tuple[int, dict]:
+        payload = dict(client)
+        if deadline_ms is not None:
+            payload["deadline_ms"] = deadline_ms
+        return await self.request("POST", "/allocate", payload)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return math.nan
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+async def loadtest(clients: List[dict], host: str, port: int, concurrency: int = 32,
+                   deadline_ms: Optional[float] = None) -> dict:
+    """Send every client over `concurrency` connections; latency percentiles (ms) and status counts."""
+    it = iter(clients)
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+
+    async def run():
+        conn = Client(host, port)
+        try:
+            for client in it:
+                t0 = time.perf_counter()
+                status, _ = await conn.allocate(client, deadline_ms)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            await conn.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(run() for _ in range(concurrency)))
+    wall = time.perf_counter() - t0
+    latencies.sort()
+    return {"requests": len(latencies), "seconds": wall, "per_second": len(latencies) / wall if wall else math.nan,
+            "p50_ms": percentile(latencies, 0.50), "p90_ms": percentile(latencies, 0.90),
+            "p99_ms": percentile(latencies, 0.99), "max_ms": latencies[-1] if latencies else math.nan,
+            "status": statuses}
+
+# ==============================================================================
+# 4. DRIVER
+# ==============================================================================
+def _service(args) -> AllocationService:
+    return AllocationService(args.catalog, args.engine, args.workers, args.max_batch, args.max_wait_ms / 1000,
+                             args.max_queue, args.rules)
+
+
+async def _serve(args):
+    service = _service(args)
+    await service.start()
+    server = await HttpServer(service).start(args.host, args.port)
+    print(f"Serving on http://{args.host}:{server.port}", file=sys.stderr)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+        await service.close()
+
+
+async def _selftest(args) -> dict:
+    service = _service(args)
+    await service.start()
+    server = await HttpServer(service).start("127.0.0.1", 0)
+    try:
+        report = await loadtest(list(bulk.read_clients(args.clients)), "127.0.0.1", server.port, args.concurrency,
+                                args.deadline_ms)
+        report["service"] = dict(service.stats)
+        return report
+    finally:
+        await server.close()
+        await service.close()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Serve allocations over HTTP, or load-test the service.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    for name in ("serve", "selftest"):
+        p = sub.add_parser(name)
+        p.add_argument("--catalog", required=True, help="fund catalog (name;isin;asset_class)")
+        p.add_argument("--rules", default=RULES_PATH, help="rules file, read again on POST /reload")
+        p.add_argument("--engine", choices=["portfolio", "budget"], default="portfolio")
+        p.add_argument("--workers", type=int, default=0, help="allocator processes (0: one thread in the server)")
+        p.add_argument("--max-batch", type=int, default=32)
+        p.add_argument("--max-wait-ms", type=float, default=2.0, help="longest a batch waits to fill")
+        p.add_argument("--max-queue", type=int, default=1024, help="queued requests before 503")
+    serve = sub.choices["serve"]
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8080)
+    for name in ("loadtest", "selftest"):
+        p = sub.choices.get(name) or sub.add_parser(name)
+        p.add_argument("clients", help="client file, as for bulk.py")
+        p.add_argument("--concurrency", type=int, default=32)
+        p.add_argument("--deadline-ms", type=float, help="deadline sent with each request")
+    sub.choices["loadtest"].add_argument("--host", default="127.0.0.1")
+    sub.choices["loadtest"].add_argument("--port", type=int, default=8080)
+    args = ap.parse_args(argv)
+
+    if args.command == "serve":
+        try:
+            asyncio.run(_serve(args))
+        except KeyboardInterrupt:
+            pass
+        return 0
+    if args.command == "loadtest":
+        report = asyncio.run(loadtest(list(bulk.read_clients(args.clients)), args.host, args.port,
+                                      args.concurrency, args.deadline_ms))
+    else:
+        report = asyncio.run(_selftest(args))
+    print(json.dumps(report, indent=2))
+    return 0 if set(report["status"]) <= {200} else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+import os
+import pickle
+from typing import Callable, TypeVar
+
+# ==============================================================================
+# PICKLED SNAPSHOTS OF PARSED DATA FILES
+# ==============================================================================
+# Parsing a large catalog CSV on every start costs more than a short CLI run
+# spends allocating, and loading the parsed result from a pickle is several
+# times faster. The pickle goes into __pycache__ next to the source and is
+# reused while the source's size and mtime match, the same check Python
+# applies to .pyc files. Writing the snapshot is best effort: a read-only
+# install simply parses every time.
+
+SNAPSHOT_VERSION = 2  # bump when what any loader pickles changes, in shape or in meaning
+
+T = TypeVar("T")
+
+
+def snapshot_path(source: str, tag: str) -> str:
+    head, name = os.path.split(os.path.abspath(source))
+    return os.path.join(head, "__pycache__", f"{name}.{tag}.pickle")
+
+
+def load_with_snapshot(source: str, parse: Callable[[str], T], tag: str) -> T:
+    """parse(source), or its pickled result from an earlier run if `source` is unchanged."""
+    st = os.stat(source)
+    key = (SNAPSHOT_VERSION, tag, st.st_size, st.st_mtime_ns)
+    path = snapshot_path(source, tag)
+    try:
+        with open(path, "rb") as f:
+            if pickle.load(f) == key:
+                return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError):
+        pass  # missing, stale or unreadable: parse again
+
+    value = parse(source)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, "wb") as f:
+            pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)  # readers never see a half-written snapshot
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+    return value
@@ -0,0 +1,33 @@
+import os
+import sys
+
+# The modules live flat in the repository root.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pytest
+
+from pldata import load_rules
+from portfolio import AllocationRules, Fund
+
+
+@pytest.fixture(scope="session")
+def rules_data():
+    return load_rules()
+
+
+@pytest.fixture(scope="session")
+def rules(rules_data):
+    return AllocationRules(*rules_data)
+
+
+@pytest.fixture(scope="session")
+def core_funds(rules):
+    """One core fund per class of every level, named '<class> Core'."""
+    return {cn: Fund(f"{cn} Core", rules.get_asset_class(cn)) for cn in rules.asset_classes}
+
+
+@pytest.fixture(scope="session")
+def satellite(rules):
+    """satellite(cls, n): a Fund named '<cls> Satellite <n>'."""
+    return lambda cls, n=1: Fund(f"{cls} Satellite {n}", rules.get_asset_class(cls))
@@ -0,0 +1,66 @@
+import json
+import os
+
+import pytest
+
+import bulk
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATALOG = os.path.join(ROOT, "test.csv")
+HEADER = "account_id;pl_level;risk_level;core_funds;satellite_funds\n"
+GOOD = "A1;PL2;3;Spiltan Småbolagsfond|SEB 392 Korträntefond SEK;Spiltan Aktiefond Småland\n"
+
+
+@pytest.mark.parametrize("row, message", [
+    ({"account_id": "A", "pl_level": "PL2", "risk_level": 0}, "risk_level must be 1-7, not 0"),
+    ({"account_id": "A", "pl_level": "PL2", "risk_level": "8"}, "risk_level must be 1-7, not 8"),
+    ({"account_id": "A", "pl_level": "PL2", "risk_level": "high"}, "risk_level must be an integer"),
+    ({"account_id": "A", "pl_level": "PL2", "risk_level": 2.5}, "risk_level must be text or an integer"),
+    ({"account_id": "A", "pl_level": "PL2"}, "missing risk_level"),
+    ({"account_id": " ", "pl_level": "PL2", "risk_level": 1}, "missing account_id"),
+    ({"account_id": "A", "risk_level": 1}, "missing pl_level"),
+    ({"account_id": "A", "pl_level": "PL2", "risk_level": 1, "core_funds": 5}, "core_funds must be"),
+])
+def test_parse_client_rejects_bad_rows(row, message):
+    with pytest.raises(ValueError, match=message):
+        bulk.parse_client(row)
+
+
+def test_parse_client_accepts_lists_and_strings():
+    c = bulk.parse_client({"account_id": 7, "pl_level": "PL3 ", "risk_level": "7",
+                           "core_funds": ["A ", ""], "satellite_funds": "B| C|"})
+    assert c == {"account_id": "7", "pl_level": "PL3", "risk_level": 7, "core_funds": ["A"],
+                 "satellite_funds": ["B", "C"]}
+
+
+def test_read_clients_reports_bad_rows_and_goes_on(tmp_path):
+    csv_path = tmp_path / "clients.csv"
+    csv_path.write_text(HEADER + "B0;PL2;0;;\n" + GOOD + ";PL2;x\n", encoding="utf-8")
+    rows = list(bulk.read_clients(str(csv_path)))
+    assert [r["account_id"] for r in rows] == ["B0", "A1", "line 4"]
+    assert "risk_level must be 1-7" in rows[0]["error"] and "error" not in rows[1]
+    jsonl = tmp_path / "clients.jsonl"
+    jsonl.write_text('{"account_id": "J1", "pl_level": "PL2", "risk_level": 9}\n\nnot json\n[1]\n'
+                     + json.dumps({"account_id": "J2", "pl_level": "PL2", "risk_level": 2}) + "\n", encoding="utf-8")
+    rows = list(bulk.read_clients(str(jsonl)))
+    assert [r["account_id"] for r in rows] == ["J1", "line 3", "line 4", "J2"]
+    assert [("error" in r) for r in rows] == [True, True, True, False]
+
+
+@pytest.mark.parametrize("engine", ["portfolio", "budget"])
+def test_bad_rows_are_per_account_errors(tmp_path, capsys, engine):
+    clients = tmp_path / "clients.csv"
+    clients.write_text(HEADER + "B0;PL2;0;Spiltan Småbolagsfond;\n" + GOOD, encoding="utf-8")
+    out = tmp_path / "out.jsonl"
+    saved = dict(bulk._worker)
+    try:
+        rc = bulk.main([str(clients), "--catalog", CATALOG, "--out", str(out), "--engine", engine, "--workers", "0"])
+    finally:
+        bulk._worker.clear()
+        bulk._worker.update(saved)
+    assert rc == 1
+    err = capsys.readouterr().err
+    assert "B0: bad client row: risk_level must be 1-7, not 0" in err
+    assert "Processed 2 accounts" in err and "1 errors" in err
+    written = [json.loads(line) for line in out.read_text(encoding="utf-8").splitlines()]
+    assert written and {r["account_id"] for r in written} == {"A1"}
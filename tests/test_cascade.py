@@ -0,0 +1,93 @@
+import random
+
+import pytest
+
+import pl2
+from allocation_trace import AllocationTrace
+
+
+def allocated(results):
+    return {i['satellite_class']: (i['parent_class'], i['allocated']) for i in results}
+
+
+def test_satellite_under_a_nested_core_draws_from_it(rules_data):
+    pls, rt, tree = rules_data
+    core_pl = {'EQ_ACWI': 20.0, 'EQ_WI': 60.0, 'EQ_SE': 20.0}
+    got, info = pl2.split_reduction_cascading(core_pl, rt, tree, pls, 3, ['EQ_US', 'EQ_WI'])
+    _, expected = pl2.split_reduction_with_leaf_limits(core_pl, rt, tree, pls, 3, ['EQ_US', 'EQ_WI'])
+    assert allocated(info) == allocated(expected)
+    assert allocated(info)['EQ_US'] == ('EQ_WI', 15.0)
+    assert got['EQ_WI'] == pytest.approx(60.0 - 15.0 + allocated(info)['EQ_WI'][1])
+    assert sum(got.values()) == pytest.approx(100.0)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_each_core_pays_for_its_own_satellites(rules_data, seed):
+    # With only the core classes in the reduction table nothing between a core
+    # and its satellites caps, so every core gives up its headroom or the sum
+    # of its satellites' leaf limits, whichever is less, also when some of the
+    # satellites are core holdings with satellites of their own.
+    pls, rt, tree = rules_data
+    classes = sorted({c for _, pl in pls for c in pl})
+    rnd = random.Random(seed)
+    for _ in range(200):
+        risk = rnd.randrange(7)
+        core_pl = {c: v[risk] for c, v in rnd.choice(pls[:-1])[1].items()}
+        for c in rnd.sample(classes, 4):
+            core_pl.setdefault(c, rnd.choice([0.0, 5.0, 30.0]))
+        flat_rt = {c: p for c, p in rt.items() if c in core_pl}
+        sats = rnd.sample(classes, rnd.randrange(1, 8))
+        got, info = pl2.split_reduction_cascading(core_pl, flat_rt, tree, pls, risk, sats)
+        drawn, limits = {}, {}
+        for i in info:
+            assert i['parent_class'] == pl2.find_satellite_parent(tree, core_pl, i['satellite_class'])
+            assert i['allocated'] <= i['leaf_limit'] + 1e-9
+            drawn[i['parent_class']] = drawn.get(i['parent_class'], 0.0) + i['allocated']
+            limits[i['parent_class']] = limits.get(i['parent_class'], 0.0) + i['leaf_limit']
+        for core, total in drawn.items():
+            headroom = core_pl[core] * flat_rt.get(core, 0) / 100
+            assert total == pytest.approx(min(headroom, limits[core]))
+            received = allocated(info).get(core, (None, 0.0))[1]
+            assert got[core] == pytest.approx(core_pl[core] - total + received)
+        assert sum(got.values()) == pytest.approx(sum(core_pl.values()))
+
+
+# EQ holds the core; EQ_DEV sits between it and EQ_US / EQ_EU and caps them
+# together at 50 * 20% = 10, below either leaf limit. EQ_EM hangs off EQ directly.
+SMALL_TREE = {'EQ': {'children': {
+    'EQ_DEV': {'children': {'EQ_US': {}, 'EQ_EU': {}}},
+    'EQ_EM': {},
+}}}
+SMALL_PLS = [
+    ('PL2', {'EQ': [100.0]}),
+    ('PL3', {'EQ_DEV': [50.0], 'EQ_EM': [50.0]}),
+    ('PL4', {'EQ_US': [30.0], 'EQ_EU': [20.0], 'EQ_EM': [8.0]}),
+]
+
+
+def test_intermediate_cap_binds_below_the_leaf_limits():
+    trace = AllocationTrace()
+    got, info = pl2.split_reduction_cascading({'EQ': 100.0}, {'EQ': 40, 'EQ_DEV': 20}, SMALL_TREE, SMALL_PLS, 0,
+                                              ['EQ_US', 'EQ_EU', 'EQ_EM'], trace=trace)
+    # EQ_DEV's pool fills EQ_US and EQ_EU to 5 each; EQ's headroom of 40 then
+    # covers 5 + 5 + 8.
+    assert allocated(info) == {'EQ_US': ('EQ', 5.0), 'EQ_EU': ('EQ', 5.0), 'EQ_EM': ('EQ', 8.0)}
+    assert {i['satellite_class']: i['capped_by'] for i in info} == {'EQ_US': 'EQ_DEV', 'EQ_EU': 'EQ_DEV',
+                                                                   'EQ_EM': None}
+    assert got == {'EQ': 82.0, 'EQ_US': 5.0, 'EQ_EU': 5.0, 'EQ_EM': 8.0}
+    records = {r['asset_class']: r for r in trace.satellites()}
+    assert records['EQ_US']['parent_class'] == 'EQ'
+    assert records['EQ_US']['capped_by'] == 'EQ_DEV'
+    assert records['EQ_US']['binding'] == 'cap'
+    assert records['EQ_EM']['capped_by'] is None
+    assert 'Limited by the cap on satellites under EQ_DEV' in trace.render()
+
+
+def test_intermediate_cap_is_not_reported_when_the_core_headroom_binds():
+    # EQ's headroom of 10 splits equally, 10/3 each, under every effective limit.
+    got, info = pl2.split_reduction_cascading({'EQ': 100.0}, {'EQ': 10, 'EQ_DEV': 20}, SMALL_TREE, SMALL_PLS, 0,
+                                              ['EQ_US', 'EQ_EU', 'EQ_EM'])
+    for i in info:
+        assert i['allocated'] == pytest.approx(10 / 3)
+        assert i['capped_by'] is None
+    assert got['EQ'] == pytest.approx(90.0)
@@ -0,0 +1,33 @@
+import io
+import os
+
+from catalog import FundCatalog, LoadReport, iter_fund_rows, load_catalog
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ROWS = """Fund A;SE0000000001;EQ_SE
+Fund B;SE0000000002;EQ_US
+Fund A;SE0000000003;EQ_EU
+;SE0000000004;EQ_SE
+Fund C
+Fund D;SE0000000002;EQ_JP
+"""
+
+
+def test_loaded_counts_the_funds_kept():
+    report = LoadReport()
+    catalog = FundCatalog(iter_fund_rows(io.StringIO(ROWS), report))
+    assert report.rows_read == 6
+    assert report.loaded == len(catalog) == 3
+    assert report.duplicate_names == {"Fund A": 1}
+    assert catalog.class_of("Fund A") == "EQ_EU"  # the later row wins
+    assert report.skipped == {"missing name or class": 1, "malformed": 1}
+    assert report.conflicting_isins == {"SE0000000002": {"EQ_US", "EQ_JP"}}
+    assert report.summary().startswith("Read 6 rows, loaded 3 funds.")
+
+
+def test_shipped_catalog_summary_matches_its_size():
+    report = LoadReport()
+    catalog = load_catalog(os.path.join(ROOT, "data", "catalog.csv"), report)
+    assert report.loaded == len(catalog)
+    assert report.rows_read == report.loaded + sum(report.duplicate_names.values()) + sum(report.skipped.values())
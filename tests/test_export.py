@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import bulk
+import export
+from export import COLUMNS, ColumnarWriter, ResultBlock, read_npy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def blocks(n=40):
+    """(account_id, ResultBlock) pairs of 1-6 rows, core rows with NaN limits."""
+    out = []
+    for i in range(n):
+        k = i % 6 + 1
+        out.append((f"A{i}", ResultBlock(
+            [f"Fund {i % 7}-{j}" for j in range(k)], [f"SE{j:010d}" for j in range(k)],
+            ["EQ_SE" if j % 2 else "MM_SEK" for j in range(k)], [100.0 / k] * k,
+            [float("nan") if j == 0 else 2.5 * j for j in range(k)], ["" if j == 0 else "leaf" for j in range(k)],
+            ["core" if j == 0 else "satellite" for j in range(k)])))
+    return out
+
+
+def expected_columns(pairs):
+    cols = {c: [] for c in COLUMNS}
+    for account_id, block in pairs:
+        cols["account_id"] += [account_id] * len(block.fund)
+        for c in COLUMNS[1:]:
+            cols[c] += list(getattr(block, c))
+    return cols
+
+
+def check(columns, pairs):
+    expected = expected_columns(pairs)
+    for c in COLUMNS:
+        if c in export.FLOAT_COLUMNS:
+            np.testing.assert_array_equal(np.asarray(columns[c], dtype=float), expected[c])
+        else:
+            assert list(columns[c]) == expected[c]
+
+
+@pytest.mark.parametrize("chunk_rows", [4, 7, 1000])
+def test_npy_round_trip(tmp_path, chunk_rows):
+    pairs = blocks()
+    with ColumnarWriter(str(tmp_path / "out.npy"), "npy", chunk_rows=chunk_rows) as w:
+        for account_id, block in pairs:
+            w.write(account_id, block)
+    check(read_npy(str(tmp_path / "out.npy")), pairs)
+    codes = read_npy(str(tmp_path / "out.npy"), decode=False, mmap=True)
+    assert codes["fund"].dtype == np.int32
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_pyarrow_round_trip(tmp_path, fmt):
+    pa = pytest.importorskip("pyarrow")
+    path, pairs = str(tmp_path / f"out.{fmt}"), blocks()
+    with ColumnarWriter(path, fmt, chunk_rows=7) as w:
+        for account_id, block in pairs:
+            w.write(account_id, block)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+    else:
+        table = pa.ipc.open_file(path).read_all()
+    check({c: table.column(c).to_pylist() for c in COLUMNS}, pairs)
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_without_pyarrow_writes_npy(tmp_path, monkeypatch, capsys, fmt):
+    monkeypatch.setattr(export, "pa", None)
+    with pytest.raises(ImportError):
+        ColumnarWriter(str(tmp_path / f"direct.{fmt}"), fmt)
+    clients = tmp_path / "clients.csv"
+    clients.write_text("account_id;pl_level;risk_level;core_funds;satellite_funds\n"
+                       "A1;PL3;4;SEB 392 Korträntefond SEK;Spiltan Aktiefond Småland\n", encoding="utf-8")
+    out = tmp_path / f"results.{fmt}"
+    rc = bulk.main([str(clients), "--catalog", os.path.join(ROOT, "test.csv"), "--out", str(out), "--workers", "0"])
+    assert rc == 0
+    assert "pyarrow" in capsys.readouterr().err
+    assert not out.exists()
+    columns = read_npy(str(tmp_path / "results.npy"))
+    assert set(columns["account_id"]) == {"A1"}
+    assert list(columns["fund"]) == ["SEB 392 Korträntefond SEK"]
@@ -0,0 +1,90 @@
+import pytest
+
+from holdings import HELD, SATELLITE, FundRegistry, HoldingStore, Overlay
+from portfolio import PortfolioHolding
+
+
+@pytest.fixture
+def store(rules, core_funds):
+    st = HoldingStore(FundRegistry())
+    for cn in ("EQ_SE", "EQ_WI", "MM_SEK"):
+        st.append(core_funds[cn], 10.0, HELD)
+    return st
+
+
+def check_index(st: HoldingStore):
+    """The index and count agree with a scan of the columns."""
+    for r, fid in enumerate(st.fund):
+        assert st.row(fid) == st.fund.index(fid)
+    assert len(st) == sum(1 for f in st.flags if f & HELD)
+
+
+def test_rows_and_len(store, core_funds, satellite):
+    assert len(store) == 3
+    assert store.row_of("EQ_WI Core") == 1
+    assert store.row_of("nothing") == -1
+    r = store.append(satellite("EQ_US"), 0.0, SATELLITE, 5.0, group=store.fund[1])
+    assert store.row_of(satellite("EQ_US").name) == r and len(store) == 3
+    store.set_held(r, True)
+    assert len(store) == 4 and satellite("EQ_US").name in store
+    check_index(store)
+
+
+def test_delete_moves_later_rows(store, core_funds):
+    store.delete(0)
+    assert store.row_of("EQ_SE Core") == -1 and store.row_of("MM_SEK Core") == 1
+    del store["EQ_WI Core"]
+    assert list(store) == ["MM_SEK Core"]
+    check_index(store)
+
+
+def test_setitem_and_delitem(store, core_funds, satellite):
+    store["EQ_US Satellite 1"] = PortfolioHolding(satellite("EQ_US"), 2.0, True, 5.0)
+    store["EQ_SE Core"] = PortfolioHolding(core_funds["EQ_SE"], 8.0)
+    assert store["EQ_SE Core"].allocation == 8.0 and len(store) == 4
+    del store["EQ_US Satellite 1"]
+    assert len(store) == 3
+    check_index(store)
+
+
+def test_fork_is_copy_on_write(store, satellite):
+    fork = store.fork()
+    r = fork.append(satellite("EQ_US"), 1.0, SATELLITE | HELD)
+    fork.alloc[fork.row_of("EQ_SE Core")] = 0.0
+    assert len(store) == 3 and store.row_of(satellite("EQ_US").name) == -1
+    assert store["EQ_SE Core"].allocation == 10.0
+    assert len(fork) == 4 and fork.row_of(satellite("EQ_US").name) == r
+    check_index(store)
+    check_index(fork)
+
+
+def test_views_follow_moved_rows(store):
+    view = store["MM_SEK Core"]
+    store.delete(0)
+    assert view.allocation == 10.0
+    view.allocation = 4.0
+    assert store.alloc[store.row_of("MM_SEK Core")] == 4.0
+
+
+def test_overlay_reads_through_and_keeps_base():
+    base = {"a": {"alloc": 1.0}, "b": {"alloc": 2.0}}
+    o = Overlay(base)
+    o.own("a")["alloc"] -= 0.5
+    o["c"] = {"alloc": 0.5}
+    del o["b"]
+    assert list(o) == ["a", "c"] and len(o) == 2
+    assert o["a"]["alloc"] == 0.5 and base["a"]["alloc"] == 1.0 and "b" in base
+    assert dict(o.items()) == {"a": {"alloc": 0.5}, "c": {"alloc": 0.5}}
+
+
+def test_fork_of_a_fork(store, satellite):
+    first = store.fork()
+    first.append(satellite("EQ_US", 1), 1.0, SATELLITE | HELD)
+    second = first.fork()
+    second.append(satellite("EQ_US", 2), 1.0, SATELLITE | HELD)
+    first.append(satellite("EQ_US", 3), 1.0, SATELLITE | HELD)
+    assert list(first) == ["EQ_SE Core", "EQ_WI Core", "MM_SEK Core", "EQ_US Satellite 1", "EQ_US Satellite 3"]
+    assert list(second) == ["EQ_SE Core", "EQ_WI Core", "MM_SEK Core", "EQ_US Satellite 1", "EQ_US Satellite 2"]
+    assert second.row_of(satellite("EQ_US", 3).name) == -1 and len(store) == 3
+    for st in (store, first, second):
+        check_index(st)
@@ -0,0 +1,80 @@
+import json
+import os
+import random
+import sqlite3
+
+import pytest
+
+import bulk
+from catalog import load_catalog
+from pldata import RULES_PATH
+from resultstore import SCHEMA_VERSION, ResultStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATALOG = os.path.join(ROOT, "test.csv")
+ROWS = "SELECT account_id, fund, allocation, leaf_limit, binding, role FROM holdings ORDER BY account_id, rowid"
+# Only an MM_SEK core fund at PL3 risk level 6, where MM_SEK is 0: nothing to hold until the edit below.
+EMPTY = "E0;PL3;6;SEB 392 Korträntefond SEK;Spiltan Aktiefond Småland"
+
+
+@pytest.fixture(scope="module")
+def files(tmp_path_factory):
+    """A client file with small cores, the shipped rules and a copy with PL3 MM_SEK raised at risk index 5."""
+    d = tmp_path_factory.mktemp("incremental")
+    names = sorted(load_catalog(CATALOG))
+    rnd = random.Random(1)
+    with open(d / "clients.csv", "w", encoding="utf-8") as f:
+        f.write("account_id;pl_level;risk_level;core_funds;satellite_funds\n")
+        f.write(EMPTY + "\n")
+        for i in range(600):
+            core, sats = rnd.sample(names, rnd.randint(1, 3)), rnd.sample(names, rnd.randint(0, 3))
+            f.write(f"A{i};{rnd.choice(['PL2', 'PL3', 'PL4'])};{rnd.randint(1, 7)};{'|'.join(core)};"
+                    f"{'|'.join(sats)}\n")
+    with open(RULES_PATH, encoding="utf-8") as f:
+        rules = json.load(f)
+    rules["levels"]["PL3"]["MM_SEK"][5] += 9
+    with open(d / "rules.json", "w", encoding="utf-8") as f:
+        json.dump(rules, f)
+    return str(d / "clients.csv"), str(d / "rules.json")
+
+
+def run(clients, out, *extra):
+    assert bulk.main([clients, "--catalog", CATALOG, "--out", out, "--workers", "0", *extra]) == 0
+
+
+def rows(path):
+    with sqlite3.connect(path) as db:
+        return db.execute(ROWS).fetchall()
+
+
+def test_incremental_matches_full_recompute(tmp_path, files):
+    clients, edited = files
+    inc, full = str(tmp_path / "inc.db"), str(tmp_path / "full.db")
+    run(clients, inc)
+    with ResultStore(inc) as store:
+        assert store.portfolio("E0") == []
+        assert "E0" in store.accounts_under(next(iter(store.versions())))
+    run(clients, inc, "--rules", edited, "--skip-validation", "--incremental")
+    run(clients, full, "--rules", edited, "--skip-validation")
+    assert rows(inc) == rows(full)
+    with ResultStore(inc) as store:
+        assert store.portfolio("E0")
+        assert store.untracked() == []
+
+
+def test_upgraded_store_recomputes_accounts_without_rows(tmp_path, files):
+    clients, edited = files
+    path = str(tmp_path / "old.db")
+    run(clients, path)
+    with sqlite3.connect(path) as db:  # as schema 2 left it: no accounts table
+        db.execute("DROP TABLE accounts")
+        db.execute("PRAGMA user_version = 2")
+    with ResultStore(path) as store:
+        assert store.db.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        without_rows = {a for a, in store.db.execute(
+            "SELECT account_id FROM reads EXCEPT SELECT account_id FROM holdings")}
+        assert "E0" in without_rows and set(store.untracked()) == without_rows
+    run(clients, path, "--rules", edited, "--skip-validation", "--incremental")
+    full = str(tmp_path / "full.db")
+    run(clients, full, "--rules", edited, "--skip-validation")
+    assert rows(path) == rows(full)
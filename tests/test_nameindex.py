@@ -0,0 +1,135 @@
+import os
+import random
+
+import pytest
+
+from catalog import FundCatalog, LoadReport, load_catalog
+from nameindex import NameIndex, normalize, trigrams
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FUNDS = FundCatalog([
+    ("Robeco New World Financials D EUR", "LU0000000001", "EQ_WO"),
+    ("Öhman Global Hållbar A", "SE0000000002", "EQ_WO"),
+    ("Alpha Global Equity A SEK", "SE0000000003", "EQ_WO"),
+    ("Alpha Global Equity B SEK", "SE0000000004", "EQ_WO"),
+    ("Nordic Bond Fund", "SE0000000005", "BO_SEK"),
+    ("Nordic-Bond Fund", "SE0000000006", "BO_SEK"),
+    ("Sverige Index", "SE0000000007", "EQ_SE"),
+    ("Sverige Index (old class)", "SE0000000007", "EQ_SE"),
+])
+
+
+@pytest.fixture(scope="module")
+def index():
+    return NameIndex(FUNDS, aliases={"Swedbank Sverige Index": "Sverige Index"})
+
+
+def test_exact_name(index):
+    r = index.resolve("Sverige Index")
+    assert r.exact and not r.ambiguous
+    assert r.best == ("Sverige Index", "SE0000000007", "EQ_SE", 1.0)
+
+
+@pytest.mark.parametrize("query", ["Robeco New World Financials D €", "  robeco new  world financials d eur ",
+                                   "ROBECO NEW WORLD FINANCIALS-D-EUR"])
+def test_normalized_name(index, query):
+    r = index.resolve(query)
+    assert r.exact
+    assert r.best.name == "Robeco New World Financials D EUR"
+
+
+def test_accents_and_aliases(index):
+    assert index.resolve("Ohman Global Hallbar A").best.isin == "SE0000000002"
+    r = index.resolve("swedbank sverige index")
+    assert r.exact and r.best.name == "Sverige Index"
+
+
+@pytest.mark.parametrize("query", ["SE0000000002", " se0000000002 "])
+def test_isin(index, query):
+    r = index.resolve(query)
+    assert r.exact and not r.ambiguous
+    assert r.best.name == "Öhman Global Hållbar A"
+
+
+def test_one_match_per_isin(index):
+    # Both Sverige Index share classes carry one ISIN, so they do not compete.
+    r = index.resolve("Sverige Indx")
+    assert not r.exact and not r.ambiguous
+    assert [m.isin for m in r.matches].count("SE0000000007") == 1
+    assert r.best.name == "Sverige Index"
+
+
+def test_fuzzy_name(index):
+    r = index.resolve("Robeco New Wrld Financials D")
+    assert not r.exact and not r.ambiguous
+    assert r.best.name == "Robeco New World Financials D EUR"
+    assert index.min_score <= r.best.score < 1.0
+
+
+def test_ambiguous_fuzzy_name(index):
+    r = index.resolve("Alpha Global Equity SEK")
+    assert r.ambiguous and r.best is None
+    assert {m.name for m in r.matches[:2]} == {"Alpha Global Equity A SEK", "Alpha Global Equity B SEK"}
+    assert r.reason.startswith("ambiguous fund name: 'Alpha Global Equity ")
+
+
+def test_ambiguous_exact_name(index):
+    # Two funds with different ISINs normalise to the same name.
+    r = index.resolve("nordic bond fund")
+    assert r.exact and r.ambiguous and r.best is None
+    assert [m.score for m in r.matches] == [1.0, 1.0]
+
+
+@pytest.mark.parametrize("query", ["", "   ", "-", "zzqx"])
+def test_empty_or_unknown_query(index, query):
+    r = index.resolve(query)
+    assert r.matches == [] and r.best is None
+    assert r.reason == "not in the fund catalog."
+
+
+def test_alias_to_unknown_fund():
+    with pytest.raises(KeyError):
+        NameIndex(FUNDS, aliases={"Old Name": "No Such Fund"})
+
+
+def brute_force_best(grams, query, min_score):
+    """(score, name) of the best fund by Dice over every catalog name, or None below min_score."""
+    q = trigrams(normalize(query))
+    scored = [(-2 * len(q & t) / (len(q) + len(t)), name) for name, t in grams.items()]
+    score, name = min(scored)
+    return (-score, name) if -score >= min_score - 1e-12 else None
+
+
+def mangle(rnd, name):
+    chars = list(name)
+    for _ in range(rnd.randrange(1, 4)):
+        i = rnd.randrange(len(chars))
+        op = rnd.randrange(3)
+        if op == 0:
+            del chars[i]
+        elif op == 1:
+            chars[i] = rnd.choice("abcdefghijklmnopqrstuvwxyz ")
+        else:
+            chars.insert(i, rnd.choice("abcdefghijklmnopqrstuvwxyz"))
+    words = "".join(chars).split()
+    if len(words) > 2 and rnd.random() < 0.3:
+        del words[rnd.randrange(len(words))]
+    return " ".join(words)
+
+
+def test_pruned_search_finds_the_brute_force_best():
+    catalog = load_catalog(os.path.join(ROOT, "data", "catalog.csv"), LoadReport())
+    index = NameIndex(catalog)
+    grams = {name: trigrams(normalize(name)) for name in catalog}
+    rnd = random.Random(7)
+    names = sorted(catalog)
+    for _ in range(300):
+        query = mangle(rnd, rnd.choice(names))
+        expected = brute_force_best(grams, query, index.min_score)
+        got = index.candidates(query)
+        if expected is None:
+            assert got == []
+        else:
+            # Ties rank by name, so the best is the same fund, not just the same score.
+            assert (got[0].score, got[0].name) == (pytest.approx(expected[0]), expected[1])
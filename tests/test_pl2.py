@@ -0,0 +1,81 @@
+import itertools
+import random
+
+import pytest
+
+import pl2
+from allocation_cache import AllocationCache
+
+# Three children with equal leaf limits under one core, so the input order
+# decides which of them the headroom runs out on.
+TIES = ([("PL2", {"A": [40.0], "B": [60.0]}), ("PL3", {"X": [5.0], "Y": [5.0], "Z": [5.0], "W": [2.0]})],
+        {"A": 30.0, "B": 10.0},
+        {"A": {"children": {"X": {}, "Y": {}, "Z": {}}}, "B": {"children": {"W": {}}}})
+
+
+def both(core_pl, rt, tree, pls, risk, sats, cache):
+    expected = pl2.split_reduction_with_leaf_limits(core_pl, rt, tree, pls, risk, sats)
+    got = pl2.split_reduction_with_leaf_limits_cached(core_pl, rt, tree, pls, risk, sats, cache)
+    return (list(expected[0].items()), expected[1]), (list(got[0].items()), got[1])
+
+
+def test_cached_matches_uncached_with_ties():
+    pls, rt, tree = TIES
+    core_pl, cache = pl2.core_template(dict(pls)["PL2"], 0), AllocationCache()
+    for sats in itertools.permutations(["X", "Y", "Z", "W"]):
+        expected, got = both(core_pl, rt, tree, pls, 0, list(sats), cache)
+        assert got == expected
+    assert cache.hits  # orders that agree on X, Y, Z share an entry
+
+
+def test_cached_matches_uncached(rules_data):
+    pls, rt, tree = rules_data
+    classes = sorted({c for _, pl in pls for c in pl})
+    rnd, cache = random.Random(0), AllocationCache()
+    for _ in range(300):
+        level = rnd.choice(pls)[1]
+        risk = rnd.randrange(7)
+        sats = rnd.sample(classes, rnd.randrange(1, 6))
+        expected, got = both(pl2.core_template(level, risk), rt, tree, pls, risk, sats, cache)
+        assert got == expected
+
+
+def test_cached_results_are_copies(rules_data):
+    pls, rt, tree = rules_data
+    core_pl, cache = pl2.core_template(dict(pls)["PL3"], 5), AllocationCache()
+    first, info = pl2.split_reduction_with_leaf_limits_cached(core_pl, rt, tree, pls, 5, ["EQ_US", "EQ_EU"], cache)
+    first["EQ_US"] = -1
+    info[0]["allocated"] = -1
+    again, info = pl2.split_reduction_with_leaf_limits_cached(core_pl, rt, tree, pls, 5, ["EQ_US", "EQ_EU"], cache)
+    assert again["EQ_US"] > 0 and info[0]["allocated"] > 0
+
+
+def test_fingerprint_is_computed_once_per_rules(rules_data, monkeypatch):
+    import allocation_cache
+    calls = []
+    real = allocation_cache.rules_fingerprint
+    monkeypatch.setattr(allocation_cache, "rules_fingerprint", lambda *a: calls.append(1) or real(*a))
+    cache = AllocationCache()
+    for _ in range(5):
+        cache.fingerprint_of(*rules_data)
+    assert len(calls) == 1
+    cache.fingerprint_of(list(rules_data.pl_dicts), rules_data.reduction_table, rules_data.tree)
+    assert len(calls) == 2
+
+
+def test_single_level_allocators_use_the_leaf_table(rules_data):
+    pls, rt, tree = rules_data
+    pl4 = dict(pls)["PL4"]
+    assert pl2.level_limit_table(pl4) is pl2.level_limit_table(pl4)
+    classes = sorted({c for _, pl in pls for c in pl})
+    rnd = random.Random(1)
+    for _ in range(200):
+        risk = rnd.randrange(7)
+        core_pl = pl2.core_template(rnd.choice(pls)[1], risk)
+        sats = rnd.sample(classes, rnd.randrange(1, 6))
+        _, results = pl2.add_satellites(core_pl, rt, tree, pl4, risk, sats)
+        for info in results:
+            assert info['leaf_limit'] == pl4.get(info['satellite_class'], [0] * 7)[risk]
+            one = pl2.max_satellite_allocation(core_pl, rt, tree, pl4, risk, info['satellite_class'])
+            assert one['leaf_limit'] == info['leaf_limit']
+            assert one['max_allocation'] == min(one['reduction_limit'], one['leaf_limit'])
@@ -0,0 +1,100 @@
+import random
+
+import pytest
+
+from allocation_cache import AllocationCache
+from portfolio import Portfolio
+
+SATELLITES = [("EQ_US", 1), ("EQ_US", 2), ("EQ_EU", 1), ("EQ_JP", 1), ("EQ_EM", 1), ("EQ_SE", 1), ("EQ_SE", 2),
+              ("HY_SEK", 1), ("IG_SEK", 1), ("BO_SEK", 1), ("CR_SEK", 1), ("MM_SEK", 1)]
+
+
+def allocations(p: Portfolio) -> dict:
+    return {name: h.allocation for name, h in p.holdings.items()}
+
+
+def full(rules, core_funds, pl, risk, sats, cache=None) -> Portfolio:
+    p = Portfolio.build_from_level("full", pl, risk, core_funds, rules)
+    p.add_satellites(sats, risk, cache=cache)
+    return p
+
+
+@pytest.mark.parametrize("pl", ["PL2", "PL3", "PL4"])
+@pytest.mark.parametrize("risk", [0, 3, 5])
+def test_incremental_add_matches_full(rules, core_funds, satellite, pl, risk):
+    sats = [satellite(c, n) for c, n in SATELLITES]
+    expected = allocations(full(rules, core_funds, pl, risk, sats))
+    for seed in range(3):
+        order = sats[:]
+        random.Random(seed).shuffle(order)
+        p = Portfolio.build_from_level("incremental", pl, risk, core_funds, rules)
+        for f in order:
+            p.add_satellite(f, risk)
+        assert allocations(p) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("pl", ["PL2", "PL3", "PL4"])
+def test_incremental_remove_matches_full(rules, core_funds, satellite, pl):
+    risk = 4
+    sats = [satellite(c, n) for c, n in SATELLITES]
+    p = full(rules, core_funds, pl, risk, sats)
+    kept = sats[:]
+    for f in sats[::3]:
+        p.remove_satellite(f.name)
+        kept.remove(f)
+        assert allocations(p) == pytest.approx(allocations(full(rules, core_funds, pl, risk, kept)))
+
+
+def test_mixed_edits_match_full(rules, core_funds, satellite):
+    pl, risk = "PL4", 5
+    p = Portfolio.build_from_level("mixed", pl, risk, core_funds, rules)
+    p.add_satellites([satellite("EQ_US", 1), satellite("EQ_JP", 1)], risk)
+    p.add_satellite(satellite("EQ_US", 2))
+    p.remove_satellite(satellite("EQ_JP", 1).name)
+    p.add_satellite(satellite("EQ_US", 3))
+    expected = full(rules, core_funds, pl, risk, [satellite("EQ_US", n) for n in (1, 2, 3)])
+    assert allocations(p) == pytest.approx(allocations(expected))
+
+
+def test_cached_matches_uncached(rules, core_funds, satellite):
+    cache = AllocationCache()
+    sats = [satellite(c, n) for c, n in SATELLITES]
+    for pl in ("PL2", "PL3", "PL4"):
+        for risk in range(7):
+            expected = allocations(full(rules, core_funds, pl, risk, sats))
+            assert allocations(full(rules, core_funds, pl, risk, sats, cache)) == pytest.approx(expected)
+            assert allocations(full(rules, core_funds, pl, risk, sats[::-1], cache)) == pytest.approx(expected)
+    assert cache.hits
+
+
+def test_totals_stay_at_100(rules, core_funds, satellite):
+    sats = [satellite(c, n) for c, n in SATELLITES]
+    for pl in ("PL2", "PL3", "PL4"):
+        for risk in range(7):
+            assert sum(allocations(full(rules, core_funds, pl, risk, sats)).values()) == pytest.approx(100)
+
+
+def test_forks_do_not_leak_into_the_core(rules, core_funds, satellite):
+    before = allocations(Portfolio.build_from_level("a", "PL3", 5, core_funds, rules))
+    p = Portfolio.build_from_level("b", "PL3", 5, core_funds, rules)
+    p.add_satellite(satellite("EQ_US"))
+    assert allocations(Portfolio.build_from_level("c", "PL3", 5, core_funds, rules)) == before
+    assert allocations(p) != before
+
+
+def test_rules_snapshot_is_settled_after_init(rules_data, satellite):
+    from portfolio import AllocationRules, Fund
+    rules = AllocationRules(*rules_data)
+    universes = rules._universes
+    assert rules.limit_universe(3) is universes[3]
+    core = {cn: Fund(f"{cn} Core", rules.get_asset_class(cn)) for cn in rules.asset_classes}
+    t = rules.core_template("PL3", 3, core)
+    rows, added = t.holdings._rows, t.holdings._added
+    for i in range(3):
+        p = Portfolio.build_from_level(f"P{i}", "PL3", 3, core, rules)
+        p.add_satellites([satellite("EQ_US", i), satellite("EQ_SE", i)], 3)
+    assert rules.core_template("PL3", 3, core) is t
+    assert t.holdings._rows is rows and t.holdings._added is added and not added
+    assert rules._universes is universes
+    with pytest.raises(AttributeError):
+        rules.version = "other"
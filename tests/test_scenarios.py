@@ -0,0 +1,83 @@
+import os
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import bulk
+import scenarios
+from batch import LevelMatrix
+from catalog import LoadReport, load_catalog
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATALOG = os.path.join(ROOT, "test.csv")
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    return load_catalog(CATALOG, LoadReport())
+
+
+@pytest.fixture(scope="module")
+def clients(catalog, rules_data):
+    """A book with partial cores, repeated funds and satellites that are also core funds."""
+    rnd = random.Random(0)
+    names = sorted(catalog)
+    levels = [name for name, _ in rules_data.pl_dicts]
+    out = []
+    for i in range(400):
+        core = rnd.sample(names, rnd.randrange(1, 8))
+        sats = rnd.sample(names, rnd.randrange(0, 6)) + rnd.sample(core, rnd.randrange(0, 2))
+        if sats and rnd.random() < 0.2:
+            sats.append(sats[0])
+        out.append(bulk.parse_client({"account_id": f"A{i}", "pl_level": rnd.choice(levels),
+                                      "risk_level": rnd.randint(1, 7), "core_funds": core,
+                                      "satellite_funds": sats}))
+    return out
+
+
+@pytest.fixture(scope="module")
+def bulk_weights(clients):
+    """Satellite weight and leaf-bound flag per client from bulk.py's portfolio engine, in book order."""
+    saved = dict(bulk._worker)
+    bulk.init_worker(CATALOG, "portfolio")
+    try:
+        weight, bound = [], []
+        for c in sorted(clients, key=lambda c: c["risk_level"]):
+            _, block, error = bulk.process_client(c)
+            assert error is None, error
+            weight.append(sum(a for a, role in zip(block.allocation, block.role) if role == "satellite"))
+            bound.append("leaf" in block.binding)
+        return np.array(weight), np.array(bound)
+    finally:
+        bulk._worker.clear()
+        bulk._worker.update(saved)
+
+
+def test_book_matches_bulk(clients, catalog, rules_data, bulk_weights):
+    matrix = LevelMatrix(*rules_data)
+    book, _ = scenarios.encode_book(clients, matrix, catalog)
+    weight, bound = scenarios.satellite_weights(matrix, book)
+    assert weight == pytest.approx(bulk_weights[0], abs=1e-9)
+    assert (bound == bulk_weights[1]).all()
+
+
+def test_zero_shock_sweep_matches_bulk(clients, catalog, rules_data, bulk_weights):
+    base, records, _ = scenarios.sweep(clients, catalog, scenarios.grid(), rules=rules_data, workers=0)
+    expected = scenarios.summarize(*bulk_weights)
+    assert base == pytest.approx(expected)
+    [record] = records
+    assert record["changed_portfolios"] == 0
+    assert record["tables_consistent"]
+    assert all(v == 0 or v == [0] * len(v) for v in record["delta"].values())
+
+
+def test_encode_book_skips_bad_rows(clients, catalog, rules_data):
+    matrix = LevelMatrix(*rules_data)
+    bad = [{"account_id": "X", "error": "bad client row: missing pl_level"},
+           {**clients[0], "account_id": "R0", "risk_level": 0},
+           {**clients[0], "account_id": "R8", "risk_level": 8}]
+    book, skipped = scenarios.encode_book(bad + clients[:10], matrix, catalog)
+    assert len(book.level) == 10
+    assert skipped["bad row"] == 1 and skipped["bad risk level"] == 2
@@ -0,0 +1,167 @@
+import itertools
+import random
+from collections import Counter
+
+import pytest
+
+import pl2
+from catalog import FundCatalog
+from selection import select_satellites
+
+# One core class A (headroom 30) over X, Y, Z with leaf limits 20, 10, 10 and
+# one core class B (headroom 6) over W with leaf limit 8.
+SMALL = ([("PL2", {"A": [100.0], "B": [60.0]}),
+          ("PL3", {"X": [20.0], "Y": [10.0], "Z": [10.0], "W": [8.0]})],
+         {"A": 30.0, "B": 10.0},
+         {"A": {"children": {"X": {}, "Y": {}, "Z": {}}}, "B": {"children": {"W": {}}}})
+
+
+def catalog_of(classes, per_class=1):
+    return FundCatalog((f"{cls} {n}", f"XX{cls}{n}", cls) for cls in classes for n in range(1, per_class + 1))
+
+
+def allocations(core_pl, rt, tree, pls, risk, classes):
+    _, info = pl2.split_reduction_with_leaf_limits(core_pl, rt, tree, pls, risk, list(classes))
+    return [i['allocated'] for i in info]
+
+
+def brute_force(core_pl, rt, tree, pls, risk, catalog, k, max_per_class, min_weight):
+    """Most headroom any k or fewer catalog funds take, scoring every choice with the allocator."""
+    # Funds of one class look the same to the rules, so choices are class multisets.
+    available = {cls: min(max_per_class, len(catalog.in_class(cls))) for cls in catalog.asset_classes}
+    best = 0.0
+    for m in range(1, k + 1):
+        for classes in itertools.combinations_with_replacement(sorted(available), m):
+            if any(n > available[cls] for cls, n in Counter(classes).items()):
+                continue
+            got = allocations(core_pl, rt, tree, pls, risk, classes)
+            if min_weight and (len(got) < m or min(got) < min_weight - 1e-9):
+                continue
+            best = max(best, sum(got))
+    return best
+
+
+def random_rules(rnd, n_classes=8):
+    """Two core classes A and B over n_classes leaves with random limits and headroom."""
+    leaves = {f"C{i}": [float(rnd.randint(1, 20))] for i in range(n_classes)}
+    under = {"A": {}, "B": {}}
+    for cls in leaves:
+        under[rnd.choice("AB")][cls] = {}
+    pls = [("PL2", {"A": [60.0], "B": [40.0]}), ("PL3", leaves)]
+    rt = {"A": float(rnd.choice([10, 25, 40, 60])), "B": float(rnd.choice([10, 25, 50]))}
+    return pls, rt, {core: {"children": children} for core, children in under.items()}
+
+
+def check(selection, core_pl, rt, tree, pls, risk, catalog, k, max_per_class, min_weight):
+    assert len(selection.funds) <= k
+    assert selection.classes == [catalog.class_of(f) for f in selection.funds]
+    assert max(Counter(selection.classes).values(), default=0) <= max_per_class
+    got = allocations(core_pl, rt, tree, pls, risk, selection.classes)
+    assert len(got) == len(selection.funds)
+    assert sum(got) == pytest.approx(selection.used)
+    assert all(a >= min_weight - 1e-9 for a in got)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_matches_exhaustive_search_on_small_catalogs(rules_data, seed):
+    pls, rt, tree = rules_data
+    rnd = random.Random(seed)
+    classes = sorted(c for _, pl in pls[1:] for c in pl)
+    for _ in range(6):
+        risk = rnd.randrange(7)
+        core_pl = pl2.core_template(dict(pls)["PL2"], risk)
+        catalog = catalog_of(rnd.sample(classes, 5), per_class=rnd.choice([1, 2]))
+        k, max_per_class = rnd.randrange(1, 5), rnd.choice([1, 2])
+        min_weight = rnd.choice([0.0, 1.0, 4.0, 10.0])
+        sel = select_satellites(core_pl, rt, tree, pls, risk, catalog, k, max_per_class, min_weight, time_budget=5.0)
+        assert sel.optimal
+        assert sel.bound == pytest.approx(sel.used)
+        check(sel, core_pl, rt, tree, pls, risk, catalog, k, max_per_class, min_weight)
+        assert sel.used == pytest.approx(brute_force(core_pl, rt, tree, pls, risk, catalog, k, max_per_class,
+                                                     min_weight))
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_branch_and_bound_matches_exhaustive_search(seed):
+    # Minimum weights large enough that the greedy seeds often miss the
+    # relaxed bound, so the search itself runs.
+    rnd = random.Random(seed)
+    for _ in range(8):
+        pls, rt, tree = random_rules(rnd)
+        core_pl = pl2.core_template(dict(pls)["PL2"], 0)
+        catalog = catalog_of(dict(pls)["PL3"], per_class=2)
+        k, max_per_class = rnd.randrange(2, 6), rnd.choice([1, 2])
+        min_weight = rnd.choice([0.0, 3.0, 5.0, 8.0, 12.0])
+        sel = select_satellites(core_pl, rt, tree, pls, 0, catalog, k, max_per_class, min_weight, time_budget=5.0)
+        assert sel.optimal
+        check(sel, core_pl, rt, tree, pls, 0, catalog, k, max_per_class, min_weight)
+        assert sel.used == pytest.approx(brute_force(core_pl, rt, tree, pls, 0, catalog, k, max_per_class,
+                                                     min_weight))
+
+
+def test_min_weight_leaves_out_picks_it_would_starve():
+    pls, rt, tree = SMALL
+    core_pl = pl2.core_template(dict(pls)["PL2"], 0)
+    catalog = catalog_of(["X", "Y", "Z", "W"])
+    # Without a minimum X + Y fill A's 30 and W takes B's 6.
+    sel = select_satellites(core_pl, rt, tree, pls, 0, catalog, k=3)
+    assert sel.funds == ["X 1", "Y 1", "W 1"]
+    assert sel.used == pytest.approx(36.0)
+    # At 12 each, Y (10) and W (6 of headroom) would fall short, leaving X.
+    sel = select_satellites(core_pl, rt, tree, pls, 0, catalog, k=3, min_weight=12.0)
+    check(sel, core_pl, rt, tree, pls, 0, catalog, 3, 1, 12.0)
+    assert sel.funds == ["X 1"]
+    assert sel.used == pytest.approx(brute_force(core_pl, rt, tree, pls, 0, catalog, 3, 1, 12.0)) == 20.0
+
+
+def test_infeasible_budgets_select_nothing():
+    pls, rt, tree = SMALL
+    core_pl = pl2.core_template(dict(pls)["PL2"], 0)
+    catalog = catalog_of(["X", "Y", "Z", "W"])
+    # No leaf limit reaches the minimum weight.
+    sel = select_satellites(core_pl, rt, tree, pls, 0, catalog, k=3, min_weight=25.0)
+    assert (sel.funds, sel.used, sel.optimal) == ([], 0.0, True)
+    # A's headroom of 30 leaves no pick 21 beyond the largest, and B's is 6.
+    sel = select_satellites(core_pl, rt, tree, pls, 0, catalog, k=3, min_weight=20.0)
+    assert sel.funds == ["X 1"]
+    assert sel.used == pytest.approx(20.0)
+    # No picks allowed, or nothing left once the catalog is excluded.
+    assert select_satellites(core_pl, rt, tree, pls, 0, catalog, k=0).funds == []
+    sel = select_satellites(core_pl, rt, tree, pls, 0, catalog, k=3, exclude=list(catalog))
+    assert (sel.funds, sel.used) == ([], 0.0)
+
+
+def test_more_picks_than_funds():
+    pls, rt, tree = SMALL
+    core_pl = pl2.core_template(dict(pls)["PL2"], 0)
+    catalog = catalog_of(["X", "W"])
+    sel = select_satellites(core_pl, rt, tree, pls, 0, catalog, k=5)
+    assert sorted(sel.funds) == ["W 1", "X 1"]
+    assert sel.used == pytest.approx(26.0)
+    assert sel.headroom == {"A": 30.0, "B": 6.0}
+
+
+def test_ties_go_to_fewer_funds():
+    pls, rt, tree = SMALL
+    core_pl = pl2.core_template(dict(pls)["PL2"], 0)
+    # Only A's classes: X + Y fills its 30 and a third pick would add nothing.
+    catalog = catalog_of(["X", "Y", "Z"])
+    sel = select_satellites(core_pl, rt, tree, pls, 0, catalog, k=3)
+    assert sel.used == pytest.approx(30.0)
+    assert len(sel.funds) == 2
+    # Y and Z tie; the class that sorts first wins, and so does the first fund of a class.
+    assert sel.funds == ["X 1", "Y 1"]
+    sel = select_satellites(core_pl, rt, tree, pls, 0, catalog_of(["Y", "Z"], per_class=2), k=2, max_per_class=2)
+    assert sel.funds == ["Y 1", "Y 2"]
+
+
+def test_timed_out_search_keeps_a_valid_selection(rules_data):
+    pls, rt, tree = rules_data
+    core_pl = pl2.core_template(dict(pls)["PL2"], 3)
+    catalog = catalog_of(sorted(c for _, pl in pls[1:] for c in pl), per_class=2)
+    sel = select_satellites(core_pl, rt, tree, pls, 3, catalog, k=4, max_per_class=2, min_weight=3.0,
+                            time_budget=0.0)
+    check(sel, core_pl, rt, tree, pls, 3, catalog, 4, 2, 3.0)
+    assert sel.bound >= sel.used - 1e-9
+    if sel.optimal:
+        assert sel.bound == pytest.approx(sel.used)
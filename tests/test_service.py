@@ -0,0 +1,204 @@
+import asyncio
+import os
+
+import pytest
+
+import bulk
+from service import AllocationService, Client, DeadlineExceeded, HttpServer, Overloaded
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATALOG = os.path.join(ROOT, "test.csv")
+CLIENT = {"account_id": "A1", "pl_level": "PL2", "risk_level": 3,
+          "core_funds": ["Spiltan Småbolagsfond", "SEB 392 Korträntefond SEK"],
+          "satellite_funds": ["Spiltan Aktiefond Småland"]}
+
+
+def run(test, max_body=4096, **kw):
+    """Run test(service, server) against a service on a loopback port, shutting both down after."""
+    async def main():
+        svc = AllocationService(CATALOG, **kw)
+        await svc.start()
+        server = await HttpServer(svc, max_body).start("127.0.0.1", 0)
+        try:
+            return await test(svc, server)
+        finally:
+            await asyncio.wait_for(server.close(), 5)
+            await svc.close()
+    return asyncio.run(main())
+
+
+async def raw(server, head: bytes, body: bytes = b""):
+    """Send one hand-written request; (status line, whole response up to the server closing)."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+    writer.write(head + b"\r\n\r\n" + body)
+    await writer.drain()
+    data = await asyncio.wait_for(reader.read(), 5)  # returns once the server closes
+    writer.close()
+    return data.split(b"\r\n", 1)[0].decode(), data
+
+
+def client(n, **kw):
+    return dict(CLIENT, account_id=f"A{n}", **kw)
+
+# ==============================================================================
+# MICRO-BATCHING
+# ==============================================================================
+def test_waiting_requests_share_a_batch(monkeypatch):
+    calls = []
+
+    def process_client(c):
+        calls.append(c["account_id"])
+        return bulk_process_client(c)
+
+    bulk_process_client = bulk.process_client
+    monkeypatch.setattr(bulk, "process_client", process_client)
+
+    async def test(svc, server):
+        results = await asyncio.gather(*(svc.allocate(client(n)) for n in range(8)))
+        assert [r[0] for r in results] == [f"A{n}" for n in range(8)]
+        assert all(r[2] is None for r in results)
+        assert len({tuple(r[1].allocation) for r in results}) == 1
+        return dict(svc.stats)
+
+    stats = run(test, max_batch=8, max_wait=0.5)
+    assert stats["batches"] == 1 and stats["batched"] == 8
+    assert calls == ["A0"]  # identical portfolios in a batch are computed once
+
+
+def test_batches_hold_at_most_max_batch():
+    async def test(svc, server):
+        clients = [client(n, risk_level=1 + n % 7) for n in range(20)]
+        results = await asyncio.gather(*(svc.allocate(c) for c in clients))
+        assert [r[0] for r in results] == [c["account_id"] for c in clients]
+        return dict(svc.stats)
+
+    stats = run(test, max_batch=8, max_wait=0.5)
+    assert stats["batched"] == 20
+    assert stats["batches"] >= 3
+
+
+def test_allocate_over_http_matches_bulk():
+    async def test(svc, server):
+        conn = Client("127.0.0.1", server.port)
+        try:
+            status, body = await conn.allocate(CLIENT)
+            _, health = await conn.request("GET", "/health")
+        finally:
+            await conn.close()
+        return status, body, health
+
+    status, body, health = run(test)
+    _, block, _ = bulk.process_client(bulk.parse_client(CLIENT))
+    assert status == 200
+    assert body["account_id"] == "A1" and body["rules_version"] == block.rules_version
+    assert [h["fund"] for h in body["holdings"]] == list(block.fund)
+    assert health["requests"] == 1 and health["queued"] == 0
+
+# ==============================================================================
+# ERROR REPLIES
+# ==============================================================================
+@pytest.mark.parametrize("length", [b"abc", b"-5", b"1_0", b" +3"])
+def test_bad_content_length_gets_400_and_closes(length):
+    async def test(svc, server):
+        return await raw(server, b"POST /allocate HTTP/1.1\r\nContent-Length: " + length, b"{}")
+
+    status, data = run(test)
+    assert status == "HTTP/1.1 400 Bad Request"
+    assert b"Connection: close" in data and b"bad Content-Length" in data
+
+
+def test_oversized_body_gets_413_unread():
+    async def test(svc, server):
+        return await raw(server, b"POST /allocate HTTP/1.1\r\nContent-Length: 5000")
+
+    status, data = run(test, max_body=4096)
+    assert status == "HTTP/1.1 413 Payload Too Large"
+    assert b"Connection: close" in data
+
+
+@pytest.mark.parametrize("method, path, payload, status, error", [
+    ("POST", "/allocate", None, 400, "bad request"),
+    ("POST", "/allocate", {"account_id": "A", "pl_level": "PL2", "risk_level": 9}, 400, "risk_level must be 1-7"),
+    ("POST", "/allocate", ["not", "an", "object"], 400, "bad request"),
+    ("GET", "/allocate", None, 405, "use POST"),
+    ("GET", "/reload", None, 405, "use POST"),
+    ("GET", "/nowhere", None, 404, "no route /nowhere"),
+    ("POST", "/allocate", client(1, pl_level="PL9"), 422, ""),
+    ("POST", "/allocate", client(1, deadline_ms=0), 504, "deadline exceeded"),
+])
+def test_error_replies_keep_the_connection(method, path, payload, status, error):
+    async def test(svc, server):
+        conn = Client("127.0.0.1", server.port)
+        try:
+            got = await conn.request(method, path, payload)
+            # The connection still serves the next request.
+            health = await conn.request("GET", "/health")
+        finally:
+            await conn.close()
+        return got, health
+
+    (got_status, body), (health_status, _) = run(test)
+    assert got_status == status
+    assert error in body["error"]
+    assert health_status == 200
+
+
+def test_full_queue_gets_503():
+    async def test(svc, server):
+        svc._task.cancel()  # nothing drains the queue
+        first = asyncio.ensure_future(svc.allocate(client(1)))
+        await asyncio.sleep(0)
+        conn = Client("127.0.0.1", server.port)
+        try:
+            status, body = await conn.allocate(client(2))
+        finally:
+            await conn.close()
+        first.cancel()
+        return status, body, svc.stats["rejected"]
+
+    status, body, rejected = run(test, max_queue=1)
+    assert (status, body, rejected) == (503, {"error": "overloaded"}, 1)
+
+# ==============================================================================
+# SHUTDOWN
+# ==============================================================================
+def test_close_ends_idle_keep_alive_connections():
+    async def test(svc, server):
+        conn = Client("127.0.0.1", server.port)
+        status, _ = await conn.request("GET", "/health")
+        await asyncio.wait_for(server.close(), 5)
+        rest = await asyncio.wait_for(conn.reader.read(), 5)
+        await conn.close()
+        return status, rest
+
+    status, rest = run(test)
+    assert status == 200
+    assert rest == b""  # the server closed the connection
+
+
+def test_close_fails_queued_requests():
+    async def main():
+        svc = AllocationService(CATALOG)
+        pending = [asyncio.ensure_future(svc.allocate(client(n))) for n in range(3)]
+        await asyncio.sleep(0)
+        assert svc.queue.qsize() == 3
+        await svc.close()  # never started, so nothing took them off the queue
+        return await asyncio.gather(*pending, return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, Overloaded) for r in results)
+
+
+def test_expired_requests_are_dropped_from_their_batch():
+    async def test(svc, server):
+        svc._task.cancel()
+        expired = asyncio.ensure_future(svc.allocate(client(1), timeout=0.01))
+        with pytest.raises(DeadlineExceeded):
+            await expired
+        svc._task = asyncio.create_task(svc._batcher())
+        result = await svc.allocate(client(2))
+        return result, dict(svc.stats)
+
+    result, stats = run(test)
+    assert result[0] == "A2"
+    assert stats["expired"] == 1 and stats["batched"] == 1
@@ -0,0 +1,72 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from bench import synthetic_catalog
+from catalog import load_catalog, load_catalog_snapshot
+from snapshot import snapshot_path
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Generous: importing and loading the rules takes well under 100 ms beyond
+# the bare interpreter on a laptop; this only catches heavy imports creeping in.
+STARTUP_BUDGET_S = 0.5
+
+IMPORTS = """
+import json, sys, time
+t0 = time.perf_counter()
+import allocator, bulk, pl2, pldata, portfolio
+imported = time.perf_counter() - t0
+loaded_at_import = len(pldata._rules)
+pldata.load_rules()
+print(json.dumps({"imported": imported, "total": time.perf_counter() - t0, "loaded_at_import": loaded_at_import}))
+"""
+
+
+def best_of(n, fn) -> float:
+    times = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def test_startup_time():
+    runs = [json.loads(subprocess.run([sys.executable, "-c", IMPORTS], cwd=ROOT, capture_output=True, text=True,
+                                      check=True).stdout) for _ in range(3)]
+    assert all(r["loaded_at_import"] == 0 for r in runs)  # importing reads no data
+    best = min(r["total"] for r in runs)
+    print(f"import + load_rules: {best * 1000:.1f} ms")
+    assert best < STARTUP_BUDGET_S
+
+
+def test_portfolio_import_leaves_numpy_alone():
+    code = "import sys, portfolio; print(sorted({'numpy', 'validation'} & set(sys.modules)))"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "[]"
+
+
+def test_catalog_snapshot_beats_parsing(tmp_path):
+    path = str(tmp_path / "catalog.csv")
+    synthetic_catalog(path, 50)
+    parsed = best_of(3, lambda: load_catalog(path))
+    first, _ = load_catalog_snapshot(path)
+    snapped = best_of(3, lambda: load_catalog_snapshot(path))
+    print(f"parse {parsed * 1000:.1f} ms, snapshot {snapped * 1000:.1f} ms")
+    assert os.path.exists(snapshot_path(path, "catalog"))
+    assert snapped * 2 < parsed
+    again, report = load_catalog_snapshot(path)
+    with open(path, encoding="utf-8") as f:
+        assert len(again) == len(first) and report.rows_read == sum(1 for _ in f)
+
+
+def test_catalog_snapshot_follows_the_source(tmp_path):
+    path = tmp_path / "catalog.csv"
+    path.write_text("Fund A;SE0000000001;EQ_SE\n", encoding="utf-8")
+    assert list(load_catalog_snapshot(str(path))[0]) == ["Fund A"]
+    path.write_text("Fund A;SE0000000001;EQ_SE\nFund B;SE0000000002;EQ_US\n", encoding="utf-8")
+    catalog, _ = load_catalog_snapshot(str(path))
+    assert catalog.class_of("Fund B") == "EQ_US"
@@ -0,0 +1,94 @@
+import copy
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from bench import synthetic_rules
+from hierarchy import compile_tree
+from validation import TOLERANCE, check_levels, validate_levels
+
+
+def reference(pl_dicts, tree, num_risks=7):
+    """The rules checked cell by cell, as (rule, level, class, risk) tuples."""
+    h = compile_tree(tree)
+    out = set()
+    for li, (name, pl) in enumerate(pl_dicts):
+        for cls, allocs in pl.items():
+            for r in range(num_risks):
+                v = allocs[r] if r < len(allocs) else None
+                if v is None:
+                    out.add(("missing", name, cls, r))
+                elif v < -TOLERANCE:
+                    out.add(("negative", name, cls, r))
+        for r in range(num_risks):
+            total = sum(a[r] for a in pl.values() if r < len(a) and a[r] is not None)
+            if abs(total - 100) > TOLERANCE:
+                out.add(("column sum", name, None, r))
+        if li == 0:
+            continue
+        coarse_name, coarse = pl_dicts[li - 1]
+        sums = {}
+        for cls, allocs in pl.items():
+            owner = cls if cls in coarse else h.nearest_ancestor_in(cls, coarse)
+            if owner is None:
+                out.add(("no parent", name, cls, None))
+                continue
+            for r in range(num_risks):
+                v = allocs[r] if r < len(allocs) and allocs[r] is not None else 0.0
+                sums[owner, r] = sums.get((owner, r), 0.0) + v
+        for cls, allocs in coarse.items():
+            for r in range(num_risks):
+                v = allocs[r] if r < len(allocs) and allocs[r] is not None else 0.0
+                if abs(v - sums.get((cls, r), 0.0)) > TOLERANCE:
+                    out.add(("children sum", coarse_name, cls, r))
+    return out
+
+
+def found(report):
+    return {(v.rule, v.level, v.asset_class, v.risk) for v in report.violations}
+
+
+def test_shipped_rules_are_consistent(rules_data):
+    report = validate_levels(rules_data.pl_dicts, rules_data.tree)
+    assert report.ok, report.summary()
+    check_levels(rules_data.pl_dicts, rules_data.tree)
+
+
+def test_synthetic_rules_are_consistent():
+    # synthetic_rules rounds every cell to 4 decimals, so sums drift a little.
+    pl_dicts, _, tree = synthetic_rules(6, 3)
+    assert validate_levels(pl_dicts, tree, tolerance=0.01).ok
+
+
+def test_each_rule_is_reported(rules_data):
+    pl_dicts = copy.deepcopy([list(x) for x in rules_data.pl_dicts])
+    levels = dict(pl_dicts)
+    levels["PL4"]["EQ_JP"][2] = None        # missing, and PL3 EQ_WI no longer adds up
+    levels["PL4"]["HY_SEK"][0] = -1.0       # negative
+    levels["PL2"]["MM_SEK"][1] += 1.0       # PL2 risk 2 column, and PL2 vs PL3 MM_SEK
+    levels["PL4"]["XX_NEW"] = [0.0] * 7     # listed in PL4 but nowhere in the tree
+    report = validate_levels(pl_dicts, rules_data.tree)
+    got = found(report)
+    assert ("missing", "PL4", "EQ_JP", 2) in got
+    assert ("children sum", "PL3", "EQ_WI", 2) in got
+    assert ("negative", "PL4", "HY_SEK", 0) in got
+    assert ("column sum", "PL2", None, 1) in got
+    assert ("children sum", "PL2", "MM_SEK", 1) in got
+    assert ("no parent", "PL4", "XX_NEW", None) in got
+    assert got == reference(pl_dicts, rules_data.tree)
+    with pytest.raises(ValueError, match="violations"):
+        check_levels(pl_dicts, rules_data.tree)
+
+
+def test_matches_cell_by_cell_reference(rules_data):
+    rnd = random.Random(0)
+    for _ in range(200):
+        pl_dicts = copy.deepcopy([list(x) for x in rules_data.pl_dicts])
+        for _ in range(rnd.randrange(1, 4)):
+            pl = rnd.choice(pl_dicts)[1]
+            cls = rnd.choice(sorted(pl))
+            r = rnd.randrange(7)
+            pl[cls][r] = rnd.choice([None, -0.5, pl[cls][r] + rnd.choice([-1, 0.25, 3]), pl[cls][r] + 1e-9])
+        assert found(validate_levels(pl_dicts, rules_data.tree)) == reference(pl_dicts, rules_data.tree)
@@ -0,0 +1,92 @@
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+# ==============================================================================
+# WATER-FILLING SPLIT OF A CORE FUND'S HEADROOM
+# ==============================================================================
+# Satellites under one core fund share its headroom equally, each capped by its
+# leaf limit; whatever a capped satellite leaves over is shared by the rest.
+# That is a water level: every satellite gets min(leaf_limit, level). Sums are
+# kept as exact integers (limits scaled to a common power-of-two denominator),
+# so the level only depends on which limits are present, never on the order
+# they were added or removed in.
+
+EPSILON = 1e-9  # headroom at or below this is treated as none, as before
+INF = float("inf")
+
+
+def split_sorted(limits: Sequence[float], headroom: float) -> Tuple[float, float]:
+    """(level, total drawn) for limits already in ascending order, in one scan.
+    Gives exactly the same floats as WaterFill.split over the same limits."""
+    if headroom <= EPSILON or not limits:
+        return (0.0 if headroom <= EPSILON else INF), 0.0
+    ratios = [float(l).as_integer_ratio() for l in limits]
+    den = max(d for _, d in ratios)
+    hn, hd = float(headroom).as_integer_ratio()
+    s, n = 0, len(ratios)
+    for i, (num, d) in enumerate(ratios):
+        v = num * (den // d)
+        # Filling everything up to this limit already uses the whole headroom?
+        if (s + v + (n - i - 1) * v) * hd >= hn * den:
+            level = (headroom - s / den) / (n - i)
+            return level, s / den + (n - i) * level
+        s += v
+    return INF, s / den
+
+
+class WaterFill:
+    """
+    Incremental water level over a fixed universe of possible limit values.
+    Two Fenwick trees hold the count and the exact scaled sum of the limits at
+    or below each value, so add, remove and split() are all O(log U).
+    """
+
+    def __init__(self, universe: Iterable[float]):
+        self.values: List[float] = sorted(set(float(v) for v in universe))
+        ratios = [v.as_integer_ratio() for v in self.values]
+        self.den = max((d for _, d in ratios), default=1)
+        self.scaled = [n * (self.den // d) for n, d in ratios]
+        self.pos: Dict[float, int] = {v: i + 1 for i, v in enumerate(self.values)}
+        self._cnt = [0] * (len(self.values) + 1)
+        self._sum = [0] * (len(self.values) + 1)
+        self.count = 0
+        self.total = 0  # scaled sum of all limits
+
+    def _update(self, limit: float, k: int):
+        i = self.pos.get(float(limit))
+        if i is None:
+            raise KeyError(f"Limit {limit} is outside this group's universe.")
+        v = self.scaled[i - 1]
+        self.count += k
+        self.total += k * v
+        while i < len(self._cnt):
+            self._cnt[i] += k
+            self._sum[i] += k * v
+            i += i & -i
+
+    def add(self, limit: float):
+        self._update(limit, 1)
+
+    def remove(self, limit: float):
+        self._update(limit, -1)
+
+    def split(self, headroom: float) -> Tuple[float, float]:
+        """(level, total drawn): each satellite gets min(limit, level)."""
+        if headroom <= EPSILON or self.count == 0:
+            return (0.0 if headroom <= EPSILON else INF), 0.0
+        hn, hd = float(headroom).as_integer_ratio()
+        # Descend to the last value where filling every limit up to it still
+        # leaves headroom over; the level lies above it, shared by the rest.
+        pos, cnt, s = 0, 0, 0
+        step = 1 << (len(self._cnt) - 1).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(self._cnt):
+                c, t = cnt + self._cnt[nxt], s + self._sum[nxt]
+                if (t + (self.count - c) * self.scaled[nxt - 1]) * hd < hn * self.den:
+                    pos, cnt, s = nxt, c, t
+            step >>= 1
+        if cnt == self.count:
+            return INF, self.total / self.den
+        above = self.count - cnt
+        level = (headroom - s / self.den) / above
+        return level, s / self.den + above * level